@@ -3,10 +3,13 @@ import logging
 
 import uuid
 from flask_cors import CORS
-from flask import Flask, Response, request
+from itertools import chain
+from flask import Flask, Response, request, stream_with_context
 
 from utils import rest_utils
 from middleware.notification import notify_sns
+import middleware.context as context
+from database_services import schema
 from application_services.FriendsResource.friends_service import FriendsResource
 
 
@@ -17,28 +20,68 @@ logger.setLevel(logging.INFO)
 application = Flask(__name__)
 CORS(application)
 
+rest_utils.check_cursor_secret()
+
+@application.before_first_request
+def bootstrap_schema():
+    """
+    Creates the user_id constraint and relationship indexes before the first request is served, rather than on
+    import, so tests and tools can import the module without a database. Safe to run on every start.
+    """
+    try:
+        schema.bootstrap(context.get_db_resource())
+    except Exception as e:
+        logger.error("Schema bootstrap, e = {}".format(e))
+
+@application.cli.command("bootstrap-schema")
+def bootstrap_schema_command():
+    """
+    Applies the schema migrations ahead of a deploy: FLASK_APP=application flask bootstrap-schema
+    """
+    bootstrap_schema()
+
 @application.route('/friends/<user>', methods=["GET"])
 def get_friends(user):
     try:
         user = str(user)
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("get_friends", inputs)
 
+        # Answered from the version alone when the client's copy is current
+        version = FriendsResource.get_version(user)
+        etag = rest_utils.make_etag(version)
+        if rest_utils.etag_matches(inputs.headers, etag):
+            return Response(status=304, headers={"ETag": etag})
+
         wc, lim, offs, links = FriendsResource.get_links(inputs)
+        fields, order_by = FriendsResource.get_projection(inputs)
+
+        if inputs.cursor is not None:
+            # Keyset pagination, links carry signed cursors
+            cursor = FriendsResource.get_cursor(inputs)
+            friend_list = FriendsResource.get_friends(user, lim, None, wc, cursor=cursor, version=version,
+                                                      fields=fields, order_by=order_by)
+            links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+        else:
+            friend_list = FriendsResource.get_friends(user, lim, offs, wc, version=version, fields=fields,
+                                                      order_by=order_by)
+
+            # remove next if empty friend_list or result less than limit
+            if not friend_list or len(friend_list)<int(lim):
+                links = links[:-1]
 
-        friend_list = FriendsResource.get_friends(user, lim, offs, wc)
-        
         res = {}
         res['friend_list'] = friend_list
-        
+
         # links
         res['links'] = links
 
-        # remove next if empty friend_list or result less than limit
-        if not friend_list or len(friend_list)<int(lim):
-            res['links'] = res['links'][:-1]
-        
         rsp = Response(json.dumps(res), status=200, content_type="application/json")
+        if etag is not None:
+            rsp.headers["ETag"] = etag
+    except ValueError as e:
+        logger.error("/friends/<user>, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
     except Exception as e:
         # HTTP status code.
         logger.error("/friends/<user>, e = {}".format(e))
@@ -52,24 +95,44 @@ def get_pending_friends(user):
     try:
         user = str(user)
         # res = FriendsResource.get_pending_friends(user)
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("get_pending_friends", inputs)
 
+        # Answered from the version alone when the client's copy is current
+        version = FriendsResource.get_version(user)
+        etag = rest_utils.make_etag(version)
+        if rest_utils.etag_matches(inputs.headers, etag):
+            return Response(status=304, headers={"ETag": etag})
+
         wc, lim, offs, links = FriendsResource.get_links(inputs)
+        fields, order_by = FriendsResource.get_projection(inputs)
+
+        if inputs.cursor is not None:
+            # Keyset pagination, links carry signed cursors
+            cursor = FriendsResource.get_cursor(inputs)
+            friend_list = FriendsResource.get_pending_friends(user, lim, None, wc, cursor=cursor, version=version,
+                                                              fields=fields, order_by=order_by)
+            links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+        else:
+            friend_list = FriendsResource.get_pending_friends(user, lim, offs, wc, version=version, fields=fields,
+                                                              order_by=order_by)
+
+            # remove next if empty friend_list or result less than limit
+            if not friend_list or len(friend_list)<int(lim):
+                links = links[:-1]
 
-        friend_list = FriendsResource.get_pending_friends(user, lim, offs, wc)
-        
         res = {}
         res['friend_list'] = friend_list
 
         # links
         res['links'] = links
 
-        # remove next if empty friend_list or result less than limit
-        if not friend_list or len(friend_list)<int(lim):
-            res['links'] = res['links'][:-1]
-
         rsp = Response(json.dumps(res), status=200, content_type="application/json")
+        if etag is not None:
+            rsp.headers["ETag"] = etag
+    except ValueError as e:
+        logger.error("/friends/<user>/pending, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
     except Exception as e:
         # HTTP status code.
         logger.error("/friends/<user>/pending, e = {}".format(e))
@@ -83,24 +146,44 @@ def get_pending_friends_request(user):
     try:
         user = str(user)
         # res = FriendsResource.get_pending_friends_request(user)
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("get_pending_friends_request", inputs)
 
+        # Answered from the version alone when the client's copy is current
+        version = FriendsResource.get_version(user)
+        etag = rest_utils.make_etag(version)
+        if rest_utils.etag_matches(inputs.headers, etag):
+            return Response(status=304, headers={"ETag": etag})
+
         wc, lim, offs, links = FriendsResource.get_links(inputs)
+        fields, order_by = FriendsResource.get_projection(inputs)
+
+        if inputs.cursor is not None:
+            # Keyset pagination, links carry signed cursors
+            cursor = FriendsResource.get_cursor(inputs)
+            friend_list = FriendsResource.get_pending_friends_request(user, lim, None, wc, cursor=cursor,
+                                                                      version=version, fields=fields, order_by=order_by)
+            links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+        else:
+            friend_list = FriendsResource.get_pending_friends_request(user, lim, offs, wc, version=version,
+                                                                      fields=fields, order_by=order_by)
+
+            # remove next if empty friend_list or result less than limit
+            if not friend_list or len(friend_list)<int(lim):
+                links = links[:-1]
 
-        friend_list = FriendsResource.get_pending_friends_request(user, lim, offs, wc)
-        
         res = {}
         res['friend_list'] = friend_list
 
         # links
         res['links'] = links
 
-        # remove next if empty friend_list or result less than limit
-        if not friend_list or len(friend_list)<int(lim):
-            res['links'] = res['links'][:-1]
-
         rsp = Response(json.dumps(res), status=200, content_type="application/json")
+        if etag is not None:
+            rsp.headers["ETag"] = etag
+    except ValueError as e:
+        logger.error("/friends/<user>/pending_request, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
     except Exception as e:
         # HTTP status code.
         logger.error("/friends/<user>/pending_request, e = {}".format(e))
@@ -108,10 +191,161 @@ def get_pending_friends_request(user):
 
     return rsp
 
+# First page of friends for each of the posted user ids; ?counts=true adds each user's number of friends
+@application.route('/friends/batch', methods=["POST"])
+def get_friends_batch():
+    try:
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("get_friends_batch", inputs)
+
+        wc, lim, offs, links = FriendsResource.get_links(inputs)
+        users = rest_utils.iter_ids(inputs.data, "user_id")
+        counts = str(inputs.args.get("counts", "false")).lower() == "true"
+
+        res = {}
+        res['friends'] = FriendsResource.get_friends_batch(users, lim, counts=counts)
+        for user, page in res['friends'].items():
+            # Same links as the first cursor page of /friends/<user>
+            page['links'] = FriendsResource.get_first_page_links(f'/friends/{user}', page['friend_list'], lim)
+
+        rsp = Response(json.dumps(res), status=200, content_type="application/json")
+    except (ValueError, KeyError) as e:
+        logger.error("/friends/batch, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/batch, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
+# Friends the two users have in common, with their number
+@application.route('/friends/<user>/mutual/<other>', methods=["GET"])
+def get_mutual_friends(user, other):
+    try:
+        user = str(user)
+        other = str(other)
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("get_mutual_friends", inputs)
+
+        # The pair's mutual friends only change when one of their friend lists does
+        versions = (FriendsResource.get_version(user), FriendsResource.get_version(other))
+        etag = rest_utils.make_etag(*versions)
+        if rest_utils.etag_matches(inputs.headers, etag):
+            return Response(status=304, headers={"ETag": etag})
+
+        wc, lim, offs, links = FriendsResource.get_links(inputs)
+
+        if inputs.cursor is not None:
+            # Keyset pagination, links carry signed cursors
+            cursor = FriendsResource.get_cursor(inputs)
+            count, friend_list = FriendsResource.get_mutual_friends(user, other, lim, None, wc, cursor=cursor,
+                                                                    versions=versions)
+            links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+        else:
+            count, friend_list = FriendsResource.get_mutual_friends(user, other, lim, offs, wc, versions=versions)
+
+            # remove next if empty friend_list or result less than limit
+            if not friend_list or len(friend_list)<int(lim):
+                links = links[:-1]
+
+        res = {}
+        res['count'] = count
+        res['friend_list'] = friend_list
+
+        # links
+        res['links'] = links
+
+        rsp = Response(json.dumps(res), status=200, content_type="application/json")
+        if etag is not None:
+            rsp.headers["ETag"] = etag
+    except ValueError as e:
+        logger.error("/friends/<user>/mutual/<other>, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/<user>/mutual/<other>, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
+# People you may know, ranked by mutual friends
+@application.route('/friends/<user>/suggestions', methods=["GET"])
+def get_suggestions(user):
+    try:
+        user = str(user)
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("get_suggestions", inputs)
+
+        res = {}
+        res['suggestions'] = FriendsResource.get_suggestions(user, inputs.limit or 10)
+
+        rsp = Response(json.dumps(res), status=200, content_type="application/json")
+    except ValueError as e:
+        logger.error("/friends/<user>/suggestions, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/<user>/suggestions, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
+# Relationship of the user with each of the posted user ids
+@application.route('/friends/<user>/status', methods=["POST"])
+def get_relationship_status(user):
+    try:
+        user = str(user)
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("get_relationship_status", inputs)
+
+        others = rest_utils.iter_ids(inputs.data, "user_id")
+        res = {}
+        res['status'] = FriendsResource.get_relationship_status(user, others)
+
+        rsp = Response(json.dumps(res), status=200, content_type="application/json")
+    except (ValueError, KeyError) as e:
+        logger.error("/friends/<user>/status, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/<user>/status, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
+# Friend and pending request counts, read from counters kept up to date by every write
+@application.route('/friends/<user>/count', methods=["GET"])
+def get_friend_count(user):
+    try:
+        user = str(user)
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("get_friend_count", inputs)
+
+        etag = rest_utils.make_etag(FriendsResource.get_version(user))
+        if rest_utils.etag_matches(inputs.headers, etag):
+            return Response(status=304, headers={"ETag": etag})
+
+        res = FriendsResource.get_friend_count(user)
+        if res is None:
+            rsp = Response("NOT FOUND", status=404, content_type="text/plain")
+        else:
+            rsp = Response(json.dumps(res), status=200, content_type="application/json",
+                           headers={"ETag": etag})
+    except ValueError as e:
+        logger.error("/friends/<user>/count, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/<user>/count, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
 @application.route('/friends/<user>/accept', methods=["POST"])
 def accept_friend_request(user):
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("accept_friend_request", inputs)
         user = str(user)
 
@@ -132,7 +366,7 @@ def accept_friend_request(user):
 @application.route('/friends/<user>/decline', methods=["DELETE"])
 def decline_friend_request(user):
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("decline_friend_request", inputs)
         user = str(user)
 
@@ -153,7 +387,7 @@ def decline_friend_request(user):
 @application.route('/friends/<user>/add', methods=["POST"])
 def add_friend_request(user):
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("add_friend_request", inputs)
         user = str(user)
 
@@ -174,7 +408,7 @@ def add_friend_request(user):
 @application.route('/friends/<user>/cancel', methods=["DELETE"])
 def cancel_friend_request(user):
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("cancel_friend_request", inputs)
         user = str(user)
 
@@ -195,7 +429,7 @@ def cancel_friend_request(user):
 @application.route('/friends/<user>/delete', methods=["DELETE"])
 def delete_friend(user):
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("delete_friend", inputs)
         user = str(user)
 
@@ -216,7 +450,7 @@ def delete_friend(user):
 @application.route('/friends/insert', methods=["POST"])
 def insert_user():
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("insert_user", inputs)
 
         if inputs.method == "POST":
@@ -235,10 +469,39 @@ def insert_user():
 
     return rsp
 
+# Body is a JSON array of user ids (or {"user_id": ...} objects), or NDJSON with one per line
+@application.route('/friends/insert/bulk', methods=["POST"])
+def insert_users():
+    try:
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("insert_users", inputs)
+
+        if inputs.method == "POST":
+            if request.mimetype == "application/x-ndjson":
+                # Lines are read off the socket as the import consumes them
+                users = rest_utils.iter_ndjson(request.stream)
+            else:
+                users = inputs.data
+            users = rest_utils.iter_ids(users, "user_id")
+            res = FriendsResource.insert_users(users, batch_size=inputs.args.get("batch_size"))
+            # Response 201 for POST -- CREATED. 400 with what was committed before a bad record.
+            rsp = Response(json.dumps(res), status=400 if "error" in res else 201, content_type="application/json")
+        else:
+            rsp = Response("NOT IMPLEMENTED", status=501)
+    except (ValueError, KeyError) as e:
+        logger.error("/friends/insert/bulk, e = {}".format(e))
+        rsp = Response("BAD REQUEST", status=400, content_type="text/plain")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/friends/insert/bulk, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
 @application.route('/friends/delete', methods=["DELETE"])
 def delete_user():
     try:
-        inputs = rest_utils.RESTContext(request)
+        inputs = rest_utils.get_context(request)
         rest_utils.log_request("delete_user", inputs)
 
         if inputs.method == "DELETE":
@@ -255,6 +518,49 @@ def delete_user():
 
     return rsp
 
+# Streams every user and relationship as NDJSON; ?gzip=true compresses the stream
+@application.route('/export/friends', methods=["GET"])
+def export_graph():
+    try:
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("export_graph", inputs)
+
+        records = FriendsResource.export_graph()
+        # Pull the first record now so a DB failure is still reported as a 500
+        first = next(records, None)
+        if first is not None:
+            records = chain([first], records)
+
+        body = rest_utils.to_ndjson(records)
+        headers = {}
+        if str(inputs.args.get("gzip", "false")).lower() == "true":
+            body = rest_utils.to_gzip(body)
+            headers["Content-Encoding"] = "gzip"
+
+        rsp = Response(stream_with_context(body), status=200, content_type="application/x-ndjson", headers=headers)
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/export/friends, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
+# Hit and miss counts of the friend list, mutual friend and status caches of this instance
+@application.route('/stats/cache', methods=["GET"])
+def cache_stats():
+    try:
+        inputs = rest_utils.get_context(request)
+        rest_utils.log_request("cache_stats", inputs)
+
+        res = FriendsResource.cache_stats()
+        rsp = Response(json.dumps(res), status=200, content_type="application/json")
+    except Exception as e:
+        # HTTP status code.
+        logger.error("/stats/cache, e = {}".format(e))
+        rsp = Response("INTERNAL ERROR", status=500, content_type="text/plain")
+
+    return rsp
+
 @application.after_request
 def after_request(response):
     notify_sns(request)
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from database_services.Neo4JDataResource import Neo4JDataResource
+from utils import rest_utils
 
 class BaseApplicationException(Exception):
 
@@ -19,7 +20,7 @@ class BaseApplicationResource(ABC):
 
     @classmethod
     @abstractmethod
-    def get_links(self, resource_data):
+    def get_links(cls, resource_data):
         # Where clause only supported in get friends
         wc = resource_data.args
 
@@ -29,14 +30,8 @@ class BaseApplicationResource(ABC):
         if not resource_data.limit or (int(lim) > resource_data._default_limit):
             lim = resource_data._default_limit
         
-        parent_path = f"{resource_data.path}?"
+        parent_path = cls._get_parent_path(resource_data)
 
-        if wc: 
-            cols = list(wc.keys())
-            wc_terms = [c + f"={wc[c]}" for c in cols]
-            parsed_wc = ",".join(wc_terms)
-            parent_path += f"{parsed_wc}&"
-        
         links = []
         if offs:
             self_href = f'{parent_path}limit={lim}&offset={offs}'
@@ -57,6 +52,68 @@ class BaseApplicationResource(ABC):
         return wc, lim, offs, links
 
 
+    @classmethod
+    def get_projection(cls, resource_data):
+        # fields=a,b and order_by=-timestamp,user_id as lists, None when not given
+        fields = [f.strip() for f in resource_data.fields.split(",") if f.strip()] if resource_data.fields else None
+        order_by = [o.strip() for o in resource_data.order_by.split(",") if o.strip()] if resource_data.order_by \
+            else None
+        return fields or None, order_by or None
+
+    @classmethod
+    def _get_parent_path(cls, resource_data):
+        wc = resource_data.args
+        parent_path = f"{resource_data.path}?"
+
+        if wc: 
+            cols = list(wc.keys())
+            wc_terms = [c + f"={wc[c]}" for c in cols]
+            parsed_wc = ",".join(wc_terms)
+            parent_path += f"{parsed_wc}&"
+
+        # Keep the projection and order on every page
+        if resource_data.fields:
+            parent_path += f"fields={resource_data.fields}&"
+        if resource_data.order_by:
+            parent_path += f"order_by={resource_data.order_by}&"
+
+        return parent_path
+
+    @classmethod
+    def get_cursor(cls, resource_data):
+        # Raises ValueError for a token that was not issued by this service
+        return rest_utils.decode_cursor(resource_data.cursor)
+
+    @classmethod
+    def get_cursor_links(cls, resource_data, cursor, result, lim, key="user_id"):
+        # Keyset pagination links. prev/next carry signed cursors built from the first/last key on the page.
+        parent_path = cls._get_parent_path(resource_data)
+
+        # A page fetched backwards that came back short is the first page
+        has_prev = bool(result) and ("after" in cursor or ("before" in cursor and len(result) >= int(lim)))
+        has_next = bool(result) and ("before" in cursor or len(result) >= int(lim))
+
+        links = []
+        if has_prev:
+            prev_cursor = rest_utils.encode_cursor({"before": result[0][key]})
+            links.append({'rel': 'prev', 'href': f'{parent_path}limit={lim}&cursor={prev_cursor}'})
+        links.append({'rel': 'self', 'href': f'{parent_path}limit={lim}&cursor={resource_data.cursor or ""}'})
+        if has_next:
+            next_cursor = rest_utils.encode_cursor({"after": result[-1][key]})
+            links.append({'rel': 'next', 'href': f'{parent_path}limit={lim}&cursor={next_cursor}'})
+
+        return links
+
+    @classmethod
+    def get_first_page_links(cls, path, result, lim, key="user_id"):
+        # Links of the first cursor page of path, for results fetched on the caller's behalf (e.g. in a batch)
+        links = [{'rel': 'self', 'href': f'{path}?limit={lim}&cursor='}]
+        if result and len(result) >= int(lim):
+            next_cursor = rest_utils.encode_cursor({"after": result[-1][key]})
+            links.append({'rel': 'next', 'href': f'{path}?limit={lim}&cursor={next_cursor}'})
+
+        return links
+
     @classmethod
     @abstractmethod
     def get_data_resource_info(self):
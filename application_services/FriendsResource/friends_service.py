@@ -1,42 +1,304 @@
+import os
+import json
+import bisect
+from itertools import islice
+
 from application_services.BaseApplicationResource import BaseApplicationResource
+from utils.cache import create_cache
 
 import middleware.context as context
 
 class FriendsResource(BaseApplicationResource):
 
+    # Users per UNWIND statement for bulk inserts, and the largest batch a caller may ask for
+    _bulk_batch_size = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+    _max_bulk_batch_size = 10000
+
+    # Users per batch friend list request
+    _max_batch_users = 100
+
+    # Relationship statuses per viewer: ids per request, and statuses kept per viewer
+    _max_status_users = 200
+    _max_status_cached = 2000
+    _status_cache = create_cache("status", max_size=int(os.environ.get("STATUS_CACHE_SIZE", 10000)),
+                                 ttl=float(os.environ.get("STATUS_CACHE_TTL", 60)), url=os.environ.get("CACHE_URL"))
+
+    # Suggestions returned at most, and friends of each friend considered when scoring them
+    _max_suggestions = 50
+    _suggestion_fanout = int(os.environ.get("SUGGESTION_FANOUT", 100))
+
+    # Mutual friend lists per pair of users, dropped when either user's friendships change
+    _mutual_cache = create_cache("mutual", max_size=int(os.environ.get("MUTUAL_CACHE_SIZE", 10000)),
+                                 ttl=float(os.environ.get("MUTUAL_CACHE_TTL", 60)), url=os.environ.get("CACHE_URL"))
+
+    # Pages of friend and pending lists, tagged "<user id>:<list>" and dropped when that list changes, and each
+    # user's relationship version, tagged "<user id>:version" and dropped on any change touching the user.
+    # In process by default; CACHE_URL=redis://... shares every cache between instances.
+    _list_cache = create_cache("lists", max_size=int(os.environ.get("LIST_CACHE_SIZE", 10000)),
+                               ttl=float(os.environ.get("LIST_CACHE_TTL", 60)), url=os.environ.get("CACHE_URL"))
+
     def __init__(self):
         super().__init__()
 
     @classmethod
-    def get_friends(cls, user, limit=10, offset=None, whereclause={}):
+    def get_friends(cls, user, limit=10, offset=None, whereclause={}, cursor=None, version=None, fields=None,
+                    order_by=None):
         db_resource = context.get_db_resource()
         template = {
             'label': "user",
-            'template': {"user_id": "'{}'".format(user)},
+            'template': {"user_id": user},
         }
-        res = db_resource.find_by_node_relationship_outward(template, relationship="FRIEND", limit=limit, offset=offset, whereclause=whereclause)
-        return res
+        fetch = lambda: db_resource.find_by_node_relationship_outward(template, relationship="FRIEND", limit=limit, offset=offset, whereclause=whereclause, cursor=cursor, fields=fields, order_by=order_by)
+        return cls._cached_list(user, "friends", fetch, limit, offset, whereclause, cursor, version, fields, order_by)
 
     @classmethod
-    def get_pending_friends(cls, user, limit=10, offset=None, whereclause={}):
+    def get_pending_friends(cls, user, limit=10, offset=None, whereclause={}, cursor=None, version=None, fields=None,
+                            order_by=None):
         db_resource = context.get_db_resource()
         template = {
             'label': "user",
-            'template': {"user_id": "'{}'".format(user)},
+            'template': {"user_id": user},
         }
-        res = db_resource.find_by_node_relationship_inward(template, relationship="PENDING_FRIEND", limit=limit, offset=offset, whereclause=whereclause)
-        return res
+        fetch = lambda: db_resource.find_by_node_relationship_inward(template, relationship="PENDING_FRIEND", limit=limit, offset=offset, whereclause=whereclause, cursor=cursor, fields=fields, order_by=order_by)
+        return cls._cached_list(user, "pending", fetch, limit, offset, whereclause, cursor, version, fields, order_by)
 
     @classmethod
-    def get_pending_friends_request(cls, user, limit=10, offset=None, whereclause={}):
+    def get_pending_friends_request(cls, user, limit=10, offset=None, whereclause={}, cursor=None, version=None,
+                                    fields=None, order_by=None):
         db_resource = context.get_db_resource()
         template = {
             "label": "user",
-            'template': {"user_id": "'{}'".format(user)},
+            'template': {"user_id": user},
         }
-        res = db_resource.find_by_node_relationship_outward(template, relationship="PENDING_FRIEND", limit=limit, offset=offset, whereclause=whereclause)
+        fetch = lambda: db_resource.find_by_node_relationship_outward(template, relationship="PENDING_FRIEND", limit=limit, offset=offset, whereclause=whereclause, cursor=cursor, fields=fields, order_by=order_by)
+        return cls._cached_list(user, "pending_request", fetch, limit, offset, whereclause, cursor, version, fields,
+                                order_by)
+
+    @classmethod
+    def _cached_list(cls, user, name, fetch, limit, offset, whereclause, cursor, version=None, fields=None,
+                     order_by=None):
+        """
+        Read-through lookup of one page of a user's list.
+
+        :param name: "friends", "pending" or "pending_request".
+        :param fetch: Function reading the page from the database on a miss.
+        :param version: The user's relationship version, if the caller read it. Part of the key, so a page
+            cached before a change made through another instance is not served under the new version.
+        :return: List of user dictionaries, copies the caller may change.
+        """
+        key = json.dumps([user, name, str(limit), str(offset or ""), whereclause or {}, cursor, version,
+                          sorted(fields) if fields else None, order_by], sort_keys=True)
+        res = cls._list_cache.get(key)
+        if res is None:
+            res = fetch()
+            cls._list_cache.set(key, res, tags=("{}:{}".format(user, name),))
+        return [dict(m) for m in res]
+
+    @classmethod
+    def get_version(cls, user):
+        """
+
+        Read through the list cache, so a conditional GET or a cached page costs no database round trip. Changes
+        made here drop it. A change made through another instance is seen once the entry expires, after
+        LIST_CACHE_TTL seconds, unless CACHE_URL shares the cache and with it the invalidations.
+
+        :return: The user's relationship version, incremented by every change to their friends or requests. None
+            if the user does not exist.
+        """
+        key = "version:{}".format(user)
+        version = cls._list_cache.get(key)
+        if version is None:
+            db_resource = context.get_db_resource()
+            template = {
+                "label": "user",
+                "template": {"user_id": user},
+            }
+            version = db_resource.get_version(template)
+            if version is not None:
+                cls._list_cache.set(key, version, tags=("{}:version".format(user),))
+        return version
+
+    @classmethod
+    def cache_stats(cls):
+        """
+
+        :return: Hit, miss and invalidation counts of each cache.
+        """
+        return {
+            "lists": cls._list_cache.stats(),
+            "mutual": cls._mutual_cache.stats(),
+            "status": cls._status_cache.stats(),
+        }
+
+    @classmethod
+    def get_friends_batch(cls, users, limit=10, counts=False):
+        """
+        First page of get_friends, in cursor order, for each of users with one query.
+
+        :param users: Iterable of user ids, at most _max_batch_users.
+        :param counts: Add each user's number of friends, read from the degree counters.
+        :return: Dictionary of {user id: {"friend_list": [...], "count": number of friends}}. Unknown users get
+            an empty list.
+        """
+        users = [str(u) for u in dict.fromkeys(users)]
+        if len(users) > cls._max_batch_users:
+            raise ValueError("At most {} user ids per request".format(cls._max_batch_users))
+        db_resource = context.get_db_resource()
+        found = db_resource.find_first_by_nodes_relationship(label="user", key="user_id", values=users,
+                                                             relationship="FRIEND", limit=limit) if users else {}
+        res = {}
+        for user in users:
+            page = found.get(user, {"nodes": [], "count": 0})
+            res[user] = {"friend_list": page["nodes"]}
+            if counts:
+                res[user]["count"] = page["count"]
         return res
 
+    @classmethod
+    def get_mutual_friends(cls, user, other, limit=10, offset=None, whereclause={}, cursor=None, versions=None):
+        """
+        The full mutual list of the pair is computed once and cached; pages are cut from it.
+
+        :param versions: Relationship versions of user and other, if the caller read them. Part of the key.
+        :return: Tuple of (number of mutual friends matching whereclause, list of them on the requested page).
+        """
+        # Symmetric, so both orders share one entry
+        pair = sorted((user, other))
+        if versions is not None:
+            versions = list(versions) if pair[0] == user else list(reversed(versions))
+        key = json.dumps([pair, versions])
+        mutual = cls._mutual_cache.get(key)
+        if mutual is None:
+            db_resource = context.get_db_resource()
+            mutual = db_resource.find_by_node_relationship_mutual({"label": "user", "template": {"user_id": pair[0]}},
+                                                                  {"label": "user", "template": {"user_id": pair[1]}},
+                                                                  relationship="FRIEND")
+            cls._mutual_cache.set(key, mutual, tags=pair)
+
+        if whereclause:
+            mutual = [m for m in mutual if all(m.get(k) == v for k, v in whereclause.items())]
+
+        limit = int(limit)
+        if cursor is None:
+            start = int(offset) if offset else 0
+            page = mutual[start:start + limit]
+        else:
+            # Same keyset semantics as the friend lists, on the list sorted by user_id
+            keys = [m["user_id"] for m in mutual]
+            if "after" in cursor:
+                start = bisect.bisect_right(keys, cursor["after"])
+                page = mutual[start:start + limit]
+            elif "before" in cursor:
+                end = bisect.bisect_left(keys, cursor["before"])
+                page = mutual[max(0, end - limit):end]
+            else:
+                page = mutual[:limit]
+
+        return len(mutual), [dict(m) for m in page]
+
+    @classmethod
+    def get_suggestions(cls, user, limit=10):
+        """
+        People the user may know: friends of friends, scored by the number of mutual friends. Existing friends
+        and pending requests in either direction are left out.
+
+        :return: List of user dictionaries with a "mutual" count, best first.
+        """
+        limit = int(limit)
+        if limit < 1 or limit > cls._max_suggestions:
+            raise ValueError("limit must be between 1 and {}".format(cls._max_suggestions))
+        db_resource = context.get_db_resource()
+        template = {
+            "label": "user",
+            "template": {"user_id": user},
+        }
+        res = db_resource.find_two_hop_by_node_relationship(template, relationship="FRIEND", exclude=["PENDING_FRIEND"],
+                                                            limit=limit, fanout=cls._suggestion_fanout)
+        suggestions = []
+        for node, mutual in res:
+            node["mutual"] = mutual
+            suggestions.append(node)
+        return suggestions
+
+    @classmethod
+    def get_relationship_status(cls, user, others):
+        """
+        Statuses are cached per viewer, so repeated lookups only query the users not seen yet.
+
+        :param others: Iterable of user ids, at most _max_status_users.
+        :return: Dictionary of {user id: "friend", "pending_in", "pending_out" or "none"}. pending_in is a
+            request from the other user to user.
+        """
+        others = [str(o) for o in dict.fromkeys(others)]
+        if len(others) > cls._max_status_users:
+            raise ValueError("At most {} user ids per request".format(cls._max_status_users))
+
+        cached = cls._status_cache.get(user) or {}
+        missing = [o for o in others if o not in cached]
+        if missing:
+            db_resource = context.get_db_resource()
+            template = {
+                "label": "user",
+                "template": {"user_id": user},
+            }
+            found = db_resource.find_relationships_between(template, key="user_id", values=missing,
+                                                           relationships=["FRIEND", "PENDING_FRIEND"])
+            # Copy, other requests may be reading the cached dictionary
+            cached = dict(cached) if len(cached) + len(missing) <= cls._max_status_cached else {}
+            for other in missing:
+                cached[other] = cls._status(found.get(other, ()))
+            cls._status_cache.set(user, cached, tags=(user,))
+
+        return {o: cached[o] for o in others}
+
+    @classmethod
+    def _status(cls, relationships):
+        relationships = set(relationships)
+        if ("FRIEND", "outward") in relationships:
+            return "friend"
+        if ("PENDING_FRIEND", "inward") in relationships:
+            return "pending_in"
+        if ("PENDING_FRIEND", "outward") in relationships:
+            return "pending_out"
+        return "none"
+
+    @classmethod
+    def _relationships_changed(cls, user, friend, lists):
+        """
+        Drops what is cached about the relationship between user and friend.
+
+        :param lists: (user id, list name) pairs of the lists the change affects.
+        """
+        for u in (user, friend):
+            cls._status_cache.invalidate(u)
+            cls._list_cache.invalidate("{}:version".format(u))
+        for u, name in lists:
+            cls._list_cache.invalidate("{}:{}".format(u, name))
+            if name == "friends":
+                cls._mutual_cache.invalidate(u)
+
+    @classmethod
+    def get_friend_count(cls, user):
+        """
+
+        :return: {"user_id", "friends", "pending_in", "pending_out"} from the user's degree counters, None if the
+            user does not exist.
+        """
+        db_resource = context.get_db_resource()
+        template = {
+            "label": "user",
+            "template": {"user_id": user},
+        }
+        degrees = db_resource.get_degrees(template)
+        if degrees is None:
+            return None
+        return {
+            "user_id": user,
+            "friends": degrees["FRIEND"]["outward"],
+            "pending_in": degrees["PENDING_FRIEND"]["inward"],
+            "pending_out": degrees["PENDING_FRIEND"]["outward"],
+        }
+
     @classmethod
     def accept_friend_request(cls, user, friend):
         db_resource = context.get_db_resource()
@@ -48,12 +310,10 @@ class FriendsResource(BaseApplicationResource):
             "label": "user",
             "template": {"user_id": friend},
         }
-        # Bidirectional
-        db_resource.create_relationship(user_template, friend_template, relationship="FRIEND")
-        db_resource.create_relationship(friend_template, user_template, relationship="FRIEND")
-
-        # Delete pending request
-        db_resource.delete_relationship(friend_template, user_template, relationship="PENDING_FRIEND")
+        # Bidirectional FRIEND and removal of the pending request, in one transaction
+        db_resource.accept_relationship(user_template, friend_template, pending="PENDING_FRIEND", relationship="FRIEND")
+        cls._relationships_changed(user, friend, [(user, "friends"), (friend, "friends"),
+                                                  (user, "pending"), (friend, "pending_request")])
         return True
 
     @classmethod
@@ -69,6 +329,7 @@ class FriendsResource(BaseApplicationResource):
         }
         # Delete pending request
         db_resource.delete_relationship(friend_template, user_template, relationship="PENDING_FRIEND")
+        cls._relationships_changed(user, friend, [(user, "pending"), (friend, "pending_request")])
         return True
 
     @classmethod
@@ -83,6 +344,7 @@ class FriendsResource(BaseApplicationResource):
             "template": {"user_id": friend},
         }
         res = db_resource.create_relationship(user_template, friend_template, relationship="PENDING_FRIEND")
+        cls._relationships_changed(user, friend, [(user, "pending_request"), (friend, "pending")])
         return res
 
     @classmethod
@@ -98,6 +360,7 @@ class FriendsResource(BaseApplicationResource):
         }
         # Delete pending request
         db_resource.delete_relationship(user_template, friend_template, relationship="PENDING_FRIEND")
+        cls._relationships_changed(user, friend, [(user, "pending_request"), (friend, "pending")])
         return True
 
     @classmethod
@@ -111,9 +374,9 @@ class FriendsResource(BaseApplicationResource):
             "label": "user",
             "template": {"user_id": friend},
         }
-        # Delete friend bidirectional
-        db_resource.delete_relationship(user_template, friend_template, relationship="FRIEND")
-        db_resource.delete_relationship(friend_template, user_template, relationship="FRIEND")
+        # Delete friend bidirectional, in one transaction
+        db_resource.delete_bidirectional_relationship(user_template, friend_template, relationship="FRIEND")
+        cls._relationships_changed(user, friend, [(user, "friends"), (friend, "friends")])
         return True
 
     @classmethod
@@ -125,6 +388,44 @@ class FriendsResource(BaseApplicationResource):
         res = db_resource.create_node(label="user", **template)
         return res
 
+    @classmethod
+    def insert_users(cls, users, batch_size=None):
+        """
+
+        Batches are committed as they are read. If users raises ValueError part way, e.g. on a malformed NDJSON
+        line, the import stops there and the result gets an "error" with the 1-based position of the bad record.
+        Every user before the batch holding it is committed ("received"), none after, so a client can resend from
+        record received + 1.
+
+        :param users: Iterable of user ids, consumed lazily one batch at a time.
+        :param batch_size: Users per write statement, defaults to BULK_BATCH_SIZE.
+        :return: Totals and per-batch counts of created and already existing users.
+        """
+        db_resource = context.get_db_resource()
+        batch_size = min(int(batch_size or cls._bulk_batch_size), cls._max_bulk_batch_size)
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive")
+
+        res = {"received": 0, "created": 0, "existing": 0, "batches": []}
+        users = iter(users)
+        while True:
+            batch = []
+            try:
+                for u in islice(users, batch_size):
+                    batch.append(str(u))
+            except ValueError as e:
+                res["error"] = {"record": res["received"] + len(batch) + 1, "message": str(e)}
+                break
+            if not batch:
+                break
+            created = db_resource.merge_nodes(label="user", key="user_id", values=batch)
+            res["batches"].append({"received": len(batch), "created": created, "existing": len(batch) - created})
+            res["received"] += len(batch)
+            res["created"] += created
+            res["existing"] += len(batch) - created
+
+        return res
+
     @classmethod
     def delete_user(cls, user):
         db_resource = context.get_db_resource()
@@ -133,4 +434,27 @@ class FriendsResource(BaseApplicationResource):
             "template": {"user_id": user},
         }
         res = db_resource.delete_node(user_template)
-        return res
\ No newline at end of file
+        # The user is on the lists of all their friends and in any pair of them. Deleting users is rare, so drop
+        # everything rather than read every relationship first.
+        cls._list_cache.clear()
+        cls._mutual_cache.clear()
+        cls._status_cache.clear()
+        return res
+
+    @classmethod
+    def export_graph(cls):
+        """
+
+        :return: Generator of every user and then every FRIEND and PENDING_FRIEND relationship, as
+            {"type": "user", ...} and {"type": "relationship", ...} dictionaries, read from the database a chunk at a time.
+        """
+        db_resource = context.get_db_resource()
+        for user in db_resource.iter_nodes(label="user"):
+            record = {"type": "user"}
+            record.update(user)
+            yield record
+        for relationship in db_resource.iter_relationships(label="user", key="user_id",
+                                                           relationships=["FRIEND", "PENDING_FRIEND"]):
+            record = {"type": "relationship"}
+            record.update(relationship)
+            yield record
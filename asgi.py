@@ -0,0 +1,386 @@
+"""
+ASGI entry point serving the same routes as application.py, for running under an asyncio server:
+
+    uvicorn asgi:app --workers 1
+
+Request handling never blocks the event loop. Database work (and the SNS publish) is awaited on the worker
+threads of middleware.context.get_async_db_resource(), so one process keeps as many queries in flight as
+DBPOOL_SIZE allows instead of one per sync worker.
+"""
+import re
+import json
+import zlib
+import logging
+from urllib.parse import parse_qs
+
+import middleware.context as context
+from middleware import notification
+from database_services import schema
+from utils import rest_utils
+from application_services.FriendsResource.friends_service import FriendsResource
+
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+rest_utils.check_cursor_secret()
+
+
+class ASGIContext(rest_utils.RESTContext):
+    """
+    RESTContext built from an ASGI scope and body instead of the Flask request.
+    """
+
+    def __init__(self, scope, body, endpoint):
+        self.limit = rest_utils.RESTContext._default_limit
+        self.path = scope["path"]
+        self.endpoint = endpoint
+        self.method = scope["method"]
+        # Headers are needed right away for the host and content type
+        self._headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        self.host_url = "{}://{}/".format(scope.get("scheme", "http"), self._headers.get("host", ""))
+        self.path_parameters = None
+
+        self.body = body
+        self.mimetype = self._headers.get("content-type", "").split(";")[0].strip()
+
+        args = parse_qs(scope.get("query_string", b"").decode("utf-8"), keep_blank_values=True)
+        args = self._de_array_args(args)
+
+        args, self.limit = self._get_and_remove_arg(args, "limit")
+        args, self.offset = self._get_and_remove_arg(args, "offset")
+        args, self.order_by = self._get_and_remove_arg(args, "order_by")
+        args, self.fields = self._get_and_remove_arg(args, "fields")
+        args, self.cursor = self._get_and_remove_arg(args, "cursor")
+        self.args = args
+
+    def _load_data(self):
+        if self.body and self.mimetype == "application/json":
+            try:
+                return json.loads(self.body)
+            except ValueError:
+                pass
+        return None
+
+
+def _json(res, status):
+    return status, json.dumps(res), "application/json", {}
+
+
+def _text(txt, status):
+    return status, txt, "text/plain", {}
+
+
+def _with_etag(result, etag):
+    status, body, content_type, headers = result
+    if etag is not None:
+        headers["etag"] = etag
+    return status, body, content_type, headers
+
+
+async def _list(inputs, user, fetch):
+    db = context.get_async_db_resource()
+
+    # Answered from the version alone when the client's copy is current
+    version = await db.call(FriendsResource.get_version, user)
+    etag = rest_utils.make_etag(version)
+    if rest_utils.etag_matches(inputs.headers, etag):
+        return 304, "", "text/plain", {"etag": etag}
+
+    wc, lim, offs, links = FriendsResource.get_links(inputs)
+    fields, order_by = FriendsResource.get_projection(inputs)
+
+    if inputs.cursor is not None:
+        # Keyset pagination, links carry signed cursors
+        cursor = FriendsResource.get_cursor(inputs)
+        friend_list = await db.call(fetch, user, lim, None, wc, cursor=cursor, version=version, fields=fields,
+                                    order_by=order_by)
+        links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+    else:
+        friend_list = await db.call(fetch, user, lim, offs, wc, version=version, fields=fields, order_by=order_by)
+
+        # remove next if empty friend_list or result less than limit
+        if not friend_list or len(friend_list) < int(lim):
+            links = links[:-1]
+
+    return _with_etag(_json({'friend_list': friend_list, 'links': links}, 200), etag)
+
+
+async def get_friends(inputs, user):
+    return await _list(inputs, user, FriendsResource.get_friends)
+
+
+async def get_pending_friends(inputs, user):
+    return await _list(inputs, user, FriendsResource.get_pending_friends)
+
+
+async def get_pending_friends_request(inputs, user):
+    return await _list(inputs, user, FriendsResource.get_pending_friends_request)
+
+
+async def get_friends_batch(inputs):
+    wc, lim, offs, links = FriendsResource.get_links(inputs)
+    users = rest_utils.iter_ids(inputs.data, "user_id")
+    counts = str(inputs.args.get("counts", "false")).lower() == "true"
+    res = await context.get_async_db_resource().call(FriendsResource.get_friends_batch, users, lim, counts=counts)
+    for user, page in res.items():
+        # Same links as the first cursor page of /friends/<user>
+        page['links'] = FriendsResource.get_first_page_links(f'/friends/{user}', page['friend_list'], lim)
+    return _json({'friends': res}, 200)
+
+
+async def get_mutual_friends(inputs, user, other):
+    db = context.get_async_db_resource()
+
+    # The pair's mutual friends only change when one of their friend lists does
+    versions = (await db.call(FriendsResource.get_version, user), await db.call(FriendsResource.get_version, other))
+    etag = rest_utils.make_etag(*versions)
+    if rest_utils.etag_matches(inputs.headers, etag):
+        return 304, "", "text/plain", {"etag": etag}
+
+    wc, lim, offs, links = FriendsResource.get_links(inputs)
+
+    if inputs.cursor is not None:
+        # Keyset pagination, links carry signed cursors
+        cursor = FriendsResource.get_cursor(inputs)
+        count, friend_list = await db.call(FriendsResource.get_mutual_friends, user, other, lim, None, wc,
+                                           cursor=cursor, versions=versions)
+        links = FriendsResource.get_cursor_links(inputs, cursor, friend_list, lim)
+    else:
+        count, friend_list = await db.call(FriendsResource.get_mutual_friends, user, other, lim, offs, wc,
+                                           versions=versions)
+
+        # remove next if empty friend_list or result less than limit
+        if not friend_list or len(friend_list) < int(lim):
+            links = links[:-1]
+
+    return _with_etag(_json({'count': count, 'friend_list': friend_list, 'links': links}, 200), etag)
+
+
+async def get_suggestions(inputs, user):
+    res = await context.get_async_db_resource().call(FriendsResource.get_suggestions, user, inputs.limit or 10)
+    return _json({'suggestions': res}, 200)
+
+
+async def get_relationship_status(inputs, user):
+    others = rest_utils.iter_ids(inputs.data, "user_id")
+    res = await context.get_async_db_resource().call(FriendsResource.get_relationship_status, user, others)
+    return _json({'status': res}, 200)
+
+
+async def get_friend_count(inputs, user):
+    db = context.get_async_db_resource()
+    etag = rest_utils.make_etag(await db.call(FriendsResource.get_version, user))
+    if rest_utils.etag_matches(inputs.headers, etag):
+        return 304, "", "text/plain", {"etag": etag}
+
+    res = await db.call(FriendsResource.get_friend_count, user)
+    if res is None:
+        return _text("NOT FOUND", 404)
+    return _with_etag(_json(res, 200), etag)
+
+
+def _friend_change(method, status):
+    async def handler(inputs, user):
+        friend = inputs.data["friend_id"]
+        res = await context.get_async_db_resource().call(method, user, friend)
+        return _json(res, status)
+    # The endpoint name is what notification.after_request_dict is keyed on
+    handler.__name__ = method.__name__
+    return handler
+
+
+accept_friend_request = _friend_change(FriendsResource.accept_friend_request, 201)
+decline_friend_request = _friend_change(FriendsResource.decline_friend_request, 204)
+add_friend_request = _friend_change(FriendsResource.add_friend_request, 201)
+cancel_friend_request = _friend_change(FriendsResource.cancel_friend_request, 204)
+delete_friend = _friend_change(FriendsResource.delete_friend, 204)
+
+
+async def insert_user(inputs):
+    user = inputs.data["user_id"]
+    res = await context.get_async_db_resource().call(FriendsResource.insert_user, user)
+    # add url location for reference
+    res['location'] = f'/friends/{res["user_id"]}'
+    return _json(res, 201)
+
+
+async def insert_users(inputs):
+    if inputs.mimetype == "application/x-ndjson":
+        users = rest_utils.iter_ndjson(inputs.body.splitlines())
+    else:
+        users = inputs.data
+    users = rest_utils.iter_ids(users, "user_id")
+    res = await context.get_async_db_resource().call(
+        FriendsResource.insert_users, users, batch_size=inputs.args.get("batch_size"))
+    return _json(res, 400 if "error" in res else 201)
+
+
+async def delete_user(inputs):
+    user = inputs.data["user_id"]
+    res = await context.get_async_db_resource().call(FriendsResource.delete_user, user)
+    return _json(res, 204)
+
+
+async def export_graph(inputs):
+    records = context.get_async_db_resource().stream(FriendsResource.export_graph)
+    # Pull the first record now so a DB failure is still reported as a 500
+    try:
+        first = [await records.__anext__()]
+    except StopAsyncIteration:
+        first = []
+
+    async def body():
+        for record in first:
+            yield json.dumps(record, default=str) + "\n"
+        async for record in records:
+            yield json.dumps(record, default=str) + "\n"
+
+    chunks = body()
+    headers = {}
+    if str(inputs.args.get("gzip", "false")).lower() == "true":
+        chunks = _gzip(chunks)
+        headers["content-encoding"] = "gzip"
+    return 200, chunks, "application/x-ndjson", headers
+
+
+async def cache_stats(inputs):
+    return _json(FriendsResource.cache_stats(), 200)
+
+
+async def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# (method, path pattern, handler). Static paths come before the <user> patterns they would also match.
+routes = [
+    ("POST", r"/friends/insert", insert_user),
+    ("POST", r"/friends/insert/bulk", insert_users),
+    ("DELETE", r"/friends/delete", delete_user),
+    ("POST", r"/friends/batch", get_friends_batch),
+    ("GET", r"/export/friends", export_graph),
+    ("GET", r"/stats/cache", cache_stats),
+    ("GET", r"/friends/(?P<user>[^/]+)", get_friends),
+    ("GET", r"/friends/(?P<user>[^/]+)/pending", get_pending_friends),
+    ("GET", r"/friends/(?P<user>[^/]+)/pending_request", get_pending_friends_request),
+    ("GET", r"/friends/(?P<user>[^/]+)/count", get_friend_count),
+    ("GET", r"/friends/(?P<user>[^/]+)/mutual/(?P<other>[^/]+)", get_mutual_friends),
+    ("GET", r"/friends/(?P<user>[^/]+)/suggestions", get_suggestions),
+    ("POST", r"/friends/(?P<user>[^/]+)/status", get_relationship_status),
+    ("POST", r"/friends/(?P<user>[^/]+)/accept", accept_friend_request),
+    ("DELETE", r"/friends/(?P<user>[^/]+)/decline", decline_friend_request),
+    ("POST", r"/friends/(?P<user>[^/]+)/add", add_friend_request),
+    ("DELETE", r"/friends/(?P<user>[^/]+)/cancel", cancel_friend_request),
+    ("DELETE", r"/friends/(?P<user>[^/]+)/delete", delete_friend),
+]
+_compiled_routes = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in routes]
+
+
+def _match(method, path):
+    """
+
+    :return: (handler, path parameters), or (None, status) with 404 or 405 if nothing matches.
+    """
+    allowed = False
+    for route_method, pattern, handler in _compiled_routes:
+        m = pattern.match(path)
+        if m:
+            if route_method == method:
+                return handler, m.groupdict()
+            allowed = True
+    return None, 405 if allowed else 404
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+async def _send(send, status, body, content_type, headers):
+    raw_headers = [(b"content-type", content_type.encode("latin-1")),
+                   (b"access-control-allow-origin", b"*")]
+    raw_headers += [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+
+    if isinstance(body, (str, bytes)):
+        if status in (204, 304):
+            body = b""
+        await send({"type": "http.response.body", "body": body.encode("utf-8") if isinstance(body, str) else body})
+        return
+
+    async for chunk in body:
+        await send({"type": "http.response.body",
+                    "body": chunk.encode("utf-8") if isinstance(chunk, str) else chunk,
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _notify(inputs, path_parameters):
+    endpoint = inputs.endpoint
+    if endpoint in notification.after_request_dict and inputs.method in notification.after_request_dict[endpoint]:
+        try:
+            await context.get_async_db_resource().call(
+                notification.publish, endpoint, inputs.method, path_parameters["user"], inputs.data["friend_id"])
+        except Exception as e:
+            logger.error("notify_sns, e = {}".format(e))
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                # Create the user_id constraint and relationship indexes before serving. Safe to run on every start.
+                await context.get_async_db_resource().call(schema.bootstrap, context.get_db_resource())
+            except Exception as e:
+                logger.error("Schema bootstrap, e = {}".format(e))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            context.close_db_resource()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await _send(send, 200, b"", "text/plain", {
+            "access-control-allow-methods": "GET, POST, DELETE, OPTIONS",
+            "access-control-allow-headers": "*",
+        })
+
+    handler, path_parameters = _match(method, scope["path"])
+    if handler is None:
+        status = path_parameters
+        return await _send(send, status, "NOT FOUND" if status == 404 else "METHOD NOT ALLOWED", "text/plain", {})
+
+    inputs = ASGIContext(scope, await _read_body(receive), handler.__name__)
+    rest_utils.log_request(handler.__name__, inputs)
+
+    try:
+        status, body, content_type, headers = await handler(inputs, **path_parameters)
+    except ValueError as e:
+        logger.error("{}, e = {}".format(scope["path"], e))
+        status, body, content_type, headers = _text("BAD REQUEST", 400)
+    except Exception as e:
+        # HTTP status code.
+        logger.error("{}, e = {}".format(scope["path"], e))
+        status, body, content_type, headers = _text("INTERNAL ERROR", 500)
+
+    await _send(send, status, body, content_type, headers)
+    await _notify(inputs, path_parameters)
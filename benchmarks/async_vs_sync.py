@@ -0,0 +1,101 @@
+"""
+Throughput of the sync Flask app (application.py) against the ASGI app (asgi.py) on the same database.
+
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 200 --path /friends/<user id>
+
+Both apps are driven in process, without a network server in front, so the numbers compare request handling
+and database concurrency only. The Flask app gets one thread per concurrent client, like a threaded WSGI
+server; the ASGI app runs every client on one event loop.
+"""
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stats import percentile
+
+
+def report(name, latencies, elapsed, errors):
+    print("{:<6} {:>8} req {:>10.1f} req/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  errors {}".format(
+        name, len(latencies), len(latencies) / elapsed if elapsed else 0.0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, errors))
+
+
+def run_sync(path, requests, concurrency):
+    import application
+
+    local = threading.local()
+    errors = [0]
+
+    def one(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = application.application.test_client()
+        start = time.perf_counter()
+        rsp = client.get(path)
+        if rsp.status_code >= 500:
+            errors[0] += 1
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, range(requests)))
+    report("sync", latencies, time.perf_counter() - start, errors[0])
+
+
+async def _asgi_get(app, path):
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+             "headers": [(b"host", b"benchmark")], "scheme": "http"}
+    status = [None]
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def _run_async(path, requests, concurrency):
+    import asgi
+
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = [0]
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            status = await _asgi_get(asgi.app, path)
+            if status >= 500:
+                errors[0] += 1
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[one() for _ in range(requests)])
+    report("async", latencies, time.perf_counter() - start, errors[0])
+
+
+def run_async(path, requests, concurrency):
+    asyncio.run(_run_async(path, requests, concurrency))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the Flask and ASGI apps under concurrent load.")
+    parser.add_argument("--path", default="/friends/benchmark", help="GET path to request")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    run_sync(args.path, args.requests, args.concurrency)
+    run_async(args.path, args.requests, args.concurrency)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Runs the same workload against each storage backend and reports throughput and latency per operation.
+
+    python -m benchmarks.backends --backend memory --backend neo4j --users 10000 --degree 20 --ops 20000
+
+Every backend is seeded with the same random friendship graph, imported with merge_relationships, and then
+driven by --concurrency threads issuing friend list reads, friend requests, accepts and friend deletes in the
+proportions given by --mix. Users are named bench-<n>; pass --cleanup to delete them afterwards.
+"""
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import middleware.context as context
+from benchmarks.stats import percentile
+
+
+def _template(user):
+    return {"label": "user", "template": {"user_id": user}}
+
+
+def _user(n):
+    return "bench-{}".format(n)
+
+
+def seed(db, users, degree, batch_size=5000, rng=None):
+    """
+    Imports users * degree / 2 random FRIEND pairs, so the average user has degree friends.
+
+    :return: Seconds taken.
+    """
+    rng = rng or random.Random(0)
+    start = time.perf_counter()
+    db.merge_nodes(label="user", key="user_id", values=[_user(n) for n in range(users)])
+    pairs = users * degree // 2
+    for i in range(0, pairs, batch_size):
+        rows = []
+        for _ in range(min(batch_size, pairs - i)):
+            a, b = rng.randrange(users), rng.randrange(users)
+            if a != b:
+                rows.append({"a": _user(a), "b": _user(b), "timestamp": "2021-01-01 00:00:00"})
+        db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    return time.perf_counter() - start
+
+
+def _read(db, a, b):
+    db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=10)
+
+
+def _add(db, a, b):
+    db.create_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+
+
+def _accept(db, a, b):
+    db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+
+
+def _delete(db, a, b):
+    db.delete_bidirectional_relationship(_template(a), _template(b), relationship="FRIEND")
+
+
+operations = {
+    "read": _read,
+    "add": _add,
+    "accept": _accept,
+    "delete": _delete,
+}
+
+
+def run_workload(db, users, ops, concurrency, mix, rng_seed=1):
+    """
+
+    :param mix: Dictionary of {operation name: weight}.
+    :return: Tuple of ({operation name: [latency seconds]}, {operation name: errors}, elapsed seconds).
+    """
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        rng = getattr(local, "rng", None)
+        if rng is None:
+            rng = local.rng = random.Random(rng_seed * 1000003 + i)
+        name = rng.choices(names, weights)[0]
+        a, b = _user(rng.randrange(users)), _user(rng.randrange(users))
+        start = time.perf_counter()
+        try:
+            operations[name](db, a, b)
+            error = False
+        except Exception:
+            error = True
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies[name].append(elapsed)
+            if error:
+                errors[name] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(ops)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def report(backend, latencies, errors, elapsed):
+    total = sum(len(v) for v in latencies.values())
+    print("{}: {} ops in {:.2f}s, {:.1f} ops/s".format(backend, total, elapsed, total / elapsed if elapsed else 0.0))
+    for name in operations:
+        values = latencies.get(name, [])
+        if not values:
+            continue
+        print("  {:<7} {:>8} ops  p50 {:>8.3f} ms  p99 {:>8.3f} ms  errors {}".format(
+            name, len(values), percentile(values, 50) * 1000, percentile(values, 99) * 1000, errors.get(name, 0)))
+
+
+def cleanup(db, users):
+    for n in range(users):
+        db.delete_node(_template(_user(n)))
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in operations:
+            raise argparse.ArgumentTypeError("unknown operation {}".format(name))
+        mix[name] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark storage backends on the same friends workload.")
+    parser.add_argument("--backend", action="append", choices=sorted(context.backends),
+                        help="backend to run, repeatable, defaults to memory")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--degree", type=int, default=20, help="average friends per user")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=_parse_mix, default="read=70,add=10,accept=10,delete=10",
+                        help="operation weights, e.g. read=70,add=10,accept=10,delete=10")
+    parser.add_argument("--cleanup", action="store_true", help="delete the benchmark users afterwards")
+    args = parser.parse_args(argv)
+
+    for backend in args.backend or ["memory"]:
+        db_info = context.get_db_info(backend)
+        db = context.create_db_resource(db_info, context.get_pool_info())
+
+        seconds = seed(db, args.users, args.degree)
+        print("{}: seeded {} users, ~{} friends each, in {:.2f}s".format(backend, args.users, args.degree, seconds))
+        report(backend, *run_workload(db, args.users, args.ops, args.concurrency, args.mix))
+
+        if args.cleanup:
+            cleanup(db, args.users)
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Per-request overhead of the request context: building it, logging the request and the after_request lookup.
+
+    python -m benchmarks.request_context --requests 20000
+
+Each iteration opens a Flask test request context for a friend request (query string, a dozen headers and a
+JSON body) and does what every request does before and after the route body: the route's get_context and
+log_request, and the get_context of notify_sns. No database is involved. The run is repeated with the root
+logger at INFO, the service default, and at DEBUG, where the request is formatted and logged.
+
+The eager baseline is the context as it was before get_context: built twice per request (by the route and by
+notify_sns), each time copying the headers, parsing the JSON body twice and formatting itself for a debug
+record, and log_request formatting the request whatever the log level.
+"""
+import sys
+import time
+import json
+import logging
+import argparse
+
+from flask import Flask, request
+
+from utils import rest_utils
+from benchmarks.stats import percentile
+
+
+class EagerContext(rest_utils.RESTContext):
+    """
+    RESTContext constructor as it was before the lazy context: headers and body are read up front.
+    """
+
+    def __init__(self, request_context, path_parameters=None):
+        super().__init__(request_context, path_parameters)
+        self._headers = dict(request_context.headers)
+        self._data = None
+        try:
+            self._data = request_context.get_json()
+        except Exception:
+            pass
+        # The body was parsed a second time, its result unused
+        try:
+            if request_context.data is not None:
+                request_context.json
+        except Exception:
+            pass
+        logging.getLogger().debug(" received: \n" + json.dumps(str(self), indent=2))
+
+
+def eager_log_request(method_name, request_context):
+    msg = json.dumps({"method_name": method_name, "request": request_context}, indent=2, default=str)
+    logging.getLogger().debug(msg)
+
+
+def _headers(count):
+    headers = {"Content-Type": "application/json", "Accept": "application/json", "If-None-Match": 'W/"12"'}
+    headers.update({"X-Header-{}".format(i): "value-{}".format(i) for i in range(count)})
+    return headers
+
+
+def run(app, requests, headers, body, touch, eager=False):
+    """
+
+    :param touch: Also read the headers and body, like a route that uses them.
+    :param eager: Measure the EagerContext baseline instead of get_context.
+    :return: List of latencies in seconds.
+    """
+    latencies = []
+    for _ in range(requests):
+        with app.test_request_context("/friends/a/add?limit=10&offset=20&fields=name&order_by=-timestamp",
+                                      method="POST", headers=headers, data=body):
+            start = time.perf_counter()
+            if eager:
+                inputs = EagerContext(request)
+                eager_log_request("add_friend_request", inputs)
+            else:
+                inputs = rest_utils.get_context(request)
+                rest_utils.log_request("add_friend_request", inputs)
+            if touch:
+                inputs.headers.get("If-None-Match")
+                inputs.data.get("friend_id")
+            # notify_sns
+            if eager:
+                EagerContext(request).endpoint
+            else:
+                rest_utils.get_context(request).endpoint
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    print("{:<30} {:>8} req  mean {:>8.1f} us  p50 {:>8.1f} us  p99 {:>8.1f} us".format(
+        name, len(latencies), sum(latencies) / len(latencies) * 1e6,
+        percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the per-request cost of the request context.")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--headers", type=int, default=10, help="extra request headers")
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    headers = _headers(args.headers)
+    body = json.dumps({"friend_id": "b"})
+
+    logger = logging.getLogger()
+    level = logger.level
+    # Formatted DEBUG records go nowhere, so only the cost of building them is measured
+    handlers, logger.handlers = logger.handlers, [logging.NullHandler()]
+    try:
+        for name, log_level in (("info", logging.INFO), ("debug", logging.DEBUG)):
+            logger.setLevel(log_level)
+            for variant, eager in (("eager", True), ("lazy", False)):
+                run(app, min(args.requests, 1000), headers, body, False, eager)
+                report("{} {} untouched".format(name, variant), run(app, args.requests, headers, body, False, eager))
+                report("{} {} headers+body".format(name, variant),
+                       run(app, args.requests, headers, body, True, eager))
+    finally:
+        logger.setLevel(level)
+        logger.handlers = handlers
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
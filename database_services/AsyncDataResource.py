@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncDataResource:
+    """
+    asyncio front end for a data resource.
+
+    The drivers underneath (py2neo, PyMySQL, ...) are blocking, so every call is handed to a thread pool sized to
+    the resource's connection pool and awaited. The event loop itself never blocks, so a single process can keep
+    as many queries in flight as the connection pool allows while it goes on accepting requests.
+
+        db = AsyncDataResource(context.get_db_resource())
+        friends = await db.find_by_node_relationship_outward(template, "FRIEND")
+    """
+
+    # Items handed from the producer thread to the event loop per hop when streaming
+    _stream_chunk_size = 500
+
+    def __init__(self, db_resource, max_workers=50):
+        self.db_resource = db_resource
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    def __getattr__(self, name):
+        attr = getattr(self.db_resource, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        return method
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Runs any blocking callable, e.g. a FriendsResource method, on the resource's worker threads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def stream(self, func, *args, **kwargs):
+        """
+        Async generator over the items of the blocking generator returned by func(*args, **kwargs).
+
+        The generator runs start to finish on one worker thread and hands items over in chunks through a bounded
+        queue, so a slow consumer pauses the producer. An exception raised by func or the generator is raised in
+        the consumer.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=4)
+        done = object()
+        stop = threading.Event()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            items = None
+            try:
+                items = func(*args, **kwargs)
+                chunk = []
+                for item in items:
+                    if stop.is_set():
+                        return
+                    chunk.append(item)
+                    if len(chunk) >= AsyncDataResource._stream_chunk_size:
+                        put(chunk)
+                        chunk = []
+                if chunk:
+                    put(chunk)
+                put(done)
+            except Exception as e:
+                put(e)
+            finally:
+                # Close on this thread, which is the one holding the generator's pool slot
+                close = getattr(items, "close", None) if items is not None else None
+                if close is not None:
+                    close()
+
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is done:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                for item in chunk:
+                    yield item
+        finally:
+            stop.set()
+            # Unblock a producer waiting on a full queue so it can see stop and exit
+            while not queue.empty():
+                queue.get_nowait()
+            await producer
+
+    def close(self):
+        self._executor.shutdown(wait=False)
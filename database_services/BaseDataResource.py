@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+
+from database_services.StatementRegistry import check_identifier
+
+# Node property incremented by every write that adds or removes one of the node's relationships
+version_property = "relationship_version"
+
+
+def degree_property(relationship, direction):
+    """
+
+    :param direction: "outward" or "inward".
+    :return: Name of the node property counting its relationships of this type and direction, e.g. friend_out_count.
+    """
+    return "{}_{}_count".format(relationship.lower(), "out" if direction == "outward" else "in")
+
+
+class BaseDataResource(ABC):
+    """
+    Contract every storage backend implements. FriendsResource, the import and export tools and the ASGI app
+    only call these methods, so backends are interchangeable through middleware.context.
+
+    Nodes are addressed with templates like {"label": "user", "template": {"user_id": "a"}}. Node and
+    relationship properties come back as plain dictionaries. tools.conformance checks a backend against
+    this contract.
+    """
+
+    # Labels and relationship types the service uses. Backends reject anything else with ValueError.
+    _labels = ("user",)
+    _relationships = ("FRIEND", "PENDING_FRIEND")
+
+    # Property that cursor pagination orders and filters on. Unique per user, so the order is total.
+    _cursor_key = "user_id"
+
+    # What list lookups may be ordered by, only keys with an index behind them: user_id of the other node (unique
+    # constraint) and timestamp of the relationship (relationship indexes).
+    _order_keys = ("user_id", "timestamp")
+
+    # Most properties a list lookup projects
+    _max_fields = 20
+
+    @abstractmethod
+    def find_nodes_by_template(self, tmp):
+        """
+
+        :return: List of the nodes matching the template.
+        """
+        pass
+
+    @abstractmethod
+    def create_node(self, label, **kwargs):
+        """
+
+        :return: Properties of the new node. Raises if a node with the same _cursor_key value exists.
+        """
+        pass
+
+    @abstractmethod
+    def merge_nodes(self, label, key, values):
+        """
+
+        :return: Number of nodes created, existing ones are skipped.
+        """
+        pass
+
+    @abstractmethod
+    def merge_relationships(self, label, key, relationship, rows):
+        """
+        Creates missing nodes and the relationship in both directions for every {"a", "b", "timestamp"} row.
+
+        :return: Number of relationships created.
+        """
+        pass
+
+    @abstractmethod
+    def create_relationship(self, template_a, template_b, relationship):
+        """
+        Creates (a)-[relationship]->(b) unless it exists. Raises if either node is missing.
+
+        :return: Dictionary of the relationship's properties plus "relationship" and "created".
+        """
+        pass
+
+    @abstractmethod
+    def delete_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        pass
+
+    @abstractmethod
+    def accept_relationship(self, template_a, template_b, pending, relationship):
+        """
+        Atomically replaces (b)-[pending]->(a) with relationship in both directions. Raises if either node is missing.
+
+        :return: Number of pending relationships removed.
+        """
+        pass
+
+    @abstractmethod
+    def delete_bidirectional_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        pass
+
+    @abstractmethod
+    def find_by_node_relationship_outward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                          cursor=None, fields=None, order_by=None):
+        """
+        Nodes m with (n)-[relationship]->(m). With a cursor ({} for the first page, {"after": key} or
+        {"before": key}) results are ordered by _cursor_key; otherwise offset pagination is used, ordered by
+        order_by and then _cursor_key.
+
+        :param fields: Property names to return, _cursor_key is always included. None for every property.
+        :param order_by: List of _order_keys, each prefixed with "-" for descending. Only _cursor_key with a cursor.
+        :return: List of node property dictionaries.
+        """
+        pass
+
+    @abstractmethod
+    def find_by_node_relationship_inward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                         cursor=None, fields=None, order_by=None):
+        """
+        Nodes m with (n)<-[relationship]-(m), paginated like find_by_node_relationship_outward.
+        """
+        pass
+
+    @abstractmethod
+    def find_first_by_nodes_relationship(self, label, key, values, relationship, direction="outward", limit=10):
+        """
+        First cursor page, ordered by _cursor_key, of find_by_node_relationship_<direction> for many nodes at once,
+        with each node's degree counter, in one round trip.
+
+        :param values: Key values of the nodes.
+        :return: Dictionary of {key value: {"nodes": [node property dictionaries], "count": degree}} for the
+            values that match a node.
+        """
+        pass
+
+    @abstractmethod
+    def find_by_node_relationship_mutual(self, template_a, template_b, relationship):
+        """
+        Nodes m with both (a)-[relationship]->(m) and (b)-[relationship]->(m), e.g. mutual friends.
+
+        :return: List of node property dictionaries ordered by _cursor_key.
+        """
+        pass
+
+    @abstractmethod
+    def find_two_hop_by_node_relationship(self, template, relationship, exclude=(), limit=10, fanout=100):
+        """
+        Scores nodes m two hops away, (n)-[relationship]->(f)-[relationship]->(m), by the number of such f.
+        Only the first fanout relationships of each f are followed, so high-degree intermediates do not dominate
+        the cost. n itself and nodes sharing relationship, or any type in exclude, with n in either direction are
+        left out.
+
+        :return: List of at most limit (node property dictionary, score) tuples, highest score first.
+        """
+        pass
+
+    @abstractmethod
+    def find_relationships_between(self, template, key, values, relationships):
+        """
+        Relationships between node n and each node m whose key property is in values, in one round trip.
+
+        :return: Dictionary of {key value: [(relationship, "outward" or "inward"), ...]} for the values that share
+            at least one of relationships with n. "outward" means (n)-[relationship]->(m).
+        """
+        pass
+
+    def _order_terms(self, order_by, cursor=None):
+        """
+
+        :param order_by: List of _order_keys, each prefixed with "-" for descending, or None.
+        :return: List of (key, descending) tuples ending with _cursor_key, so the order is total.
+        """
+        terms = []
+        for term in order_by or ():
+            descending = term.startswith("-")
+            key = check_identifier(term[1:] if descending else term, self._order_keys)
+            if key not in [k for k, _ in terms]:
+                terms.append((key, descending))
+        if self._cursor_key not in [k for k, _ in terms]:
+            terms.append((self._cursor_key, False))
+        else:
+            # The key is unique, anything after it never decides the order
+            terms = terms[:[k for k, _ in terms].index(self._cursor_key) + 1]
+
+        if cursor is not None and terms != [(self._cursor_key, False)]:
+            raise ValueError("Cursor pagination is ordered by {}".format(self._cursor_key))
+        return terms
+
+    def _projection(self, fields):
+        """
+
+        :param fields: Property names, or None.
+        :return: Sorted list of the property names plus _cursor_key, None for every property.
+        """
+        if not fields:
+            return None
+        fields = sorted({check_identifier(f) for f in fields} | {self._cursor_key})
+        if len(fields) > self._max_fields:
+            raise ValueError("At most {} fields can be requested".format(self._max_fields))
+        return fields
+
+    @abstractmethod
+    def get_degrees(self, template):
+        """
+        Relationship counts of a node, maintained by every write so reading them does not depend on its degree.
+
+        :return: {relationship: {"outward": count, "inward": count}} for every relationship type, None if no node
+            matches the template.
+        """
+        pass
+
+    @abstractmethod
+    def get_version(self, template):
+        """
+        Version of a node's relationships, incremented in the same transaction as every write that adds or
+        removes one of them. Nodes that never had a relationship are at version 0.
+
+        :return: The version, None if no node matches the template.
+        """
+        pass
+
+    @abstractmethod
+    def iter_nodes(self, label):
+        """
+
+        :return: Generator of the property dictionaries of every node with label.
+        """
+        pass
+
+    @abstractmethod
+    def iter_relationships(self, label, key, relationships):
+        """
+
+        :return: Generator of {"relationship": type, "from": key value, "to": key value, **properties}.
+        """
+        pass
+
+    @abstractmethod
+    def update_node(self, label, keys, data):
+        pass
+
+    @abstractmethod
+    def delete_node(self, template):
+        """
+        Deletes the matching nodes together with their relationships.
+
+        :return: {"nodes": nodes deleted, "relationships": relationships deleted}, None if nothing matched.
+        """
+        pass
+
+    def pool_stats(self):
+        return {}
+
+    def statement_stats(self):
+        return {}
+
+    def close(self):
+        pass
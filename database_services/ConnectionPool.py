@@ -0,0 +1,183 @@
+import time
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+
+
+class ConnectionPoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounds the number of callers that may use a data resource at the same time and keeps usage statistics.
+
+    The driver underneath (py2neo) owns the actual Bolt connections, but it fails immediately with
+    ConnectionLimit when all of them are busy. This pool makes callers wait for a free slot, up to
+    the acquisition timeout, so bursts queue up instead of erroring. Acquisition is re-entrant per
+    thread, so a method holding a slot can call other pooled methods without deadlocking.
+
+    A pooled generator started inside a pooled call shares the caller's slot, so it must be consumed before
+    that call returns. Otherwise it takes a slot of its own, held until it is exhausted or closed, and only
+    marks the thread as holding a slot while the generator body runs. A consumer that interleaves such open
+    generators with other pooled calls needs one slot for each of them.
+    """
+
+    def __init__(self, max_size=50, timeout=30.0):
+        """
+
+        :param max_size: Maximum number of concurrent users of the resource.
+        :param timeout: Seconds to wait for a free slot before raising ConnectionPoolTimeout.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Notified when the last slot in use is released
+        self._drained = threading.Condition(self._lock)
+        self._closed = False
+        self._local = threading.local()
+
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired = 0
+        self._waited = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+
+    @contextmanager
+    def acquire(self):
+        """
+        Holds a slot for the body, or joins the one the thread already holds.
+        """
+        if self.held():
+            with self.holding():
+                yield
+            return
+
+        with self.slot(), self.holding():
+            yield
+
+    def held(self):
+        """
+
+        :return: True if the calling thread is inside a pooled call.
+        """
+        return bool(getattr(self._local, "depth", 0))
+
+    @contextmanager
+    def holding(self):
+        """
+        Marks the thread as holding a slot for the body, so pooled calls made from it are re-entrant.
+        """
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Takes a slot for the body without marking the thread, e.g. for a generator that is suspended in between.
+        """
+        if self._closed:
+            raise ConnectionPoolTimeout("Connection pool is closed")
+
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._timeouts += 1
+                logging.error("Connection pool exhausted, waited {:.2f}s".format(self.timeout))
+                raise ConnectionPoolTimeout("Timed out waiting for a connection after {}s".format(self.timeout))
+            with self._lock:
+                self._waited += 1
+                self._total_wait += time.perf_counter() - start
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                if not self._in_use:
+                    self._drained.notify_all()
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "timeout": self.timeout,
+                "in_use": self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "acquired": self._acquired,
+                "waited": self._waited,
+                "timeouts": self._timeouts,
+                "total_wait_seconds": round(self._total_wait, 6),
+                "closed": self._closed,
+            }
+
+    def close(self, timeout=None):
+        """
+        Stops handing out slots and waits for the callers holding one to finish.
+
+        :param timeout: Seconds to wait, the acquisition timeout by default. Open generators hold their slot
+            until they are exhausted or closed, so a close can give up with slots still in use.
+        :return: True if no slot is in use anymore.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._closed = True
+            drained = self._drained.wait_for(lambda: not self._in_use, timeout=timeout)
+            if not drained:
+                logging.warning("Connection pool closed with {} slots in use".format(self._in_use))
+            return drained
+
+
+# Access modes. Every public data resource method declares one, so reads can be sent to read replicas
+# (followers) when routing is enabled while writes always go to the leader.
+READ = "READ"
+WRITE = "WRITE"
+
+
+def pooled(access_mode):
+    """
+    Tags the decorated data resource method with its access mode and runs it while holding a slot of
+    the resource's connection pool. Generator methods hold the slot until they are exhausted or closed, and
+    share the caller's when started from inside a pooled call.
+    """
+    def decorator(method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                # Join the caller's slot, or take one of its own. The thread only counts as holding it while
+                # the body runs.
+                with nullcontext() if self._pool.held() else self._pool.slot():
+                    items = method(self, *args, **kwargs)
+                    try:
+                        while True:
+                            with self._pool.holding():
+                                try:
+                                    item = next(items)
+                                except StopIteration:
+                                    return
+                            yield item
+                    finally:
+                        with self._pool.holding():
+                            items.close()
+        else:
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self._pool.acquire():
+                    return method(self, *args, **kwargs)
+        wrapper.access_mode = access_mode
+        return wrapper
+    return decorator
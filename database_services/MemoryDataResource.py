@@ -0,0 +1,544 @@
+import heapq
+import logging
+import threading
+import datetime as dt
+from itertools import islice
+
+from database_services.BaseDataResource import BaseDataResource
+from database_services.StatementRegistry import check_identifier
+
+
+class MemoryDataResource(BaseDataResource):
+    """
+    In-process stand-in for Neo4JDataResource with the same methods and return values, for tests, local
+    development and benchmarks. Select it with DBTYPE=memory. Nothing is persisted.
+
+    Every node gets a small integer id, interned from its label and _cursor_key value. Relationships are
+    adjacency maps of those ids per relationship type: _out[type][a] maps b to the properties of (a)-[type]->(b)
+    and _in[type][b] is the set of a. Lookups never scan the graph, so million-edge graphs stay fast.
+    """
+
+    # Nodes handed out per lock acquisition when streaming, so writers are not held up by a long export
+    _iter_chunk_size = 1000
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self._lock = threading.RLock()
+        self._closed = False
+        # Node id -> property dictionary, None once deleted. Ids are never reused.
+        self._nodes = []
+        # Label -> {key value -> node id}
+        self._index = {label: {} for label in MemoryDataResource._labels}
+        self._out = {relationship: {} for relationship in MemoryDataResource._relationships}
+        self._in = {relationship: {} for relationship in MemoryDataResource._relationships}
+        # Node id -> relationship version, absent until the node's relationships first change
+        self._versions = {}
+
+    def pool_stats(self):
+        """
+
+        :return: The keys of ConnectionPool.stats(). There is no connection pool, so nothing is ever in use.
+        """
+        return {
+            "max_size": None,
+            "timeout": None,
+            "in_use": 0,
+            "peak_in_use": 0,
+            "acquired": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "total_wait_seconds": 0.0,
+            "closed": self._closed,
+        }
+
+    def graph_stats(self):
+        """
+
+        :return: Number of nodes and, per relationship type, of relationships.
+        """
+        with self._lock:
+            return {
+                "nodes": sum(len(ids) for ids in self._index.values()),
+                "relationships": {r: sum(len(bs) for bs in out.values()) for r, out in self._out.items()},
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+    def _node_id(self, label, props, create=False):
+        """
+
+        :param props: Dictionary of {property_name: property_value} the node must match. Must include _cursor_key.
+        :param create: Create the node if no node has the key value.
+        :return: Id of the matching node, or None.
+        """
+        check_identifier(label, MemoryDataResource._labels)
+        key = MemoryDataResource._cursor_key
+        if key not in props:
+            raise ValueError("Template must include {}".format(key))
+
+        index = self._index[label]
+        nid = index.get(props[key])
+        if nid is None:
+            if not create:
+                return None
+            nid = len(self._nodes)
+            self._nodes.append({key: props[key]})
+            index[props[key]] = nid
+        node = self._nodes[nid]
+        if any(node.get(k) != v for k, v in props.items()):
+            return None
+        return nid
+
+    def _find_ids(self, template):
+        """
+
+        :return: Ids of the nodes matching a {"label": ..., "template": {...}} template.
+        """
+        label = template.get("label", None)
+        props = template.get("template", None) or {}
+        check_identifier(label, MemoryDataResource._labels)
+        if MemoryDataResource._cursor_key in props:
+            nid = self._node_id(label, props)
+            return [] if nid is None else [nid]
+        return [nid for nid in self._index[label].values()
+                if all(self._nodes[nid].get(k) == v for k, v in props.items())]
+
+    def run_match(self, labels=None, properties=None):
+        """
+
+        :return: A list of node property dictionaries with the label and properties.
+        """
+        if labels is None:
+            raise ValueError("Invalid request. Labels are required.")
+        with self._lock:
+            return [dict(self._nodes[nid]) for nid in self._find_ids({"label": labels, "template": properties})]
+
+    def find_nodes_by_template(self, tmp):
+        return self.run_match(labels=tmp.get('label', None), properties=tmp.get("template", None))
+
+    def create_node(self, label, **kwargs):
+        key = MemoryDataResource._cursor_key
+        check_identifier(label, MemoryDataResource._labels)
+        if key not in kwargs:
+            raise ValueError("Node must have a {}".format(key))
+
+        with self._lock:
+            # Same behaviour as the unique constraint on user_id in Neo4j
+            if kwargs[key] in self._index[label]:
+                raise Exception("Node with {} {} already exists".format(key, kwargs[key]))
+            nid = self._node_id(label, {key: kwargs[key]}, create=True)
+            self._nodes[nid].update(kwargs)
+            return dict(self._nodes[nid])
+
+    def merge_nodes(self, label, key, values):
+        """
+
+        :return: Number of nodes created.
+        """
+        check_identifier(key, (MemoryDataResource._cursor_key,))
+        created = 0
+        with self._lock:
+            index = self._index[check_identifier(label, MemoryDataResource._labels)]
+            for value in dict.fromkeys(values):
+                if value not in index:
+                    self._node_id(label, {key: value}, create=True)
+                    created += 1
+        return created
+
+    def _add(self, relationship, a, b, props):
+        """
+        Adds (a)-[relationship]->(b) unless present. Caller holds the lock.
+
+        :return: True if the relationship was created.
+        """
+        out = self._out[relationship].setdefault(a, {})
+        if b in out:
+            return False
+        out[b] = props
+        self._in[relationship].setdefault(b, set()).add(a)
+        self._versions[a] = self._versions.get(a, 0) + 1
+        self._versions[b] = self._versions.get(b, 0) + 1
+        return True
+
+    def _remove(self, relationship, a, b):
+        """
+        Removes (a)-[relationship]->(b) if present. Caller holds the lock.
+
+        :return: Number of relationships removed.
+        """
+        out = self._out[relationship].get(a)
+        if not out or b not in out:
+            return 0
+        del out[b]
+        if not out:
+            del self._out[relationship][a]
+        inward = self._in[relationship][b]
+        inward.discard(a)
+        if not inward:
+            del self._in[relationship][b]
+        self._versions[a] = self._versions.get(a, 0) + 1
+        self._versions[b] = self._versions.get(b, 0) + 1
+        return 1
+
+    def merge_relationships(self, label, key, relationship, rows):
+        """
+        Bulk version of create_relationship for imports, in both directions, creating missing nodes.
+
+        :param rows: List of {"a": key value, "b": key value, "timestamp": str}.
+        :return: Number of relationships created.
+        """
+        check_identifier(key, (MemoryDataResource._cursor_key,))
+        check_identifier(relationship, MemoryDataResource._relationships)
+        created = 0
+        with self._lock:
+            index = self._index[check_identifier(label, MemoryDataResource._labels)]
+            for row in rows:
+                a = index.get(row["a"])
+                if a is None:
+                    a = self._node_id(label, {key: row["a"]}, create=True)
+                b = index.get(row["b"])
+                if b is None:
+                    b = self._node_id(label, {key: row["b"]}, create=True)
+                # Both directions share one property dictionary
+                props = {"timestamp": row["timestamp"]}
+                created += self._add(relationship, a, b, props)
+                created += self._add(relationship, b, a, props)
+        return created
+
+    def _pair(self, template_a, template_b):
+        a = self._node_id(template_a.get("label", None), template_a.get("template", None) or {})
+        b = self._node_id(template_b.get("label", None), template_b.get("template", None) or {})
+        return a, b
+
+    def create_relationship(self, template_a, template_b, relationship):
+        """
+        Creates the relationship (a)-[relationship]->(b) unless it already exists.
+
+        :return: Dictionary with the relationship type, its properties and whether it was newly created.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        with self._lock:
+            a, b = self._pair(template_a, template_b)
+            if a is None or b is None:
+                # To distinguish whether it is not found or error
+                raise Exception("Node not found for relationship {}".format(relationship))
+            created = self._add(relationship, a, b, {"timestamp": dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")})
+            result = dict(self._out[relationship][a][b])
+
+        result["relationship"] = relationship
+        result["created"] = created
+        return result
+
+    def delete_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        with self._lock:
+            a, b = self._pair(template_a, template_b)
+            if a is None or b is None:
+                return 0
+            return self._remove(relationship, a, b)
+
+    def accept_relationship(self, template_a, template_b, pending, relationship):
+        """
+        Replaces the pending request (b)-[pending]->(a) with relationship in both directions, atomically.
+
+        :return: Number of pending relationships removed.
+        """
+        check_identifier(pending, MemoryDataResource._relationships)
+        check_identifier(relationship, MemoryDataResource._relationships)
+        with self._lock:
+            a, b = self._pair(template_a, template_b)
+            if a is None or b is None:
+                # To distinguish whether it is not found or error
+                raise Exception("Node not found for relationship {}".format(relationship))
+            props = {"timestamp": dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")}
+            self._add(relationship, a, b, props)
+            self._add(relationship, b, a, props)
+            return self._remove(pending, b, a)
+
+    def delete_bidirectional_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        with self._lock:
+            a, b = self._pair(template_a, template_b)
+            if a is None or b is None:
+                return 0
+            return self._remove(relationship, a, b) + self._remove(relationship, b, a)
+
+    def _page(self, template, relationship, direction, limit, offset, whereclause, cursor, fields, order_by):
+        """
+        Same selection, order and projection as Neo4JDataResource.find_statement, evaluated on the adjacency maps.
+
+        :return: List of node property dictionaries.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        key = MemoryDataResource._cursor_key
+        terms = self._order_terms(order_by, cursor)
+        fields = self._projection(fields)
+        where = dict(whereclause or {})
+        limit = int(limit)
+
+        with self._lock:
+            ids = self._find_ids(template)
+            adjacency = self._out[relationship] if direction == "outward" else self._in[relationship]
+            out = self._out[relationship]
+            # (node, relationship properties) pairs
+            rows = []
+            for nid in ids:
+                for mid in adjacency.get(nid, ()):
+                    m = self._nodes[mid]
+                    if all(m.get(k) == v for k, v in where.items()):
+                        rows.append((m, out[nid][mid] if direction == "outward" else out[mid][nid]))
+
+            if cursor is not None and "after" in cursor:
+                rows = [row for row in rows if row[0][key] > cursor["after"]]
+            elif cursor is not None and "before" in cursor:
+                rows = [row for row in rows if row[0][key] < cursor["before"]]
+            # Stable sorts, least significant term first
+            for k, descending in reversed(terms):
+                if k == "timestamp":
+                    rows.sort(key=lambda row: row[1].get(k) or "", reverse=descending)
+                else:
+                    rows.sort(key=lambda row: row[0][k], reverse=descending)
+            nodes = [m for m, _ in rows]
+
+            if cursor is not None and "before" in cursor:
+                page = nodes[max(0, len(nodes) - limit):]
+            elif cursor is not None:
+                page = nodes[:limit]
+            else:
+                skip = int(offset) if offset else 0
+                page = nodes[skip:skip + limit]
+
+            # change to dict for JSON response
+            if fields is None:
+                return [dict(m) for m in page]
+            return [{f: m.get(f) for f in fields} for m in page]
+
+    def find_by_node_relationship_outward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                          cursor=None, fields=None, order_by=None):
+        return self._page(template, relationship, "outward", limit, offset, whereclause, cursor, fields, order_by)
+
+    def find_by_node_relationship_inward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                         cursor=None, fields=None, order_by=None):
+        return self._page(template, relationship, "inward", limit, offset, whereclause, cursor, fields, order_by)
+
+    def find_first_by_nodes_relationship(self, label, key, values, relationship, direction="outward", limit=10):
+        """
+
+        :return: Dictionary of {key value: {"nodes": [...], "count": degree}}.
+        """
+        check_identifier(key, (MemoryDataResource._cursor_key,))
+        check_identifier(relationship, MemoryDataResource._relationships)
+        cursor_key = MemoryDataResource._cursor_key
+        res = {}
+        with self._lock:
+            index = self._index[check_identifier(label, MemoryDataResource._labels)]
+            adjacency = self._out[relationship] if direction == "outward" else self._in[relationship]
+            for value in values:
+                n = index.get(value)
+                if n is None:
+                    continue
+                neighbours = adjacency.get(n, ())
+                first = heapq.nsmallest(int(limit), (self._nodes[m] for m in neighbours), key=lambda m: m[cursor_key])
+                res[value] = {"nodes": [dict(m) for m in first], "count": len(neighbours)}
+        return res
+
+    def find_by_node_relationship_mutual(self, template_a, template_b, relationship):
+        """
+        Intersects the two adjacency maps, walking the smaller one.
+
+        :return: List of node property dictionaries ordered by _cursor_key.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        key = MemoryDataResource._cursor_key
+        with self._lock:
+            a, b = self._pair(template_a, template_b)
+            if a is None or b is None:
+                return []
+            out_a = self._out[relationship].get(a, {})
+            out_b = self._out[relationship].get(b, {})
+            if len(out_b) < len(out_a):
+                out_a, out_b = out_b, out_a
+            nodes = [dict(self._nodes[mid]) for mid in out_a if mid in out_b]
+        nodes.sort(key=lambda m: m[key])
+        return nodes
+
+    def find_two_hop_by_node_relationship(self, template, relationship, exclude=(), limit=10, fanout=100):
+        """
+        Counts candidates while walking at most fanout relationships per intermediate, then keeps the best limit
+        with a bounded heap.
+
+        :return: List of (node property dictionary, score) tuples, highest score first.
+        """
+        check_identifier(relationship, MemoryDataResource._relationships)
+        excluded = [relationship] + [check_identifier(r, MemoryDataResource._relationships) for r in exclude]
+        key = MemoryDataResource._cursor_key
+        with self._lock:
+            ids = self._find_ids(template)
+            if not ids:
+                return []
+            n = ids[0]
+            skip = {n}
+            for r in excluded:
+                skip.update(self._out[r].get(n, ()))
+                skip.update(self._in[r].get(n, ()))
+
+            scores = {}
+            out = self._out[relationship]
+            for f in out.get(n, ()):
+                for m in islice(out.get(f, ()), int(fanout)):
+                    if m not in skip:
+                        scores[m] = scores.get(m, 0) + 1
+
+            best = heapq.nsmallest(int(limit), scores.items(), key=lambda item: (-item[1], self._nodes[item[0]][key]))
+            return [(dict(self._nodes[m]), score) for m, score in best]
+
+    def find_relationships_between(self, template, key, values, relationships):
+        """
+
+        :return: Dictionary of {key value: [(relationship, direction), ...]}.
+        """
+        check_identifier(key, (MemoryDataResource._cursor_key,))
+        for relationship in relationships:
+            check_identifier(relationship, MemoryDataResource._relationships)
+        res = {}
+        with self._lock:
+            ids = self._find_ids(template)
+            if not ids:
+                return res
+            n = ids[0]
+            index = self._index[template.get("label", None)]
+            for value in values:
+                m = index.get(value)
+                if m is None:
+                    continue
+                for relationship in relationships:
+                    if m in self._out[relationship].get(n, ()):
+                        res.setdefault(value, []).append((relationship, "outward"))
+                    if n in self._out[relationship].get(m, ()):
+                        res.setdefault(value, []).append((relationship, "inward"))
+        return res
+
+    def get_version(self, template):
+        with self._lock:
+            ids = self._find_ids(template)
+            return self._versions.get(ids[0], 0) if ids else None
+
+    def get_degrees(self, template):
+        """
+        The adjacency maps already hold every node's relationships, so their sizes are the counts.
+
+        :return: {relationship: {"outward": count, "inward": count}}, None if no node matches.
+        """
+        with self._lock:
+            ids = self._find_ids(template)
+            if not ids:
+                return None
+            nid = ids[0]
+            return {relationship: {"outward": len(self._out[relationship].get(nid, {})),
+                                   "inward": len(self._in[relationship].get(nid, ()))}
+                    for relationship in MemoryDataResource._relationships}
+
+    def _iter_ids(self, label):
+        """
+        Ids of the nodes with label, copied out _iter_chunk_size at a time under the lock.
+        """
+        index = self._index[check_identifier(label, MemoryDataResource._labels)]
+        start = 0
+        while True:
+            with self._lock:
+                chunk = [nid for nid in range(start, min(start + MemoryDataResource._iter_chunk_size, len(self._nodes)))
+                         if self._nodes[nid] is not None
+                         and index.get(self._nodes[nid][MemoryDataResource._cursor_key]) == nid]
+                end = len(self._nodes)
+            if start >= end:
+                return
+            start += MemoryDataResource._iter_chunk_size
+            yield chunk
+
+    def iter_nodes(self, label):
+        """
+
+        :return: Generator of node property dictionaries.
+        """
+        for chunk in self._iter_ids(label):
+            with self._lock:
+                nodes = [dict(self._nodes[nid]) for nid in chunk if self._nodes[nid] is not None]
+            for node in nodes:
+                yield node
+
+    def iter_relationships(self, label, key, relationships):
+        """
+
+        :return: Generator of {"relationship": type, "from": key value, "to": key value, **properties}.
+        """
+        check_identifier(key)
+        for relationship in relationships:
+            check_identifier(relationship, MemoryDataResource._relationships)
+
+        for chunk in self._iter_ids(label):
+            records = []
+            with self._lock:
+                for nid in chunk:
+                    a = self._nodes[nid]
+                    if a is None:
+                        continue
+                    for relationship in relationships:
+                        for mid, props in self._out[relationship].get(nid, {}).items():
+                            record = {"relationship": relationship, "from": a.get(key), "to": self._nodes[mid].get(key)}
+                            record.update(props)
+                            records.append(record)
+            for record in records:
+                yield record
+
+    def update_node(self, label, keys, data):
+        key = MemoryDataResource._cursor_key
+        for k in data.keys():
+            check_identifier(k)
+
+        with self._lock:
+            result = []
+            for nid in self._find_ids({"label": label, "template": keys}):
+                node = self._nodes[nid]
+                if key in data and data[key] != node[key]:
+                    # Keep the index unique, like the constraint on user_id
+                    if data[key] in self._index[label]:
+                        raise Exception("Node with {} {} already exists".format(key, data[key]))
+                    del self._index[label][node[key]]
+                    self._index[label][data[key]] = nid
+                node.update(data)
+                result.append(str({"n": dict(node)}))
+            return result
+
+    def delete_node(self, template):
+        """
+        Deletes the matching nodes together with their relationships.
+
+        :return: {"nodes": nodes deleted, "relationships": relationships deleted}, None if nothing matched.
+        """
+        label = template.get("label", None)
+        relationships = 0
+        with self._lock:
+            ids = self._find_ids(template)
+            for nid in ids:
+                for relationship in MemoryDataResource._relationships:
+                    for b in list(self._out[relationship].get(nid, {})):
+                        relationships += self._remove(relationship, nid, b)
+                    for a in list(self._in[relationship].get(nid, ())):
+                        relationships += self._remove(relationship, a, nid)
+                del self._index[label][self._nodes[nid][MemoryDataResource._cursor_key]]
+                self._nodes[nid] = None
+                self._versions.pop(nid, None)
+
+        if self.debug:
+            logging.debug("Memory delete_node, template = {}, deleted = {}".format(template, len(ids)))
+        return {"nodes": len(ids), "relationships": relationships} if ids else None
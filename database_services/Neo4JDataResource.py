@@ -1,11 +1,26 @@
-from py2neo import data, Graph, NodeMatcher, Node, Relationship, RelationshipMatcher
+from py2neo import Graph, NodeMatcher, Node, Relationship, RelationshipMatcher
+from py2neo.errors import Neo4jError, ConnectionBroken, ConnectionUnavailable
 """
 See https://py2neo.org/v4/
 """
+import time
 import logging
+import threading
 import datetime as dt
 
-class Neo4JDataResource:
+from database_services.BaseDataResource import BaseDataResource, degree_property, version_property
+from database_services.ConnectionPool import ConnectionPool, pooled, READ, WRITE
+from database_services.StatementRegistry import StatementRegistry, check_identifier
+
+# Node properties holding relationship counts and the relationship version. Maintained by the write statements,
+# hidden from returned nodes.
+_degree_properties = frozenset(degree_property(relationship, direction)
+                               for relationship in BaseDataResource._relationships
+                               for direction in ("outward", "inward"))
+_internal_properties = _degree_properties | {version_property}
+
+
+class Neo4JDataResource(BaseDataResource):
     """
     This object provides a set of helper methods for creating and retrieving nodes and relationships from
     a Neo4j database holding information about players, teams, fans, comments and their relationships.
@@ -16,32 +31,105 @@ class Neo4JDataResource:
     # but tend to be annoying after a while. So, I did not create types Player, Team, etc.
     #
 
+    # Labels and relationship types (BaseDataResource._labels, _relationships) are the only identifiers
+    # that appear in statement text. Everything else is a parameter.
+
+    # Named parameterized statements shared by every instance, with hit and latency counters.
+    statements = StatementRegistry()
+
+    # Statements are retried this many times on transient errors (e.g. deadlocks), backing off
+    # _retry_backoff * attempt seconds between tries. All write statements are MERGE/DELETE and idempotent.
+    _retries = 3
+    _retry_backoff = 0.05
+
+    # Nodes with more relationships than this are deleted in chunks of this many relationships
+    _delete_batch_size = 10000
 
-    # Connects to the DB and sets a Graph instance variable.
-    # Also creates a NodeMatcher and RelationshipMatcher, which are a py2neo framework classes.
-    def __init__(self, auth=('neo4j', 'password'), host='localhost', port=7687, debug=False, secure=False):
+    # Degree of a node read from the store's per-node relationship counts, without expanding its relationships:
+    # Neo4j 5 syntax first, 4.x second. The first one the server accepts is kept in _degree_syntax.
+    _degree_expressions = ["COUNT {{ ({0})--() }}", "size(({0})--())"]
+    _degree_syntax = None
+
+    # Nodes read per query when streaming nodes and relationships
+    _iter_chunk_size = 1000
+
+
+    # Records the connection settings. The Graph instance (and with it the Bolt connection pool) is
+    # created lazily on first use, so constructing the resource at import time does not connect.
+    # pool_size bounds concurrent callers and driver connections, max_lifetime is the maximum age
+    # in seconds of a pooled connection and pool_timeout is how long a caller waits for a free one.
+    # With routing=True the cluster's routing table is used, sending READ work to followers/replicas.
+    def __init__(self, auth=('neo4j', 'password'), host='localhost', port=7687, debug=False, secure=False,
+                 pool_size=50, max_lifetime=3600, pool_timeout=30.0, routing=False):
         self.debug = debug
-        self._graph = Graph(secure=secure,
-                            auth=auth,
-                            host=host,
-                            port=port)
-        self._node_matcher = NodeMatcher(self._graph)
-        self._relationship_matcher = RelationshipMatcher(self._graph)
+        self._graph_settings = {
+            "routing": routing,
+            "secure": secure,
+            "auth": auth,
+            "host": host,
+            "port": port,
+            "max_size": pool_size,
+            "max_age": max_lifetime,
+        }
+        self._pool = ConnectionPool(max_size=pool_size, timeout=pool_timeout)
+        self._connect_lock = threading.Lock()
+        self._graph_instance = None
+        self._node_matcher = None
+        self._relationship_matcher = None
+
+    @property
+    def _graph(self):
+        """
+        Connects to the DB on first access and creates the NodeMatcher and RelationshipMatcher,
+        which are py2neo framework classes. Safe to call from several threads.
+        """
+        if self._graph_instance is None:
+            with self._connect_lock:
+                if self._graph_instance is None:
+                    graph = Graph(**self._graph_settings)
+                    self._node_matcher = NodeMatcher(graph)
+                    self._relationship_matcher = RelationshipMatcher(graph)
+                    self._graph_instance = graph
+        return self._graph_instance
+
+    def pool_stats(self):
+        """
+
+        :return: Statistics for the caller-side pool and, once connected, the driver's Bolt connections.
+        """
+        stats = self._pool.stats()
+        stats["connected"] = self._graph_instance is not None
+        if self._graph_instance is not None:
+            connector = self._graph_instance.service.connector
+            stats["bolt_in_use"] = sum(connector.in_use.values())
+        return stats
+
+    def close(self):
+        """
+        Stops handing out connections, waits up to the pool timeout for callers in flight, and closes every open
+        Bolt connection.
+        """
+        self._pool.close()
+        with self._connect_lock:
+            if self._graph_instance is not None:
+                self._graph_instance.service.connector.close()
+                self._graph_instance = None
 
+    @pooled(READ)
     def run_q(self, qs, args):
         """
 
-        :param qs: Query string that may have {} slots for parameters.
-        :param args: Dictionary of parameters to insert into query string.
-        :return:  Result of the query, which executes as a single, standalone transaction.
+        :param qs: Query string that may have $name parameters.
+        :param args: Dictionary of parameters for the query.
+        :return:  Result cursor of the query, which executes as a single, standalone read-only transaction.
         """
         try:
-            tx = self._graph.begin(readonly=True)
-            result = self._graph.run(qs, args)
-            return result
+            return self._run(qs, args, readonly=True)
         except Exception as e:
             logging.error("Run exception = {}".format(e))
+            raise
 
+    @pooled(READ)
     def run_match(self, labels=None, properties=None):
         """
         Uses a NodeMatcher to find a node matching a "template."
@@ -69,6 +157,7 @@ class Neo4JDataResource:
 
         return full_result
 
+    @pooled(READ)
     def find_nodes_by_template(self, tmp):
         """
 
@@ -81,125 +170,625 @@ class Neo4JDataResource:
         result = self.run_match(labels=labels, properties=props)
         return result
 
+    @pooled(WRITE)
     def create_node(self, label, **kwargs):
+        check_identifier(label, Neo4JDataResource._labels)
         n = Node(label, **kwargs)
         tx = self._graph.begin(readonly=False)
-        tx.create(n)
-        tx.commit()
+        try:
+            tx.create(n)
+            self._graph.commit(tx)
+        except Exception:
+            self._graph.rollback(tx)
+            raise
         return dict(n) # change to dict for JSON response
 
-    def create_relationship(self, template_a, template_b, relationship):
+    @pooled(WRITE)
+    def merge_nodes(self, label, key, values):
+        """
+        Creates one node per value, keyed on property key, skipping nodes that already exist.
+        All values go to the server in one UNWIND statement.
+
+        :param values: List of key values. Duplicates are ignored.
+        :return: Number of nodes created.
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+        check_identifier(key)
+
+        name = "merge_nodes:{}({})".format(label, key)
+        build = lambda: ("UNWIND $rows AS r MERGE (n:{} {{{}: r}}) "
+                         "ON CREATE SET n._new = true "
+                         "WITH n, coalesce(n._new, false) AS created REMOVE n._new "
+                         "RETURN sum(CASE WHEN created THEN 1 ELSE 0 END) AS created").format(label, key)
+        params = {"rows": list(dict.fromkeys(values))}
+
+        try:
+            res = self.run_statement(name, build, params, readonly=False)
+        except Exception as e:
+            logging.error("Error NEO4J Merge nodes: " + str(e))
+            raise Exception(e)
+
+        return res[0]["created"] if res else 0
+
+    @pooled(WRITE)
+    def merge_relationships(self, label, key, relationship, rows):
+        """
+        Bulk version of create_relationship for imports. Creates missing nodes and the relationship in both
+        directions for every row, in one UNWIND statement. Existing relationships are left as they are.
+
+        :param rows: List of {"a": key value, "b": key value, "timestamp": str}.
+        :return: Number of relationships created.
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+        check_identifier(key)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        name = "merge_relationships:{}({}):{}".format(label, key, relationship)
+        build = lambda: ("UNWIND $rows AS r "
+                         "MERGE (a:{label} {{{key}: r.a}}) MERGE (b:{label} {{{key}: r.b}}) "
+                         "MERGE (a)-[x:{rel}]->(b) ON CREATE SET x.timestamp = r.timestamp, x._new = true "
+                         "MERGE (b)-[y:{rel}]->(a) ON CREATE SET y.timestamp = r.timestamp, y._new = true "
+                         "WITH a, b, x, y, coalesce(x._new, false) AS cx, coalesce(y._new, false) AS cy "
+                         "REMOVE x._new, y._new {count_x} {count_y} "
+                         "RETURN sum(CASE WHEN cx THEN 1 ELSE 0 END) + sum(CASE WHEN cy THEN 1 ELSE 0 END) AS created"
+                         ).format(label=label, key=key, rel=relationship,
+                                  count_x=self._when("cx", self._count_update("a", "b", relationship, 1)),
+                                  count_y=self._when("cy", self._count_update("b", "a", relationship, 1)))
+        params = {"rows": rows}
+
         try:
-            node_a = self.find_nodes_by_template(template_a)[0]
-            node_b = self.find_nodes_by_template(template_b)[0]
-            ts = dt.datetime.utcnow()
-            relationship_obj = Relationship(node_a, relationship, node_b, timestamp=ts.strftime("%Y-%m-%d %H:%M:%S"))
+            res = self.run_statement(name, build, params, readonly=False)
+        except Exception as e:
+            logging.error("Error NEO4J Merge relationships: " + str(e))
+            raise Exception(e)
+
+        return res[0]["created"] if res else 0
 
-            tx = self._graph.begin(readonly=False)
-            tx.create(relationship_obj)
-            tx.commit()
+    @pooled(WRITE)
+    def create_relationship(self, template_a, template_b, relationship):
+        """
+        Creates the relationship (a)-[relationship]->(b) unless it already exists, in one round trip.
 
+        :return: Dictionary with the relationship type, its properties and whether it was newly created.
+        """
+        pattern_a, params = self._node_pattern("a", template_a.get("label", None), template_a.get("template", None))
+        pattern_b, params_b = self._node_pattern("b", template_b.get("label", None), template_b.get("template", None))
+        params.update(params_b)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        # The _new marker only lives inside the statement; it tells a fresh edge from a merged one.
+        # Creating or deleting a relationship locks both nodes, so their counters cannot be updated concurrently.
+        name = "merge_relationship:{}->{}:{}".format(pattern_a, pattern_b, relationship)
+        count = self._when("created", self._count_update("a", "b", relationship, 1))
+        build = lambda: ("MATCH {}, {} MERGE (a)-[r:{}]->(b) "
+                         "ON CREATE SET r.timestamp = $timestamp, r._new = true "
+                         "WITH a, b, r, coalesce(r._new, false) AS created REMOVE r._new {} "
+                         "RETURN r, created").format(pattern_a, pattern_b, relationship, count)
+        params["timestamp"] = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        try:
+            res = self.run_statement(name, build, params, readonly=False)
         except Exception as e:
             logging.error("Error NEO4J Create relationship: " + str(e))
-            tx.rollback()
-            # To distinguish whether it is not found or error
             raise Exception(e)
 
-        return relationship_obj
+        if not res:
+            # To distinguish whether it is not found or error
+            raise Exception("Node not found for relationship {}".format(relationship))
+
+        result = dict(res[0]["r"])
+        result["relationship"] = relationship
+        result["created"] = res[0]["created"]
+        return result
 
+    @pooled(WRITE)
     def delete_relationship(self, template_a, template_b, relationship):
-        try:
-            node_a = self.find_nodes_by_template(template_a)[0]
-            node_b = self.find_nodes_by_template(template_b)[0]
-            relationship_obj = self._relationship_matcher.match(nodes=[node_a, node_b], r_type=relationship).first()
+        """
+        Deletes the relationship (a)-[relationship]->(b), if present, in one round trip.
 
-            tx = self._graph.begin(readonly=False)
-            tx.separate(relationship_obj)
-            tx.commit()
+        :return: Number of relationships deleted.
+        """
+        pattern_a, params = self._node_pattern("a", template_a.get("label", None), template_a.get("template", None))
+        pattern_b, params_b = self._node_pattern("b", template_b.get("label", None), template_b.get("template", None))
+        params.update(params_b)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        name = "delete_relationship:{}->{}:{}".format(pattern_a, pattern_b, relationship)
+        build = lambda: ("MATCH {}-[r:{}]->{} WITH a, b, r DELETE r SET {} "
+                         "RETURN count(r) AS deleted").format(pattern_a, relationship, pattern_b,
+                                                             self._count_update("a", "b", relationship, -1))
 
+        try:
+            res = self.run_statement(name, build, params, readonly=False)
         except Exception as e:
             logging.error("Error NEO4J Delete relationship: " + str(e))
-            tx.rollback()
+            raise Exception(e)
+
+        return res[0]["deleted"] if res else 0
+
+    @pooled(WRITE)
+    def accept_relationship(self, template_a, template_b, pending, relationship):
+        """
+        Replaces the pending request (b)-[pending]->(a) with relationship in both directions, as a single
+        statement, so either everything is applied or nothing is.
+
+        :return: Number of pending relationships removed.
+        """
+        pattern_a, params = self._node_pattern("a", template_a.get("label", None), template_a.get("template", None))
+        pattern_b, params_b = self._node_pattern("b", template_b.get("label", None), template_b.get("template", None))
+        params.update(params_b)
+        check_identifier(pending, Neo4JDataResource._relationships)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        name = "accept_relationship:{}->{}:{}:{}".format(pattern_a, pattern_b, pending, relationship)
+        count_1 = self._when("c1", self._count_update("a", "b", relationship, 1))
+        count_2 = self._when("c2", self._count_update("b", "a", relationship, 1))
+        build = lambda: ("MATCH {a}, {b} "
+                         "MERGE (a)-[r1:{rel}]->(b) ON CREATE SET r1.timestamp = $timestamp, r1._new = true "
+                         "MERGE (b)-[r2:{rel}]->(a) ON CREATE SET r2.timestamp = $timestamp, r2._new = true "
+                         "WITH a, b, r1, r2, coalesce(r1._new, false) AS c1, coalesce(r2._new, false) AS c2 "
+                         "REMOVE r1._new, r2._new {count_1} {count_2} "
+                         "WITH a, b OPTIONAL MATCH (b)-[p:{pending}]->(a) DELETE p "
+                         "WITH a, b, count(p) AS deleted {count_p} "
+                         "RETURN deleted").format(a=pattern_a, b=pattern_b, rel=relationship, pending=pending,
+                                                  count_1=count_1, count_2=count_2,
+                                                  count_p=self._when("deleted > 0", self._count_update(
+                                                      "b", "a", pending, "-deleted")))
+        params["timestamp"] = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        try:
+            res = self.run_statement(name, build, params, readonly=False)
+        except Exception as e:
+            logging.error("Error NEO4J Accept relationship: " + str(e))
+            raise Exception(e)
+
+        if not res:
             # To distinguish whether it is not found or error
+            raise Exception("Node not found for relationship {}".format(relationship))
+
+        return res[0]["deleted"]
+
+    @pooled(WRITE)
+    def delete_bidirectional_relationship(self, template_a, template_b, relationship):
+        """
+        Deletes relationship in both directions between a and b in a single statement.
+
+        :return: Number of relationships deleted.
+        """
+        pattern_a, params = self._node_pattern("a", template_a.get("label", None), template_a.get("template", None))
+        pattern_b, params_b = self._node_pattern("b", template_b.get("label", None), template_b.get("template", None))
+        params.update(params_b)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        name = "delete_bidirectional_relationship:{}-{}:{}".format(pattern_a, pattern_b, relationship)
+        build = lambda: ("MATCH {}-[r:{}]-{} WITH a, b, r, startNode(r) = a AS forward DELETE r {} {} "
+                         "RETURN count(r) AS deleted").format(
+            pattern_a, relationship, pattern_b,
+            self._when("forward", self._count_update("a", "b", relationship, -1)),
+            self._when("NOT forward", self._count_update("b", "a", relationship, -1)))
+
+        try:
+            res = self.run_statement(name, build, params, readonly=False)
+        except Exception as e:
+            logging.error("Error NEO4J Delete relationship: " + str(e))
             raise Exception(e)
 
-        return None
+        return res[0]["deleted"] if res else 0
+
+    def _node_pattern(self, var, label, props):
+        """
+
+        :param var: Variable name for the node in the statement.
+        :param label: Label of the node, must be one of _labels.
+        :param props: Dictionary of {property_name: property_value} the node must match.
+        :return: Tuple of (pattern text, parameters), e.g. ("(n:user {user_id: $n_user_id})", {"n_user_id": "a"})
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+        keys = sorted(props.keys())
+        props_str = ", ".join("{}: ${}_{}".format(check_identifier(k), var, k) for k in keys)
+        params = {"{}_{}".format(var, k): props[k] for k in keys}
+        return "({}:{} {{{}}})".format(var, label, props_str), params
+
+    def _count_update(self, a, b, relationship, delta):
+        """
+
+        :return: SET items adding delta to the outward degree of a and the inward degree of b, for
+            (a)-[relationship]->(b), and incrementing the version of both.
+        """
+        delta = str(delta)
+        delta = "- " + delta[1:] if delta.startswith("-") else "+ " + delta
+        return ("{a}.{o} = coalesce({a}.{o}, 0) {d}, {b}.{i} = coalesce({b}.{i}, 0) {d}, "
+                "{a}.{v} = coalesce({a}.{v}, 0) + 1, {b}.{v} = coalesce({b}.{v}, 0) + 1").format(
+            a=a, b=b, d=delta, o=degree_property(relationship, "outward"), i=degree_property(relationship, "inward"),
+            v=version_property)
+
+    def _when(self, condition, items):
+        """
 
-    def find_by_node_relationship_outward(self, template, relationship, limit=10, offset=None, whereclause={}):
+        :return: Clause applying the SET items only on rows where condition holds.
+        """
+        return "FOREACH (_ IN CASE WHEN {} THEN [1] ELSE [] END | SET {})".format(condition, items)
+
+    def _release_neighbours(self, var):
+        """
+
+        :return: Clauses decrementing the counters and incrementing the version of every neighbour of node var,
+            ahead of a DETACH DELETE.
+        """
+        clauses = []
+        for relationship in Neo4JDataResource._relationships:
+            clauses.append("FOREACH (m IN [({})-[:{}]->(x) | x] | SET {})".format(
+                var, relationship, self._release(degree_property(relationship, "inward"))))
+            clauses.append("FOREACH (m IN [({})<-[:{}]-(x) | x] | SET {})".format(
+                var, relationship, self._release(degree_property(relationship, "outward"))))
+        return " ".join(clauses)
+
+    def _release(self, counter):
+        """
+
+        :return: SET items for a neighbour m losing one relationship counted by counter.
+        """
+        return "m.{c} = coalesce(m.{c}, 0) - 1, m.{v} = coalesce(m.{v}, 0) + 1".format(c=counter, v=version_property)
+
+    def _node(self, node):
+        """
+
+        :return: Properties of node without the degree counters and version. Changed to dict for JSON response.
+        """
+        return {k: v for k, v in dict(node).items() if k not in _internal_properties}
+
+    @pooled(READ)
+    def get_version(self, template):
+        pattern, params = self._node_pattern("n", template.get("label", None), template.get("template", None))
+
+        name = "version:{}({})".format(template.get("label", None), ",".join(sorted(template.get("template", None))))
+        build = lambda: "MATCH {} RETURN coalesce(n.{}, 0) AS version LIMIT 1".format(pattern, version_property)
+
+        records = list(self.run_statement(name, build, params))
+        return records[0]["version"] if records else None
+
+    @pooled(READ)
+    def get_degrees(self, template):
+        pattern, params = self._node_pattern("n", template.get("label", None), template.get("template", None))
+
+        name = "degrees:{}({})".format(template.get("label", None), ",".join(sorted(template.get("template", None))))
+        columns = ["coalesce(n.{0}, 0) AS {0}".format(p) for p in sorted(_degree_properties)]
+        build = lambda: "MATCH {} RETURN {} LIMIT 1".format(pattern, ", ".join(columns))
+
+        records = list(self.run_statement(name, build, params))
+        if not records:
+            return None
+        return {relationship: {direction: records[0][degree_property(relationship, direction)]
+                               for direction in ("outward", "inward")}
+                for relationship in Neo4JDataResource._relationships}
+
+    def run_statement(self, name, build, params, readonly=True):
+        """
+
+        :param name: Name of the prepared statement.
+        :param build: Zero argument callable returning the statement text, used the first time name is seen.
+        :param params: Dictionary of parameters for the statement.
+        :param readonly: False for statements that write, which then run in a read-write transaction.
+        :return: Result cursor of the statement for reads, list of dictionaries for writes.
+        """
+        statement = Neo4JDataResource.statements.prepare(name, build)
+        runner = self.run_q if readonly else self.run_write
+        return Neo4JDataResource.statements.run(runner, statement, params)
+
+    @pooled(WRITE)
+    def run_write(self, qs, args):
+        """
+        Runs a write statement as its own read-write transaction.
+
+        :return: Result of the statement as a list of dictionaries, fully fetched so errors surface here.
+        """
+        return self._run(qs, args, readonly=False)
+
+    def _run(self, qs, args, readonly):
+        """
+        Runs qs in an auto-commit transaction of the given access mode, retrying on transient errors
+        (e.g. deadlocks) and dropped connections. With routing enabled, read-only transactions go to
+        followers or read replicas and read-write transactions go to the leader.
+
+        :return: The result cursor for reads, the fully fetched list of dictionaries for writes.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                cursor = self._graph.auto(readonly=readonly).run(qs, args)
+                return cursor if readonly else cursor.data()
+            except (Neo4jError, ConnectionBroken, ConnectionUnavailable) as e:
+                retry = not isinstance(e, Neo4jError) or e.should_retry()
+                if not retry or attempt > Neo4JDataResource._retries:
+                    raise
+                logging.warning("Retrying NEO4J {}, attempt {}, e = {}".format(
+                    "read" if readonly else "write", attempt, e))
+                time.sleep(Neo4JDataResource._retry_backoff * attempt)
+
+    def statement_stats(self):
+        return Neo4JDataResource.statements.stats()
+
+    @pooled(READ)
+    def explain(self, name, build, params):
+        """
+
+        :return: The execution plan Neo4j would use for the named statement, as a nested dictionary
+            with operatorType, args, identifiers and children, without running it.
+        """
+        statement = Neo4JDataResource.statements.prepare(name, build)
+        cursor = self._graph.auto(readonly=True).run("EXPLAIN " + statement.text, params)
+        cursor.data()
+        return cursor.plan()
+
+    def find_statement(self, template, relationship, direction, limit=10, offset=None, whereclause=None, cursor=None,
+                       fields=None, order_by=None):
+        """
+
+        :param direction: "outward" for (n)-[relationship]->(m), "inward" for (n)<-[relationship]-(m).
+        :param cursor: None for offset pagination. Otherwise results are ordered by _cursor_key and cursor is
+            {} for the first page, {"after": key} for the page after key or {"before": key} for the page before it.
+            A cursor page reads the whole adjacency list of n and keeps the top limit past the key.
+        :param fields: Property names returned through a map projection, m {.a, .b}, instead of the whole node.
+        :param order_by: List of _order_keys, "timestamp" being the relationship's. See _order_terms.
+        :return: Tuple of (name, build, params) describing the relationship lookup, for run_statement or explain.
+        """
         label = template.get("label", None)
         props = template.get("template", None)
-        props_str = ''
-        for key, value in props.items():
-            props_str += "{}: {},".format(key, value)
-        props_str = '{' + props_str[:-1] + '}'
-
-        if whereclause:
-            cols = list(whereclause.keys())
-            wc_terms = [f"m.{c}" + f"='{whereclause[c]}'" for c in cols]
-            parsed_wc = " AND ".join(wc_terms)
-            
-            q = "MATCH (n:{} {})-[:{}]->(m) WHERE {} RETURN m".format(label, props_str, relationship, parsed_wc)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+        terms = self._order_terms(order_by, cursor)
+        fields = self._projection(fields)
 
+        pattern, params = self._node_pattern("n", label, props)
+        if direction == "outward":
+            path = "{}-[r:{}]->(m)".format(pattern, relationship)
         else:
-            q = "MATCH (n:{} {})-[:{}]->(m) RETURN m".format(label, props_str, relationship)
-        
-        if offset:
-            q += f" SKIP {offset}"
-        q += f" LIMIT {limit}"
-        
-        res = self.run_q(q, args=None).data()
+            path = "{}<-[r:{}]-(m)".format(pattern, relationship)
 
-        result = []
-        for x in res:
-            # change to dict for JSON response
-            ret = dict(x)['m'] 
-            result.append(dict(ret)) 
+        # Where clause values travel in a single map parameter, so the text is the same for any filter.
+        name = "find_{}:{}({}):{}".format(direction, label, ",".join(sorted(props)), relationship)
+        where = "all(k IN keys($where) WHERE m[k] = $where[k])"
+        params["where"] = dict(whereclause or {})
+        params["limit"] = int(limit)
+
+        # Only the page's rows are projected, after ORDER BY and LIMIT
+        if fields is None:
+            projection = "m"
+        else:
+            name += ":fields({})".format(",".join(fields))
+            projection = "m {{{}}} AS m".format(", ".join("." + f for f in fields))
+
+        if cursor is None:
+            name += ":order({})".format(",".join(("-" if d else "") + k for k, d in terms))
+            order = ", ".join("{}.{}{}".format("r" if k == "timestamp" else "m", k, " DESC" if d else "")
+                              for k, d in terms)
+            build = lambda: ("MATCH {} WHERE {} WITH m, r ORDER BY {} SKIP $skip LIMIT $limit "
+                             "RETURN {}").format(path, where, order, projection)
+            params["skip"] = int(offset) if offset else 0
+        else:
+            # Keyset pagination: filter past the last key seen instead of skipping rows. This is filter plus top-k
+            # over n's adjacency list, not an index seek: every neighbour is still expanded and compared, but only
+            # the page is sorted and returned, and the cost no longer grows with the page number as SKIP does.
+            key = Neo4JDataResource._cursor_key
+            if "after" in cursor:
+                name += ":after"
+                where += " AND m.{} > $after".format(key)
+                order = "m.{}".format(key)
+                params["after"] = cursor["after"]
+            elif "before" in cursor:
+                name += ":before"
+                where += " AND m.{} < $before".format(key)
+                order = "m.{} DESC".format(key)
+                params["before"] = cursor["before"]
+            else:
+                name += ":first"
+                order = "m.{}".format(key)
+            build = lambda: "MATCH {} WHERE {} WITH m ORDER BY {} LIMIT $limit RETURN {}".format(
+                path, where, order, projection)
+
+        return name, build, params
+
+    def _find_by_node_relationship(self, template, relationship, direction, limit, offset, whereclause, cursor,
+                                   fields, order_by):
+        name, build, params = self.find_statement(template, relationship, direction, limit, offset, whereclause, cursor,
+                                                  fields, order_by)
+
+        # py2neo has pulled every record before the cursor is returned, so the page is converted in one pass
+        result = [self._node(x['m']) for x in self.run_statement(name, build, params)]
+
+        # Pages before a cursor are fetched in descending order; hand them back ascending.
+        if cursor and "before" in cursor:
+            result.reverse()
         return result
 
-    def find_by_node_relationship_inward(self, template, relationship, limit=10, offset=None, whereclause={}):
+    @pooled(READ)
+    def find_by_node_relationship_outward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                          cursor=None, fields=None, order_by=None):
+        return self._find_by_node_relationship(template, relationship, "outward", limit, offset, whereclause, cursor,
+                                               fields, order_by)
+
+    @pooled(READ)
+    def find_by_node_relationship_inward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                         cursor=None, fields=None, order_by=None):
+        return self._find_by_node_relationship(template, relationship, "inward", limit, offset, whereclause, cursor,
+                                               fields, order_by)
+
+    @pooled(READ)
+    def find_first_by_nodes_relationship(self, label, key, values, relationship, direction="outward", limit=10):
+        """
+        UNWINDs values; the subquery reads each node's page in index order and stops at $limit.
+
+        :return: Dictionary of {key value: {"nodes": [...], "count": degree}}.
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+        check_identifier(key, (Neo4JDataResource._cursor_key,))
+        check_identifier(relationship, Neo4JDataResource._relationships)
+        arrow = "-[:{}]->" if direction == "outward" else "<-[:{}]-"
+        params = {"values": list(values), "limit": int(limit)}
+
+        name = "find_first_{}:{}({}):{}".format(direction, label, key, relationship)
+        build = lambda: ("UNWIND $values AS v MATCH (n:{label} {{{key}: v}}) "
+                         "CALL {{ WITH n OPTIONAL MATCH (n){arrow}(m) "
+                         "WITH m ORDER BY m.{cursor_key} LIMIT $limit RETURN collect(m) AS nodes }} "
+                         "RETURN v, nodes, coalesce(n.{count}, 0) AS count").format(
+            label=label, key=key, arrow=arrow.format(relationship), cursor_key=Neo4JDataResource._cursor_key,
+            count=degree_property(relationship, direction))
+
+        return {record["v"]: {"nodes": [self._node(m) for m in record["nodes"]], "count": record["count"]}
+                for record in self.run_statement(name, build, params)}
+
+    @pooled(READ)
+    def find_by_node_relationship_mutual(self, template_a, template_b, relationship):
+        """
+        One statement; the planner expands both nodes and joins on m, so cost follows the two degrees.
+
+        :return: List of node property dictionaries ordered by _cursor_key.
+        """
+        pattern_a, params = self._node_pattern("a", template_a.get("label", None), template_a.get("template", None))
+        pattern_b, params_b = self._node_pattern("b", template_b.get("label", None), template_b.get("template", None))
+        params.update(params_b)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+
+        name = "find_mutual:{}->{}:{}".format(pattern_a, pattern_b, relationship)
+        build = lambda: "MATCH {a}-[:{rel}]->(m)<-[:{rel}]-{b} RETURN DISTINCT m ORDER BY m.{key}".format(
+            a=pattern_a, b=pattern_b, rel=relationship, key=Neo4JDataResource._cursor_key)
+
+        return [self._node(record["m"]) for record in self.run_statement(name, build, params)]
+
+    @pooled(READ)
+    def find_two_hop_by_node_relationship(self, template, relationship, exclude=(), limit=10, fanout=100):
+        """
+        The subquery stops expanding each intermediate after $fanout rows, and ORDER BY with LIMIT is planned as
+        a Top operator, which keeps only the best $limit candidates.
+
+        :return: List of (node property dictionary, score) tuples, highest score first.
+        """
         label = template.get("label", None)
         props = template.get("template", None)
-        props_str = ''
-        for key, value in props.items():
-            props_str += "{}: {},".format(key, value)
-        props_str = '{' + props_str[:-1] + '}'
-
-        if whereclause:
-            cols = list(whereclause.keys())
-            wc_terms = [f"m.{c}" + f"='{whereclause[c]}'" for c in cols]
-            parsed_wc = " AND ".join(wc_terms)
-            
-            q = "MATCH (n:{} {})<-[:{}]-(m) WHERE {} RETURN m".format(label, props_str, relationship, parsed_wc)
+        pattern, params = self._node_pattern("n", label, props)
+        check_identifier(relationship, Neo4JDataResource._relationships)
+        excluded = [relationship] + [check_identifier(r, Neo4JDataResource._relationships) for r in exclude]
+        params["fanout"] = int(fanout)
+        params["limit"] = int(limit)
+
+        name = "two_hop:{}({}):{}:{}".format(label, ",".join(sorted(props)), relationship, ",".join(excluded))
+        build = lambda: ("MATCH {pattern}-[:{rel}]->(f) "
+                         "CALL {{ WITH f MATCH (f)-[:{rel}]->(m) RETURN m LIMIT $fanout }} "
+                         "WITH n, m WHERE m <> n AND {excluded} "
+                         "RETURN m, count(*) AS score ORDER BY score DESC, m.{key} LIMIT $limit").format(
+            pattern=pattern, rel=relationship, key=Neo4JDataResource._cursor_key,
+            excluded=" AND ".join("NOT (n)-[:{}]-(m)".format(r) for r in excluded))
+
+        return [(self._node(record["m"]), record["score"]) for record in self.run_statement(name, build, params)]
+
+    @pooled(READ)
+    def find_relationships_between(self, template, key, values, relationships):
+        """
+        UNWINDs values, so each target is one unique index seek; only the relationships between n and m are read.
 
-        else:
-            q = "MATCH (n:{} {})<-[:{}]-(m) RETURN m".format(label, props_str, relationship)
+        :return: Dictionary of {key value: [(relationship, direction), ...]}.
+        """
+        label = template.get("label", None)
+        props = template.get("template", None)
+        pattern, params = self._node_pattern("n", label, props)
+        check_identifier(key, (Neo4JDataResource._cursor_key,))
+        types = [check_identifier(r, Neo4JDataResource._relationships) for r in relationships]
+        params["values"] = list(values)
+
+        name = "relationships_between:{}({}):{}".format(label, ",".join(sorted(props)), "|".join(types))
+        build = lambda: ("MATCH {pattern} UNWIND $values AS v MATCH (m:{label} {{{key}: v}}) "
+                         "MATCH (n)-[r:{types}]-(m) "
+                         "RETURN v, type(r) AS relationship, startNode(r) = n AS outward").format(
+            pattern=pattern, label=label, key=key, types="|".join(types))
+
+        res = {}
+        for record in self.run_statement(name, build, params):
+            res.setdefault(record["v"], []).append(
+                (record["relationship"], "outward" if record["outward"] else "inward"))
+        return res
+
+    @pooled(READ)
+    def _read_chunk(self, name, build, params):
+        """
+
+        :return: The records of one chunk of a keyset scan, fully fetched. py2neo pulls the whole result before
+            the cursor is returned, so bounding memory means bounding each query.
+        """
+        return list(self.run_statement(name, build, params))
 
-        if offset:
-            q += f" SKIP {offset}"
-        q += f" LIMIT {limit}"
+    def _iter_chunks(self, name, build, params):
+        """
+        Streams a keyset scan over _cursor_key, one query per chunk of _iter_chunk_size nodes. Each chunk is its
+        own pooled read, so no slot or connection is held while the caller consumes rows.
 
-        res = self.run_q(q, args=None).data()
+        :param build: One argument callable returning the statement text, given "first" or "after". The
+            statement takes $limit, and $after for the next chunks, and returns the node's key as "key".
+        :return: Generator of records.
+        """
+        params = dict(params, limit=Neo4JDataResource._iter_chunk_size)
+        mode = "first"
+        while True:
+            records = self._read_chunk("{}:{}".format(name, mode), lambda: build(mode), params)
+            for record in records:
+                yield record
+            if len(records) < Neo4JDataResource._iter_chunk_size:
+                return
+            mode, params["after"] = "after", records[-1]["key"]
+
+    def iter_nodes(self, label):
+        """
 
-        result = []
-        for x in res:
-            # change to dict for JSON response
-            ret = dict(x)['m'] 
-            result.append(dict(ret)) 
-        return result
+        :return: Generator of node property dictionaries, read in _cursor_key order a chunk at a time.
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+
+        key = Neo4JDataResource._cursor_key
+        build = lambda mode: "MATCH (n:{label}) WHERE n.{key} {cond} RETURN n.{key} AS key, n " \
+                             "ORDER BY n.{key} LIMIT $limit".format(
+            label=label, key=key, cond="IS NOT NULL" if mode == "first" else "> $after")
+
+        for record in self._iter_chunks("iter_nodes:{}".format(label), build, {}):
+            yield self._node(record["n"])
+
+    def iter_relationships(self, label, key, relationships):
+        """
+        Walks the nodes with label like iter_nodes and returns the outgoing relationships of each chunk of them.
 
+        :return: Generator of {"relationship": type, "from": key value, "to": key value, **properties}.
+        """
+        check_identifier(label, Neo4JDataResource._labels)
+        check_identifier(key)
+        for relationship in relationships:
+            check_identifier(relationship, Neo4JDataResource._relationships)
+
+        types = "|".join(relationships)
+        name = "iter_relationships:{}({}):{}".format(label, key, types)
+        cursor_key = Neo4JDataResource._cursor_key
+        build = lambda mode: ("MATCH (a:{label}) WHERE a.{cursor_key} {cond} "
+                              "WITH a ORDER BY a.{cursor_key} LIMIT $limit "
+                              "RETURN a.{cursor_key} AS key, a.{key} AS from, "
+                              "[(a)-[r:{types}]->(b:{label}) | "
+                              "{{relationship: type(r), to: b.{key}, props: properties(r)}}] AS relationships"
+                              ).format(label=label, key=key, types=types, cursor_key=cursor_key,
+                                       cond="IS NOT NULL" if mode == "first" else "> $after")
+
+        for record in self._iter_chunks(name, build, {}):
+            for r in record["relationships"]:
+                result = {"relationship": r["relationship"], "from": record["from"], "to": r["to"]}
+                result.update(r["props"])
+                yield result
+
+    @pooled(WRITE)
     def update_node(self, label, keys, data):
-        props_str = ''
-        for key, value in keys.items():
-            props_str += "{}: '{}', ".format(key, value)
-        props_str = '{' + props_str[:-2] + '}'
+        pattern, params = self._node_pattern("n", label, keys)
+        for key in data.keys():
+            check_identifier(key)
 
-        data_str = ''
-        for key, value in data.items():
-            data_str += "n.{} = '{}', ".format(key, value)
-        data_str = data_str[:-2]
+        name = "update:{}({})".format(label, ",".join(sorted(keys)))
+        build = lambda: "MATCH {} SET n += $data RETURN n".format(pattern)
+        params["data"] = dict(data)
 
-        q = "MATCH (n:{} {}) SET {} RETURN n".format(label, props_str, data_str)
-        res = self.run_q(q, args=None).data()
+        res = self.run_statement(name, build, params, readonly=False)
 
         result = []
         for x in res:
@@ -207,21 +796,87 @@ class Neo4JDataResource:
 
         return result
 
+    def _run_with_degree(self, name, build, params):
+        """
+        Runs a write statement that reads node degrees, in the first of _degree_expressions the server accepts.
+
+        :param build: Callable taking the degree expression, a format string of the node variable, and returning
+            the statement text.
+        :return: Result of the statement as a list of dictionaries.
+        """
+        expressions = Neo4JDataResource._degree_expressions
+        candidates = range(len(expressions)) if self._degree_syntax is None else [self._degree_syntax]
+        for i in candidates:
+            try:
+                res = self.run_statement("{}:degree{}".format(name, i), lambda: build(expressions[i]), params,
+                                         readonly=False)
+            except Neo4jError as e:
+                if getattr(e, "title", None) != "SyntaxError" or i == len(expressions) - 1:
+                    raise
+                logging.info("NEO4J degree syntax {} not supported, e = {}".format(i, e))
+                continue
+            Neo4JDataResource._degree_syntax = i
+            return res
+
+    @pooled(WRITE)
     def delete_node(self, template):
-        nodes = None
+        """
+        Deletes the matching nodes and their relationships on the server. Nodes with at most _delete_batch_size
+        relationships go in a single DETACH DELETE statement. Relationships of bigger nodes are first deleted
+        _delete_batch_size at a time, each batch its own transaction, so no transaction or lock grows with degree.
+
+        :return: {"nodes": nodes deleted, "relationships": relationships deleted}, None if nothing matched.
+        """
+        pattern, params = self._node_pattern("n", template.get("label", None), template.get("template", None))
+        params["batch"] = Neo4JDataResource._delete_batch_size
+        props = ",".join(sorted(template.get("template", None)))
+
+        # Only low degree nodes are deleted here; the rest are left for the chunked path below. The degree comes
+        # from the degree store, so a big node costs the same as a small one until its relationships are deleted.
+        name = "delete_node:{}({})".format(template.get("label", None), props)
+        build = lambda degree: ("MATCH {} WITH n, {} AS degree "
+                                "WITH n, degree, degree <= $batch AS small "
+                                "FOREACH (_ IN CASE WHEN small THEN [1] ELSE [] END | {} DETACH DELETE n) "
+                                "RETURN count(*) AS matched, sum(CASE WHEN small THEN 1 ELSE 0 END) AS deleted, "
+                                "sum(CASE WHEN small THEN degree ELSE 0 END) AS relationships"
+                                ).format(pattern, degree.format("n"), self._release_neighbours("n"))
+
+        chunk_name = "delete_node_relationships:{}({})".format(template.get("label", None), props)
+        release = []
+        for relationship in Neo4JDataResource._relationships:
+            release.append(self._when("t = '{}' AND forward".format(relationship),
+                                      self._release(degree_property(relationship, "inward"))))
+            release.append(self._when("t = '{}' AND NOT forward".format(relationship),
+                                      self._release(degree_property(relationship, "outward"))))
+        chunk_build = lambda: ("MATCH {}-[r]-(m) WITH DISTINCT n, r, m LIMIT $batch "
+                               "WITH r, m, type(r) AS t, startNode(r) = n AS forward DELETE r {} "
+                               "RETURN count(r) AS deleted").format(pattern, " ".join(release))
+
+        # DETACH in case relationships were added while the chunks were deleted. The relationships reported are the
+        # sum of the batches; the few a concurrent write may have added are not counted again.
+        final_name = "delete_node_detach:{}({})".format(template.get("label", None), props)
+        final_build = lambda: "MATCH {} {} DETACH DELETE n RETURN count(*) AS deleted".format(
+            pattern, self._release_neighbours("n"))
+
         try:
-            nodes = self.find_nodes_by_template(template)
-            tx = self._graph.begin(readonly=False)
-            for node in nodes:
-                tx.delete(node)
-            tx.commit()
+            res = self._run_with_degree(name, build, params)[0]
+            result = {"nodes": res["deleted"], "relationships": res["relationships"]}
+
+            if res["matched"] > res["deleted"]:
+                while True:
+                    deleted = self.run_statement(chunk_name, chunk_build, params, readonly=False)[0]["deleted"]
+                    result["relationships"] += deleted
+                    logging.info("NEO4J Delete {}, {} relationships deleted".format(params, result["relationships"]))
+                    if deleted < params["batch"]:
+                        break
+                res = self.run_statement(final_name, final_build, params, readonly=False)[0]
+                result["nodes"] += res["deleted"]
         except Exception as e:
             logging.error("Error NEO4J Delete: " + str(e))
-            tx.rollback()
             # To distinguish whether it is not found or error
             raise Exception(e)
 
-        if nodes:
-            return len(nodes)
+        if result["nodes"]:
+            return result
         else:
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,920 @@
+import time
+import json
+import heapq
+import sqlite3
+import logging
+import threading
+import collections
+import datetime as dt
+from contextlib import contextmanager
+
+import pymysql
+
+from database_services.BaseDataResource import BaseDataResource, degree_property, version_property
+from database_services.ConnectionPool import ConnectionPool, pooled, READ, WRITE
+from database_services.StatementRegistry import check_identifier
+
+
+class RelationalDataResource(BaseDataResource):
+    """
+    Stores the friends graph as an adjacency list in a relational database: SQLite for local use (DBTYPE=sqlite)
+    or MySQL through PyMySQL (DBTYPE=mysql).
+
+        users (id, user_id, properties, <relationship>_<out|in>_count..., relationship_version)
+                                                user_id unique, other node properties as JSON, degree counters
+        edges (src, type, dst, timestamp)       primary key (src, type, dst), index (dst, type, src)
+
+    Both edge indexes cover every column a one-hop lookup reads, so a friend list is one index range scan plus
+    a primary key join per friend. Lists are ordered by user_id, which keeps keyset (cursor) pagination exact.
+    Every write adjusts the degree counters and version of both endpoints in its own transaction, so counts and
+    versions are one row read.
+    """
+
+    # Table holding the nodes of each label
+    _tables = {"user": "users"}
+
+    # Keys per IN (...) list when resolving user ids in bulk, below SQLite's bound parameter limit
+    _in_chunk_size = 500
+
+    # Rows read per query when streaming nodes and relationships
+    _iter_chunk_size = 1000
+
+    # Transactions are retried this many times on lock timeouts, deadlocks and dropped connections
+    _retries = 3
+    _retry_backoff = 0.05
+
+    # Counter column per (relationship, direction)
+    _degree_columns = [(relationship, direction, degree_property(relationship, direction))
+                       for relationship in BaseDataResource._relationships for direction in ("outward", "inward")]
+
+    _schema = {
+        "sqlite": [
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL UNIQUE, "
+            "properties TEXT NOT NULL DEFAULT '{}'" +
+            "".join(", {} INTEGER NOT NULL DEFAULT 0".format(column) for _, _, column in _degree_columns) +
+            ", {} INTEGER NOT NULL DEFAULT 0)".format(version_property),
+            "CREATE TABLE IF NOT EXISTS edges ("
+            "src INTEGER NOT NULL, type TEXT NOT NULL, dst INTEGER NOT NULL, timestamp TEXT, "
+            "PRIMARY KEY (src, type, dst)) WITHOUT ROWID",
+            "CREATE INDEX IF NOT EXISTS edges_dst ON edges (dst, type, src)",
+        ],
+        "mysql": [
+            "CREATE TABLE IF NOT EXISTS users ("
+            "id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, user_id VARCHAR(255) NOT NULL, "
+            "properties TEXT NOT NULL, " +
+            "".join("{} INT NOT NULL DEFAULT 0, ".format(column) for _, _, column in _degree_columns) +
+            "{} BIGINT NOT NULL DEFAULT 0, ".format(version_property) +
+            "UNIQUE KEY users_user_id (user_id)) "
+            "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+            "CREATE TABLE IF NOT EXISTS edges ("
+            "src BIGINT NOT NULL, type VARCHAR(32) NOT NULL, dst BIGINT NOT NULL, timestamp VARCHAR(19), "
+            "PRIMARY KEY (src, type, dst), KEY edges_dst (dst, type, src)) "
+            "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+        ],
+    }
+
+    def __init__(self, dialect="sqlite", database="friends.db", auth=None, host=None, port=None, debug=False,
+                 pool_size=50, max_lifetime=3600, pool_timeout=30.0):
+        """
+
+        :param dialect: "sqlite" or "mysql".
+        :param database: SQLite file name, or MySQL database name.
+        """
+        if dialect not in RelationalDataResource._schema:
+            raise ValueError("Unsupported dialect: {}".format(dialect))
+        self.debug = debug
+        self.dialect = dialect
+        self._connect_settings = {
+            "database": database,
+            "auth": auth,
+            "host": host,
+            "port": int(port) if port else 3306,
+            "timeout": pool_timeout,
+        }
+        self._max_lifetime = max_lifetime
+        self._pool = ConnectionPool(max_size=pool_size, timeout=pool_timeout)
+        # Idle (connection, created at) pairs, and the connection the current thread has checked out
+        self._idle = collections.deque()
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        settings = self._connect_settings
+        if self.dialect == "sqlite":
+            conn = sqlite3.connect(settings["database"], timeout=settings["timeout"], isolation_level=None,
+                                   check_same_thread=False)
+            # Readers never block the writer and vice versa; fsync on checkpoints only.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        else:
+            user, password = settings["auth"] or (None, None)
+            conn = pymysql.connect(host=settings["host"], port=settings["port"], user=user, password=password,
+                                   database=settings["database"], charset="utf8mb4", autocommit=True,
+                                   connect_timeout=int(settings["timeout"]))
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """
+        Checks out a connection for the current thread, reusing an idle one when possible. Re-entrant: nested
+        calls on the same thread share the connection. Connections older than max_lifetime are replaced.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = None
+        with self._idle_lock:
+            while self._idle:
+                candidate, created = self._idle.pop()
+                if time.monotonic() - created < self._max_lifetime:
+                    conn = (candidate, created)
+                    break
+                candidate.close()
+        if conn is None:
+            conn = (self._connect(), time.monotonic())
+            self._ensure_schema(conn[0])
+
+        self._local.conn = conn[0]
+        try:
+            yield conn[0]
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # The server may have dropped the connection, do not hand it out again
+            self._local.conn = None
+            try:
+                conn[0].close()
+            except Exception:
+                pass
+            raise
+        except BaseException:
+            self._local.conn = None
+            self._checkin(conn)
+            raise
+        else:
+            self._local.conn = None
+            self._checkin(conn)
+
+    def _checkin(self, conn):
+        with self._idle_lock:
+            if len(self._idle) < self._pool.max_size:
+                self._idle.append(conn)
+                return
+        conn[0].close()
+
+    def _ensure_schema(self, conn):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                cur = conn.cursor()
+                for statement in RelationalDataResource._schema[self.dialect]:
+                    cur.execute(statement)
+                self._add_counter_columns(cur)
+                self._schema_ready = True
+
+    def _add_counter_columns(self, cur):
+        """
+        Adds the counter and version columns to users tables created before they existed, and counts the existing
+        edges once.
+        """
+        if self.dialect == "sqlite":
+            cur.execute("PRAGMA table_info(users)")
+            columns = {row[1] for row in cur.fetchall()}
+        else:
+            cur.execute("SHOW COLUMNS FROM users")
+            columns = {row[0] for row in cur.fetchall()}
+
+        for relationship, direction, column in RelationalDataResource._degree_columns:
+            if column in columns:
+                continue
+            logging.info("Adding and backfilling users.{}".format(column))
+            cur.execute("ALTER TABLE users ADD COLUMN {} INTEGER NOT NULL DEFAULT 0".format(column))
+            near = "src" if direction == "outward" else "dst"
+            cur.execute(self._sql("UPDATE users SET {} = (SELECT COUNT(*) FROM edges e WHERE e.{} = users.id "
+                                  "AND e.type = ?)".format(column, near)), (relationship,))
+
+        if version_property not in columns:
+            logging.info("Adding users.{}".format(version_property))
+            cur.execute("ALTER TABLE users ADD COLUMN {} BIGINT NOT NULL DEFAULT 0".format(version_property))
+
+    def _is_transient(self, e):
+        if isinstance(e, sqlite3.OperationalError):
+            return "locked" in str(e) or "busy" in str(e)
+        if isinstance(e, pymysql.err.OperationalError):
+            # Lock wait timeout, deadlock, server gone away, lost connection
+            return e.args and e.args[0] in (1205, 1213, 2006, 2013)
+        return False
+
+    def _sql(self, text):
+        """
+        Statements are written with ? placeholders; PyMySQL expects %s.
+        """
+        return text if self.dialect == "sqlite" else text.replace("?", "%s")
+
+    def _property(self, column):
+        """
+
+        :return: SQL expression reading the JSON property whose path ($.name) is the next parameter.
+        """
+        if self.dialect == "sqlite":
+            return "json_extract({}, ?)".format(column)
+        return "JSON_UNQUOTE(JSON_EXTRACT({}, ?))".format(column)
+
+    def _run(self, work, readonly=True):
+        """
+        Runs work(cursor) on a pooled connection, inside a transaction unless readonly, retrying transient errors.
+        Work must only touch the database, since it may run more than once.
+
+        :return: What work returned.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self._connection() as conn:
+                    cur = conn.cursor()
+                    if readonly:
+                        return work(cur)
+                    # IMMEDIATE takes the SQLite write lock up front, so two writers cannot deadlock on upgrade
+                    cur.execute("BEGIN IMMEDIATE" if self.dialect == "sqlite" else "START TRANSACTION")
+                    try:
+                        result = work(cur)
+                        cur.execute("COMMIT")
+                        return result
+                    except BaseException:
+                        try:
+                            cur.execute("ROLLBACK")
+                        except Exception as e:
+                            logging.warning("Rollback failed, e = {}".format(e))
+                        raise
+            except Exception as e:
+                if not self._is_transient(e) or attempt > RelationalDataResource._retries:
+                    raise
+                logging.warning("Retrying {} {}, attempt {}, e = {}".format(
+                    self.dialect, "read" if readonly else "write", attempt, e))
+                time.sleep(RelationalDataResource._retry_backoff * attempt)
+
+    def pool_stats(self):
+        stats = self._pool.stats()
+        stats["idle_connections"] = len(self._idle)
+        return stats
+
+    def close(self):
+        self._pool.close()
+        with self._idle_lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+    def _table(self, label):
+        return RelationalDataResource._tables[check_identifier(label, RelationalDataResource._labels)]
+
+    def _node_filter(self, label, props, alias="n"):
+        """
+
+        :param props: Dictionary of {property_name: property_value} the node must match.
+        :return: Tuple of (condition on alias, parameters), the relational counterpart of Neo4j's _node_pattern.
+        """
+        self._table(label)
+        conditions, params = [], []
+        for k in sorted(props or {}):
+            if k == RelationalDataResource._cursor_key:
+                conditions.append("{}.user_id = ?".format(alias))
+            else:
+                conditions.append("{} = ?".format(self._property("{}.properties".format(alias))))
+                params.append("$." + check_identifier(k))
+            params.append(props[k])
+        return " AND ".join(conditions) or "1 = 1", params
+
+    def _node_ids(self, cur, template):
+        label = template.get("label", None)
+        condition, params = self._node_filter(label, template.get("template", None))
+        cur.execute(self._sql("SELECT n.id FROM {} n WHERE {}".format(self._table(label), condition)), params)
+        return [row[0] for row in cur.fetchall()]
+
+    def _node(self, user_id, properties):
+        node = json.loads(properties) if properties else {}
+        node[RelationalDataResource._cursor_key] = user_id
+        return node
+
+    def _resolve_ids(self, cur, label, values):
+        """
+
+        :return: Dictionary of {key value: id} for the values that exist.
+        """
+        table = self._table(label)
+        ids = {}
+        values = list(values)
+        for i in range(0, len(values), RelationalDataResource._in_chunk_size):
+            chunk = values[i:i + RelationalDataResource._in_chunk_size]
+            cur.execute(self._sql("SELECT user_id, id FROM {} WHERE user_id IN ({})".format(
+                table, ", ".join("?" * len(chunk)))), chunk)
+            ids.update(cur.fetchall())
+        return ids
+
+    def _insert_ignore(self):
+        return "INSERT OR IGNORE" if self.dialect == "sqlite" else "INSERT IGNORE"
+
+    def _count(self, cur, relationship, pairs, delta):
+        """
+        Adds delta to the outward counter of every src and the inward counter of every dst, and increments the
+        version of both.
+
+        :param pairs: List of (src id, dst id) whose edge was created or deleted.
+        """
+        if not pairs:
+            return
+        out, inward = degree_property(relationship, "outward"), degree_property(relationship, "inward")
+        cur.executemany(self._sql("UPDATE users SET {c} = {c} + ?, {v} = {v} + 1 WHERE id = ?".format(
+            c=out, v=version_property)), [(delta, a) for a, _ in pairs])
+        cur.executemany(self._sql("UPDATE users SET {c} = {c} + ?, {v} = {v} + 1 WHERE id = ?".format(
+            c=inward, v=version_property)), [(delta, b) for _, b in pairs])
+
+    def _recount(self, cur, relationship, ids):
+        """
+        Sets the counters of relationship on ids from the edges, for bulk writes where per-edge deltas are unknown.
+        """
+        ids = list(ids)
+        for i in range(0, len(ids), RelationalDataResource._in_chunk_size):
+            chunk = ids[i:i + RelationalDataResource._in_chunk_size]
+            cur.execute(self._sql(
+                "UPDATE users SET "
+                "{out} = (SELECT COUNT(*) FROM edges e WHERE e.src = users.id AND e.type = ?), "
+                "{inward} = (SELECT COUNT(*) FROM edges e WHERE e.dst = users.id AND e.type = ?), "
+                "{version} = {version} + 1 "
+                "WHERE id IN ({ids})".format(out=degree_property(relationship, "outward"),
+                                             inward=degree_property(relationship, "inward"),
+                                             version=version_property, ids=", ".join("?" * len(chunk)))),
+                [relationship, relationship] + chunk)
+
+    def _insert_edges(self, cur, relationship, pairs, timestamp):
+        """
+
+        :param pairs: List of (src id, dst id).
+        :return: The pairs that were created, existing edges are left as they are.
+        """
+        created = []
+        sql = self._sql("{} INTO edges (src, type, dst, timestamp) VALUES (?, ?, ?, ?)".format(self._insert_ignore()))
+        for a, b in pairs:
+            cur.execute(sql, (a, relationship, b, timestamp))
+            if cur.rowcount == 1:
+                created.append((a, b))
+        self._count(cur, relationship, created, 1)
+        return created
+
+    def _pair(self, cur, template_a, template_b):
+        a = self._node_ids(cur, template_a)
+        b = self._node_ids(cur, template_b)
+        return a, b
+
+    @pooled(READ)
+    def find_nodes_by_template(self, tmp):
+        label = tmp.get("label", None)
+        condition, params = self._node_filter(label, tmp.get("template", None))
+
+        def work(cur):
+            cur.execute(self._sql("SELECT n.user_id, n.properties FROM {} n WHERE {}".format(
+                self._table(label), condition)), params)
+            return [self._node(*row) for row in cur.fetchall()]
+        return self._run(work)
+
+    @pooled(WRITE)
+    def create_node(self, label, **kwargs):
+        key = RelationalDataResource._cursor_key
+        if key not in kwargs:
+            raise ValueError("Node must have a {}".format(key))
+        table = self._table(label)
+        properties = {k: v for k, v in kwargs.items() if k != key}
+        for k in properties:
+            check_identifier(k)
+
+        def work(cur):
+            cur.execute(self._sql("INSERT INTO {} (user_id, properties) VALUES (?, ?)".format(table)),
+                        (kwargs[key], json.dumps(properties)))
+
+        try:
+            self._run(work, readonly=False)
+        except Exception as e:
+            logging.error("Error {} Create node: ".format(self.dialect) + str(e))
+            raise Exception(e)
+        return dict(kwargs)
+
+    @pooled(WRITE)
+    def merge_nodes(self, label, key, values):
+        """
+        Creates one node per value, skipping existing ones, with one batched INSERT.
+
+        :return: Number of nodes created.
+        """
+        check_identifier(key, (RelationalDataResource._cursor_key,))
+        rows = [(v, "{}") for v in dict.fromkeys(values)]
+
+        def work(cur):
+            cur.executemany(self._sql("{} INTO {} (user_id, properties) VALUES (?, ?)".format(
+                self._insert_ignore(), self._table(label))), rows)
+            return cur.rowcount
+        return self._run(work, readonly=False) if rows else 0
+
+    @pooled(WRITE)
+    def merge_relationships(self, label, key, relationship, rows):
+        """
+        Bulk version of create_relationship for imports, in both directions, creating missing nodes. One transaction.
+
+        :param rows: List of {"a": key value, "b": key value, "timestamp": str}.
+        :return: Number of relationships created.
+        """
+        check_identifier(key, (RelationalDataResource._cursor_key,))
+        check_identifier(relationship, RelationalDataResource._relationships)
+        table = self._table(label)
+        values = list(dict.fromkeys(v for row in rows for v in (row["a"], row["b"])))
+
+        def work(cur):
+            cur.executemany(self._sql("{} INTO {} (user_id, properties) VALUES (?, ?)".format(
+                self._insert_ignore(), table)), [(v, "{}") for v in values])
+            ids = self._resolve_ids(cur, label, values)
+            edges = []
+            for row in rows:
+                a, b = ids[row["a"]], ids[row["b"]]
+                edges.append((a, relationship, b, row["timestamp"]))
+                edges.append((b, relationship, a, row["timestamp"]))
+            cur.executemany(self._sql("{} INTO edges (src, type, dst, timestamp) VALUES (?, ?, ?, ?)".format(
+                self._insert_ignore())), edges)
+            created = cur.rowcount
+            if created:
+                self._recount(cur, relationship, set(ids.values()))
+            return created
+        return self._run(work, readonly=False) if rows else 0
+
+    @pooled(WRITE)
+    def create_relationship(self, template_a, template_b, relationship):
+        """
+        Creates the relationship (a)-[relationship]->(b) unless it already exists, in one transaction.
+
+        :return: Dictionary with the relationship type, its properties and whether it was newly created.
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+        timestamp = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        def work(cur):
+            a, b = self._pair(cur, template_a, template_b)
+            if not a or not b:
+                return None
+            created = bool(self._insert_edges(cur, relationship, [(a[0], b[0])], timestamp))
+            cur.execute(self._sql("SELECT timestamp FROM edges WHERE src = ? AND type = ? AND dst = ?"),
+                        (a[0], relationship, b[0]))
+            return {"timestamp": cur.fetchone()[0], "relationship": relationship, "created": created}
+
+        try:
+            result = self._run(work, readonly=False)
+        except Exception as e:
+            logging.error("Error {} Create relationship: ".format(self.dialect) + str(e))
+            raise Exception(e)
+
+        if result is None:
+            # To distinguish whether it is not found or error
+            raise Exception("Node not found for relationship {}".format(relationship))
+        return result
+
+    def _delete_edges(self, cur, relationship, pairs):
+        """
+
+        :param pairs: List of (src id, dst id).
+        :return: Number of edges deleted.
+        """
+        deleted = []
+        sql = self._sql("DELETE FROM edges WHERE src = ? AND type = ? AND dst = ?")
+        for a, b in pairs:
+            cur.execute(sql, (a, relationship, b))
+            if cur.rowcount == 1:
+                deleted.append((a, b))
+        self._count(cur, relationship, deleted, -1)
+        return len(deleted)
+
+    @pooled(WRITE)
+    def delete_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+
+        def work(cur):
+            a, b = self._pair(cur, template_a, template_b)
+            return self._delete_edges(cur, relationship, [(x, y) for x in a for y in b])
+        return self._run(work, readonly=False)
+
+    @pooled(WRITE)
+    def accept_relationship(self, template_a, template_b, pending, relationship):
+        """
+        Replaces the pending request (b)-[pending]->(a) with relationship in both directions, in one transaction.
+
+        :return: Number of pending relationships removed.
+        """
+        check_identifier(pending, RelationalDataResource._relationships)
+        check_identifier(relationship, RelationalDataResource._relationships)
+        timestamp = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        def work(cur):
+            a, b = self._pair(cur, template_a, template_b)
+            if not a or not b:
+                return None
+            self._insert_edges(cur, relationship, [(a[0], b[0]), (b[0], a[0])], timestamp)
+            return self._delete_edges(cur, pending, [(b[0], a[0])])
+
+        try:
+            result = self._run(work, readonly=False)
+        except Exception as e:
+            logging.error("Error {} Accept relationship: ".format(self.dialect) + str(e))
+            raise Exception(e)
+
+        if result is None:
+            # To distinguish whether it is not found or error
+            raise Exception("Node not found for relationship {}".format(relationship))
+        return result
+
+    @pooled(WRITE)
+    def delete_bidirectional_relationship(self, template_a, template_b, relationship):
+        """
+
+        :return: Number of relationships deleted.
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+
+        def work(cur):
+            a, b = self._pair(cur, template_a, template_b)
+            pairs = [(x, y) for x in a for y in b]
+            return self._delete_edges(cur, relationship, pairs + [(y, x) for x, y in pairs])
+        return self._run(work, readonly=False)
+
+    def find_statement(self, template, relationship, direction, limit=10, offset=None, whereclause=None, cursor=None,
+                       order_by=None):
+        """
+        Same selection and order as Neo4JDataResource.find_statement. Node properties are one JSON column, so
+        fields are projected by the caller.
+
+        :return: Tuple of (SQL text, parameters).
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+        terms = self._order_terms(order_by, cursor)
+        label = template.get("label", None)
+        table = self._table(label)
+        condition, params = self._node_filter(label, template.get("template", None))
+
+        # (n)-[relationship]->(m) walks the (src, type, dst) key, (n)<-[relationship]-(m) the (dst, type, src) index
+        near, far = ("src", "dst") if direction == "outward" else ("dst", "src")
+        sql = ("SELECT m.user_id, m.properties FROM edges e JOIN {table} m ON m.id = e.{far} "
+               "WHERE e.{near} IN (SELECT n.id FROM {table} n WHERE {condition}) AND e.type = ?").format(
+            table=table, far=far, near=near, condition=condition)
+        params.append(relationship)
+
+        where, where_params = self._node_filter(label, whereclause, alias="m")
+        sql += " AND " + where
+        params += where_params
+
+        key = RelationalDataResource._cursor_key
+        if cursor is None:
+            order = ", ".join("{}.{}{}".format("e" if k == "timestamp" else "m", k, " DESC" if d else "")
+                              for k, d in terms)
+            sql += " ORDER BY {} LIMIT ? OFFSET ?".format(order)
+            params += [int(limit), int(offset) if offset else 0]
+        elif "after" in cursor:
+            sql += " AND m.{key} > ? ORDER BY m.{key} LIMIT ?".format(key=key)
+            params += [cursor["after"], int(limit)]
+        elif "before" in cursor:
+            sql += " AND m.{key} < ? ORDER BY m.{key} DESC LIMIT ?".format(key=key)
+            params += [cursor["before"], int(limit)]
+        else:
+            sql += " ORDER BY m.{} LIMIT ?".format(key)
+            params.append(int(limit))
+
+        return self._sql(sql), params
+
+    @pooled(READ)
+    def _find_by_node_relationship(self, template, relationship, direction, limit, offset, whereclause, cursor,
+                                   fields, order_by):
+        fields = self._projection(fields)
+        sql, params = self.find_statement(template, relationship, direction, limit, offset, whereclause, cursor,
+                                          order_by)
+
+        def work(cur):
+            cur.execute(sql, params)
+            return cur.fetchall()
+        rows = self._run(work)
+
+        # Pages before a cursor are fetched in descending order; hand them back ascending.
+        if cursor and "before" in cursor:
+            rows = reversed(rows)
+        nodes = [self._node(*row) for row in rows]
+        if fields is None:
+            return nodes
+        return [{f: node.get(f) for f in fields} for node in nodes]
+
+    @pooled(READ)
+    def find_by_node_relationship_outward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                          cursor=None, fields=None, order_by=None):
+        return self._find_by_node_relationship(template, relationship, "outward", limit, offset, whereclause, cursor,
+                                               fields, order_by)
+
+    @pooled(READ)
+    def find_by_node_relationship_inward(self, template, relationship, limit=10, offset=None, whereclause={},
+                                         cursor=None, fields=None, order_by=None):
+        return self._find_by_node_relationship(template, relationship, "inward", limit, offset, whereclause, cursor,
+                                               fields, order_by)
+
+    @pooled(READ)
+    def find_first_by_nodes_relationship(self, label, key, values, relationship, direction="outward", limit=10):
+        """
+        One query per _in_chunk_size nodes; ROW_NUMBER over each node's edges keeps its first limit neighbours.
+
+        :return: Dictionary of {key value: {"nodes": [...], "count": degree}}.
+        """
+        check_identifier(key, (RelationalDataResource._cursor_key,))
+        check_identifier(relationship, RelationalDataResource._relationships)
+        table = self._table(label)
+        near, far = ("src", "dst") if direction == "outward" else ("dst", "src")
+        values = list(dict.fromkeys(values))
+        chunk_size = RelationalDataResource._in_chunk_size - 2
+
+        def work(cur):
+            res = {}
+            for i in range(0, len(values), chunk_size):
+                chunk = values[i:i + chunk_size]
+                marks = ", ".join("?" * len(chunk))
+                cur.execute(self._sql("SELECT user_id, {count} FROM {table} WHERE user_id IN ({marks})".format(
+                    count=degree_property(relationship, direction), table=table, marks=marks)), chunk)
+                for value, count in cur.fetchall():
+                    res[value] = {"nodes": [], "count": count}
+
+                cur.execute(self._sql(
+                    "SELECT owner, user_id, properties FROM ("
+                    "SELECT n.user_id AS owner, m.user_id, m.properties, "
+                    "ROW_NUMBER() OVER (PARTITION BY e.{near} ORDER BY m.user_id) AS position "
+                    "FROM {table} n JOIN edges e ON e.{near} = n.id AND e.type = ? JOIN {table} m ON m.id = e.{far} "
+                    "WHERE n.user_id IN ({marks})) t WHERE position <= ? ORDER BY owner, user_id").format(
+                    near=near, far=far, table=table, marks=marks), [relationship] + chunk + [int(limit)])
+                for owner, user_id, properties in cur.fetchall():
+                    res[owner]["nodes"].append(self._node(user_id, properties))
+            return res
+        return self._run(work)
+
+    @pooled(READ)
+    def find_by_node_relationship_mutual(self, template_a, template_b, relationship):
+        """
+        Joins the two (src, type, dst) key ranges on dst.
+
+        :return: List of node property dictionaries ordered by _cursor_key.
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+        label_a, label_b = template_a.get("label", None), template_b.get("label", None)
+        condition_a, params = self._node_filter(label_a, template_a.get("template", None), alias="a")
+        condition_b, params_b = self._node_filter(label_b, template_b.get("template", None), alias="b")
+        table = self._table(label_a)
+        sql = ("SELECT DISTINCT m.user_id, m.properties FROM edges ea "
+               "JOIN edges eb ON eb.dst = ea.dst AND eb.type = ea.type "
+               "JOIN {table} m ON m.id = ea.dst "
+               "WHERE ea.src IN (SELECT a.id FROM {table} a WHERE {a}) AND ea.type = ? "
+               "AND eb.src IN (SELECT b.id FROM {table_b} b WHERE {b}) "
+               "ORDER BY m.{key}").format(table=table, table_b=self._table(label_b), a=condition_a, b=condition_b,
+                                          key=RelationalDataResource._cursor_key)
+        params = params + [relationship] + params_b
+
+        def work(cur):
+            cur.execute(self._sql(sql), params)
+            return cur.fetchall()
+        return [self._node(*row) for row in self._run(work)]
+
+    @pooled(READ)
+    def find_two_hop_by_node_relationship(self, template, relationship, exclude=(), limit=10, fanout=100):
+        """
+        Reads at most fanout edges per intermediate, with one LIMITed subquery per intermediate joined by
+        UNION ALL, counts the candidates and keeps the best limit with a bounded heap. Ties go to the older node.
+
+        :return: List of (node property dictionary, score) tuples, highest score first.
+        """
+        check_identifier(relationship, RelationalDataResource._relationships)
+        excluded = [relationship] + [check_identifier(r, RelationalDataResource._relationships) for r in exclude]
+        table = self._table(template.get("label", None))
+        types = ", ".join("?" * len(excluded))
+        # Parameters per intermediate are (src, type, fanout)
+        chunk_size = RelationalDataResource._in_chunk_size // 3
+
+        def work(cur):
+            ids = self._node_ids(cur, template)
+            if not ids:
+                return []
+            n = ids[0]
+            cur.execute(self._sql("SELECT dst FROM edges WHERE src = ? AND type IN ({t}) "
+                                  "UNION SELECT src FROM edges WHERE dst = ? AND type IN ({t})".format(t=types)),
+                        [n] + excluded + [n] + excluded)
+            skip = {row[0] for row in cur.fetchall()}
+            skip.add(n)
+
+            cur.execute(self._sql("SELECT dst FROM edges WHERE src = ? AND type = ?"), (n, relationship))
+            intermediates = [row[0] for row in cur.fetchall()]
+
+            scores = {}
+            for i in range(0, len(intermediates), chunk_size):
+                chunk = intermediates[i:i + chunk_size]
+                cur.execute(self._sql(" UNION ALL ".join(
+                    ["SELECT dst FROM (SELECT dst FROM edges WHERE src = ? AND type = ? LIMIT ?) f"] * len(chunk))),
+                    [p for f in chunk for p in (f, relationship, int(fanout))])
+                for (m,) in cur.fetchall():
+                    if m not in skip:
+                        scores[m] = scores.get(m, 0) + 1
+
+            best = heapq.nsmallest(int(limit), scores.items(), key=lambda item: (-item[1], item[0]))
+            if not best:
+                return []
+            cur.execute(self._sql("SELECT id, user_id, properties FROM {} WHERE id IN ({})".format(
+                table, ", ".join("?" * len(best)))), [m for m, _ in best])
+            nodes = {row[0]: self._node(row[1], row[2]) for row in cur.fetchall()}
+            return [(nodes[m], score) for m, score in best if m in nodes]
+        return self._run(work)
+
+    @pooled(READ)
+    def find_relationships_between(self, template, key, values, relationships):
+        """
+        Resolves the values to ids, then reads the edges from and to n for those ids on the key and the dst index.
+
+        :return: Dictionary of {key value: [(relationship, direction), ...]}.
+        """
+        check_identifier(key, (RelationalDataResource._cursor_key,))
+        types = [check_identifier(r, RelationalDataResource._relationships) for r in relationships]
+        label = template.get("label", None)
+        values = list(dict.fromkeys(values))
+        # Parameters per query are n, the types and the chunk of ids
+        chunk_size = RelationalDataResource._in_chunk_size - len(types) - 1
+
+        def work(cur):
+            res = {}
+            ids = self._node_ids(cur, template)
+            if not ids or not types:
+                return res
+            n = ids[0]
+            by_id = {nid: value for value, nid in self._resolve_ids(cur, label, values).items()}
+            targets = list(by_id)
+            for i in range(0, len(targets), chunk_size):
+                chunk = targets[i:i + chunk_size]
+                marks = ", ".join("?" * len(chunk))
+                for near, far, direction in (("src", "dst", "outward"), ("dst", "src", "inward")):
+                    cur.execute(self._sql("SELECT {far}, type FROM edges WHERE {near} = ? AND type IN ({t}) "
+                                          "AND {far} IN ({m})".format(near=near, far=far, m=marks,
+                                                                      t=", ".join("?" * len(types)))),
+                                [n] + types + chunk)
+                    for m, relationship in cur.fetchall():
+                        res.setdefault(by_id[m], []).append((relationship, direction))
+            return res
+        return self._run(work)
+
+    @pooled(READ)
+    def get_version(self, template):
+        label = template.get("label", None)
+        condition, params = self._node_filter(label, template.get("template", None))
+
+        def work(cur):
+            cur.execute(self._sql("SELECT n.{} FROM {} n WHERE {} LIMIT 1".format(
+                version_property, self._table(label), condition)), params)
+            return cur.fetchone()
+        row = self._run(work)
+        return row[0] if row else None
+
+    @pooled(READ)
+    def get_degrees(self, template):
+        """
+
+        :return: {relationship: {"outward": count, "inward": count}} read from the counter columns, None if no
+            node matches.
+        """
+        label = template.get("label", None)
+        condition, params = self._node_filter(label, template.get("template", None))
+        columns = RelationalDataResource._degree_columns
+
+        def work(cur):
+            cur.execute(self._sql("SELECT {} FROM {} n WHERE {} LIMIT 1".format(
+                ", ".join("n." + column for _, _, column in columns), self._table(label), condition)), params)
+            return cur.fetchone()
+        row = self._run(work)
+        if row is None:
+            return None
+
+        degrees = {relationship: {} for relationship in RelationalDataResource._relationships}
+        for (relationship, direction, _), count in zip(columns, row):
+            degrees[relationship][direction] = count
+        return degrees
+
+    def _iter_chunks(self, first, after, key):
+        """
+        Streams a keyset scan, one query per chunk, so no connection is held while the caller consumes rows.
+
+        :param first: Query for the first chunk, taking the chunk size as its only parameter.
+        :param after: Query for the next chunks, taking the key of the last row seen and then the chunk size.
+        :param key: Function from a row to its key parameters.
+        :return: Generator of rows.
+        """
+        sql, params = first, []
+        while True:
+            def work(cur):
+                cur.execute(self._sql(sql), params + [RelationalDataResource._iter_chunk_size])
+                return cur.fetchall()
+            rows = self._run(work)
+            for row in rows:
+                yield row
+            if len(rows) < RelationalDataResource._iter_chunk_size:
+                return
+            sql, params = after, key(rows[-1])
+
+    @pooled(READ)
+    def iter_nodes(self, label):
+        """
+
+        :return: Generator of node property dictionaries, read in id order a chunk at a time.
+        """
+        table = self._table(label)
+        first = "SELECT id, user_id, properties FROM {} ORDER BY id LIMIT ?".format(table)
+        after = "SELECT id, user_id, properties FROM {} WHERE id > ? ORDER BY id LIMIT ?".format(table)
+        for row in self._iter_chunks(first, after, lambda row: [row[0]]):
+            yield self._node(row[1], row[2])
+
+    @pooled(READ)
+    def iter_relationships(self, label, key, relationships):
+        """
+
+        :return: Generator of {"relationship": type, "from": key value, "to": key value, **properties}.
+        """
+        check_identifier(key, (RelationalDataResource._cursor_key,))
+        for relationship in relationships:
+            check_identifier(relationship, RelationalDataResource._relationships)
+        table = self._table(label)
+
+        types = ", ".join("'{}'".format(r) for r in relationships)
+        select = ("SELECT e.src, e.type, e.dst, e.timestamp, a.user_id, b.user_id FROM edges e "
+                  "JOIN {table} a ON a.id = e.src JOIN {table} b ON b.id = e.dst WHERE e.type IN ({types})").format(
+            table=table, types=types)
+        first = select + " ORDER BY e.src, e.type, e.dst LIMIT ?"
+        after = select + " AND (e.src, e.type, e.dst) > (?, ?, ?) ORDER BY e.src, e.type, e.dst LIMIT ?"
+        for row in self._iter_chunks(first, after, lambda row: [row[0], row[1], row[2]]):
+            yield {"relationship": row[1], "from": row[4], "to": row[5], "timestamp": row[3]}
+
+    @pooled(WRITE)
+    def update_node(self, label, keys, data):
+        key = RelationalDataResource._cursor_key
+        for k in data.keys():
+            check_identifier(k)
+        table = self._table(label)
+        condition, params = self._node_filter(label, keys)
+
+        def work(cur):
+            cur.execute(self._sql("SELECT n.id, n.user_id, n.properties FROM {} n WHERE {}".format(
+                table, condition)), params)
+            result = []
+            for nid, user_id, properties in cur.fetchall():
+                node = self._node(user_id, properties)
+                node.update(data)
+                cur.execute(self._sql("UPDATE {} SET user_id = ?, properties = ? WHERE id = ?".format(table)),
+                            (node[key], json.dumps({k: v for k, v in node.items() if k != key}), nid))
+                result.append(str({"n": node}))
+            return result
+        return self._run(work, readonly=False)
+
+    @pooled(WRITE)
+    def delete_node(self, template):
+        """
+        Deletes the matching nodes together with their relationships. Edges are removed by two range deletes on
+        the (src, type, dst) key and the (dst, type, src) index, in one transaction.
+
+        :return: {"nodes": nodes deleted, "relationships": relationships deleted}, None if nothing matched.
+        """
+        table = self._table(template.get("label", None))
+
+        def work(cur):
+            ids = self._node_ids(cur, template)
+            relationships = 0
+            for nid in ids:
+                # Neighbours lose one relationship per edge to or from the node
+                for relationship, direction, column in RelationalDataResource._degree_columns:
+                    near, far = ("dst", "src") if direction == "outward" else ("src", "dst")
+                    cur.execute(self._sql("UPDATE {t} SET {c} = {c} - 1, {v} = {v} + 1 WHERE id IN "
+                                          "(SELECT {far} FROM edges WHERE {near} = ? AND type = ?)".format(
+                                              t=table, c=column, v=version_property, far=far, near=near)),
+                                (nid, relationship))
+                cur.execute(self._sql("DELETE FROM edges WHERE src = ?"), (nid,))
+                relationships += cur.rowcount
+                cur.execute(self._sql("DELETE FROM edges WHERE dst = ?"), (nid,))
+                relationships += cur.rowcount
+                cur.execute(self._sql("DELETE FROM {} WHERE id = ?".format(table)), (nid,))
+            return {"nodes": len(ids), "relationships": relationships}
+
+        try:
+            result = self._run(work, readonly=False)
+        except Exception as e:
+            logging.error("Error {} Delete: ".format(self.dialect) + str(e))
+            # To distinguish whether it is not found or error
+            raise Exception(e)
+
+        if result["nodes"]:
+            return result
+        else:
+            return None
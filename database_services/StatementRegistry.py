@@ -0,0 +1,104 @@
+import re
+import time
+import threading
+
+# Labels, relationship types and property keys cannot be Cypher parameters, so the few that end up in
+# statement text are checked against this pattern before a statement is built.
+_identifier_pattern = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def check_identifier(name, allowed=None):
+    """
+
+    :param name: Label, relationship type or property key that will be placed in a statement.
+    :param allowed: Optional collection of the only accepted values.
+    :return: name, if it is safe to use.
+    """
+    if not isinstance(name, str) or not _identifier_pattern.match(name):
+        raise ValueError("Invalid identifier: {}".format(name))
+    if allowed is not None and name not in allowed:
+        raise ValueError("Unsupported identifier: {}".format(name))
+    return name
+
+
+class PreparedStatement:
+    """
+    A named, fully parameterized Cypher statement. The text never changes between executions, so the
+    server-side plan cache is hit after the first run. Keeps hit and latency counters.
+    """
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, error=False):
+        with self._lock:
+            self.hits += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if error:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "errors": self.errors,
+                "total_ms": round(self.total_time * 1000, 3),
+                "avg_ms": round(self.total_time * 1000 / self.hits, 3) if self.hits else 0.0,
+                "max_ms": round(self.max_time * 1000, 3),
+            }
+
+
+class StatementRegistry:
+    """
+    Client-side registry of named prepared statements.
+    """
+
+    def __init__(self):
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, name, build):
+        """
+
+        :param name: Unique name of the statement.
+        :param build: Zero argument callable returning the statement text. Only called the first time name is seen.
+        :return: The PreparedStatement registered under name.
+        """
+        statement = self._statements.get(name, None)
+        if statement is None:
+            with self._lock:
+                statement = self._statements.get(name, None)
+                if statement is None:
+                    statement = PreparedStatement(name, build())
+                    self._statements[name] = statement
+        return statement
+
+    def get(self, name):
+        return self._statements[name]
+
+    def run(self, runner, statement, params):
+        """
+
+        :param runner: Callable taking (text, params) that executes the statement, e.g. Graph.run.
+        :param statement: The PreparedStatement to execute.
+        :param params: Dictionary of parameters.
+        :return: Whatever runner returns.
+        """
+        start = time.perf_counter()
+        try:
+            result = runner(statement.text, params)
+        except Exception:
+            statement.record(time.perf_counter() - start, error=True)
+            raise
+        statement.record(time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        return {name: s.stats() for name, s in sorted(self._statements.items())}
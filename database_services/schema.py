@@ -0,0 +1,126 @@
+"""
+Idempotent schema migrations for the Neo4j friends graph, run at startup.
+
+Each migration lists its statement in Neo4j 4.4+/5 syntax first and the older 4.x syntax second;
+the first one the server accepts wins. IF NOT EXISTS makes re-running a schema migration a no-op. Data
+migrations, listed in run_once, are recorded as a SchemaMigration node when applied and skipped afterwards.
+"""
+import logging
+
+from database_services.BaseDataResource import degree_property
+from database_services.Neo4JDataResource import Neo4JDataResource
+
+migrations = [
+    ("user_user_id_unique", [
+        "CREATE CONSTRAINT user_user_id_unique IF NOT EXISTS FOR (n:user) REQUIRE n.user_id IS UNIQUE",
+        "CREATE CONSTRAINT user_user_id_unique IF NOT EXISTS ON (n:user) ASSERT n.user_id IS UNIQUE",
+    ]),
+    ("friend_timestamp", [
+        "CREATE INDEX friend_timestamp IF NOT EXISTS FOR ()-[r:FRIEND]-() ON (r.timestamp)",
+    ]),
+    ("pending_friend_timestamp", [
+        "CREATE INDEX pending_friend_timestamp IF NOT EXISTS FOR ()-[r:PENDING_FRIEND]-() ON (r.timestamp)",
+    ]),
+]
+
+# Users created before degree counters were maintained get them counted once. New users only get the counters
+# of relationships they have, so the IS NULL filter would keep matching them: the migration is recorded instead.
+_degree_counts = ", ".join(
+    "n.{} = size([{} | 1])".format(degree_property(relationship, direction),
+                                   "(n)-[:{}]->()" if direction == "outward" else "(n)<-[:{}]-()").format(relationship)
+    for relationship in Neo4JDataResource._relationships for direction in ("outward", "inward"))
+migrations.append(("user_degree_counters", [
+    "MATCH (n:user) WHERE n.{} IS NULL CALL {{ WITH n SET {} }} IN TRANSACTIONS OF 10000 ROWS".format(
+        degree_property("FRIEND", "outward"), _degree_counts),
+    "MATCH (n:user) WHERE n.{} IS NULL SET {}".format(degree_property("FRIEND", "outward"), _degree_counts),
+]))
+
+run_once = {"user_degree_counters"}
+
+# The lookups behind /friends/<user>, /pending and /pending_request.
+hot_queries = [
+    ("FRIEND", "outward"),
+    ("PENDING_FRIEND", "inward"),
+    ("PENDING_FRIEND", "outward"),
+]
+
+
+def migrate(db_resource):
+    """
+
+    :param db_resource: A Neo4JDataResource.
+    :return: Dictionary of {migration name: True if applied or already present, False if it failed}.
+    """
+    applied = {record["name"] for record in db_resource.run_q("MATCH (m:SchemaMigration) RETURN m.name AS name", {})}
+
+    result = {}
+    for name, statements in migrations:
+        if name in applied:
+            result[name] = True
+            continue
+
+        result[name] = False
+        for statement in statements:
+            try:
+                db_resource.run_write(statement, {})
+                result[name] = True
+                break
+            except Exception as e:
+                error = e
+        if result[name]:
+            if name in run_once:
+                db_resource.run_write("MERGE (m:SchemaMigration {name: $name})", {"name": name})
+            logging.info("Schema migration {} applied".format(name))
+        else:
+            # A unique constraint cannot be created while duplicate users exist.
+            logging.error("Schema migration {} failed, e = {}".format(name, error))
+
+    return result
+
+
+def _plan_operators(plan):
+    operators = [plan.get("operatorType", "")]
+    for child in plan.get("children", []):
+        operators.extend(_plan_operators(child))
+    return operators
+
+
+def report_index_usage(db_resource):
+    """
+    Runs EXPLAIN on the hot relationship lookups and logs the operators that find the starting node.
+
+    :param db_resource: A Neo4JDataResource.
+    :return: Dictionary of {statement name: list of plan operators}.
+    """
+    template = {"label": "user", "template": {"user_id": ""}}
+    report = {}
+    for relationship, direction in hot_queries:
+        name, build, params = db_resource.find_statement(template, relationship, direction)
+        try:
+            plan = db_resource.explain(name, build, params)
+        except Exception as e:
+            logging.error("EXPLAIN {} failed, e = {}".format(name, e))
+            continue
+
+        operators = _plan_operators(plan or {})
+        report[name] = operators
+
+        seeks = [o for o in operators if "Index" in o]
+        if seeks:
+            logging.info("{} uses {}".format(name, ", ".join(seeks)))
+        else:
+            logging.warning("{} uses no index, operators = {}".format(name, ", ".join(operators)))
+
+    return report
+
+
+def bootstrap(db_resource):
+    """
+    Applies the migrations and reports index usage. Only Neo4j resources have a schema to manage.
+    """
+    if not isinstance(db_resource, Neo4JDataResource):
+        return None
+
+    result = migrate(db_resource)
+    report_index_usage(db_resource)
+    return result
@@ -5,13 +5,21 @@ def lambda_handler(event, context):
         '/friends/<user>',
         '/friends/<user>/pending',
         '/friends/<user>/pending_request',
+        '/friends/<user>/count',
+        '/friends/<user>/mutual/<other>',
+        '/friends/<user>/suggestions',
+        '/friends/<user>/status',
         '/friends/<user>/accept',
         '/friends/<user>/decline',
         '/friends/<user>/add',
         '/friends/<user>/cancel',
         '/friends/<user>/delete',
         '/friends/insert',
+        '/friends/insert/bulk',
+        '/friends/batch',
         '/friends/delete',
+        '/export/friends',
+        '/stats/cache',
     ]
     return {
         'statusCode': 200,
@@ -1,24 +1,50 @@
 
 import os
+import atexit
+import logging
+import threading
 from database_services.Neo4JDataResource import Neo4JDataResource
+from database_services.MemoryDataResource import MemoryDataResource
+from database_services.RelationalDataResource import RelationalDataResource
+from database_services.AsyncDataResource import AsyncDataResource
 
-def get_db_info():
+# One data resource per process, shared by every request thread. Created lazily by get_db_resource().
+_db_resource = None
+_async_db_resource = None
+_db_resource_lock = threading.Lock()
+
+def get_db_info(db_type=None):
     """
+    :param db_type: Backend to connect to, DBTYPE by default.
     :return: A dictionary with connect info for DB
     """
-    db_type = os.environ.get("DBTYPE", None)
+    db_type = db_type or os.environ.get("DBTYPE", None)
     db_host = os.environ.get("DBHOST", None)
     db_port = os.environ.get("DBPORT", None)
     db_user = os.environ.get("DBUSER", None)
     db_password = os.environ.get("DBPASSWORD", None)
+    # SQLite file, or database (schema) name on a MySQL server
+    db_name = os.environ.get("DBNAME", None)
 
-    if db_host is not None:
+    if db_type == "memory":
+        # In-process graph, nothing to connect to
+        db_info = {
+            "type": db_type,
+        }
+    elif db_type == "sqlite":
+        # Local file, nothing to connect to
+        db_info = {
+            "type": db_type,
+            "database": db_name or "friends.db",
+        }
+    elif db_host is not None:
         db_info = {
             "type": db_type,
             "host": db_host,
             "user": db_user,
             "password": db_password,
             "port": db_port,
+            "database": db_name,
         }
     else:
         db_info = {
@@ -31,23 +57,114 @@ def get_db_info():
 
     return db_info
 
+def get_pool_info():
+    """
+    :return: A dictionary with the connection pool settings for the DB
+    """
+    pool_info = {
+        "size": int(os.environ.get("DBPOOL_SIZE", 50)),
+        "max_lifetime": int(os.environ.get("DBPOOL_MAX_LIFETIME", 3600)),
+        "timeout": float(os.environ.get("DBPOOL_TIMEOUT", 30)),
+        "routing": os.environ.get("DBROUTING", "false").lower() == "true",
+    }
+
+    return pool_info
+
+def _create_neo4j(db_info, pool_info):
+    return Neo4JDataResource(
+        auth=(db_info['user'], db_info['password']),
+        host=db_info['host'],
+        port=db_info['port'],
+        secure=False,
+        pool_size=pool_info['size'],
+        max_lifetime=pool_info['max_lifetime'],
+        pool_timeout=pool_info['timeout'],
+        routing=pool_info['routing'],
+    )
+
+def _create_memory(db_info, pool_info):
+    return MemoryDataResource()
+
+def _create_sqlite(db_info, pool_info):
+    return RelationalDataResource(
+        dialect="sqlite",
+        database=db_info['database'],
+        pool_size=pool_info['size'],
+        max_lifetime=pool_info['max_lifetime'],
+        pool_timeout=pool_info['timeout'],
+    )
+
+def _create_mysql(db_info, pool_info):
+    return RelationalDataResource(
+        dialect="mysql",
+        database=db_info['database'] or "friends",
+        auth=(db_info['user'], db_info['password']),
+        host=db_info['host'],
+        port=db_info['port'],
+        pool_size=pool_info['size'],
+        max_lifetime=pool_info['max_lifetime'],
+        pool_timeout=pool_info['timeout'],
+    )
+
+# DBTYPE -> factory(db_info, pool_info). A new backend subclasses BaseDataResource, passes
+# tools.conformance and is registered here.
+backends = {
+    "neo4j": _create_neo4j,
+    "memory": _create_memory,
+    "sqlite": _create_sqlite,
+    "mysql": _create_mysql,
+}
+
+def create_db_resource(db_info, pool_info):
+    """
+    :return: A data resource for db_info['type'], or None for an unknown type.
+    """
+    factory = backends.get(db_info['type'], None)
+    if factory is None:
+        return None
+
+    return factory(db_info, pool_info)
+
 def get_db_resource():
-    db_info = get_db_info()
-
-    if db_info['type'] == 'neo4j':
-        db_resource = Neo4JDataResource(
-            auth=(db_info['user'], db_info['password']),
-            host=db_info['host'],
-            port=db_info['port'],
-            secure=False,
-        )
-    elif db_info['type'] == 'neptune':
-        # db_resource = NeptuneDataResource(
-        #     auth=(db_info['user'], db_info['password']),
-        #     host=db_info['host'],
-        #     port=db_info['port'],
-        #     secure=False,
-        # )
-        pass
-
-    return db_resource
\ No newline at end of file
+    """
+    :return: The process-wide data resource, created on first call. Thread safe.
+    """
+    global _db_resource
+
+    if _db_resource is None:
+        with _db_resource_lock:
+            if _db_resource is None:
+                _db_resource = create_db_resource(get_db_info(), get_pool_info())
+
+    return _db_resource
+
+def get_async_db_resource():
+    """
+    :return: The process-wide asyncio front end for get_db_resource(), with one worker per pooled connection.
+    """
+    global _async_db_resource
+
+    if _async_db_resource is None:
+        db_resource = get_db_resource()
+        with _db_resource_lock:
+            if _async_db_resource is None:
+                _async_db_resource = AsyncDataResource(db_resource, max_workers=get_pool_info()['size'])
+
+    return _async_db_resource
+
+def close_db_resource():
+    """
+    Closes the process-wide data resource, if one was created. The next get_db_resource() call creates a new one.
+    """
+    global _db_resource, _async_db_resource
+
+    with _db_resource_lock:
+        if _async_db_resource is not None:
+            _async_db_resource.close()
+            _async_db_resource = None
+        if _db_resource is not None:
+            logging.info("Closing DB resource, pool stats = {}".format(_db_resource.pool_stats()))
+            _db_resource.close()
+            _db_resource = None
+
+atexit.register(close_db_resource)
@@ -20,23 +20,31 @@ after_request_dict = {
 }
 
 def notify_sns(request):
-    inputs = rest_utils.RESTContext(request)
+    # The route's context, so the body is not parsed a second time
+    inputs = rest_utils.get_context(request)
     if inputs.endpoint in after_request_dict:
         if inputs.method in after_request_dict[inputs.endpoint]:
             try:
                 user_id = inputs.path.split("/")[2]
                 friend_id = inputs.data["friend_id"]
-                message = {
-                    "user_id": user_id,
-                    "friend_id": friend_id,
-                }
-                
-                client = boto3.client('sns', region_name="us-east-1")
-                sns_response = client.publish(
-                    TargetArn=os.environ.get("SNS_ARN", None),
-                    Message=json.dumps({'default': json.dumps(message)}),
-                    Subject=after_request_dict[request.endpoint][request.method]["subject"],
-                    MessageStructure='json'
-                )
+                publish(inputs.endpoint, inputs.method, user_id, friend_id)
             except Exception as e:
-                logger.error("notify_sns, e = {}".format(e))
\ No newline at end of file
+                logger.error("notify_sns, e = {}".format(e))
+
+def publish(endpoint, method, user_id, friend_id):
+    """
+    Publishes the SNS message for a friend request change. Used by both the Flask and the ASGI app.
+    """
+    message = {
+        "user_id": user_id,
+        "friend_id": friend_id,
+    }
+
+    client = boto3.client('sns', region_name="us-east-1")
+    sns_response = client.publish(
+        TargetArn=os.environ.get("SNS_ARN", None),
+        Message=json.dumps({'default': json.dumps(message)}),
+        Subject=after_request_dict[endpoint][method]["subject"],
+        MessageStructure='json'
+    )
+    return sns_response
@@ -0,0 +1,34 @@
+import pytest
+
+import middleware.context as context
+from middleware import notification
+from application_services.FriendsResource.friends_service import FriendsResource
+from database_services.MemoryDataResource import MemoryDataResource
+
+
+def _clear_caches():
+    FriendsResource._list_cache.clear()
+    FriendsResource._mutual_cache.clear()
+    FriendsResource._status_cache.clear()
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    """
+    A fresh in-memory graph as the process-wide data resource, with the FriendsResource caches emptied.
+    """
+    db_resource = MemoryDataResource()
+    monkeypatch.setattr(context, "_db_resource", db_resource)
+    _clear_caches()
+    yield db_resource
+    _clear_caches()
+
+
+@pytest.fixture
+def client(memory_db, monkeypatch):
+    """
+    Test client of the Flask app over memory_db. SNS notifications are dropped.
+    """
+    import application
+    monkeypatch.setattr(notification, "publish", lambda *args: None)
+    return application.application.test_client()
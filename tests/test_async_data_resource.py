@@ -0,0 +1,44 @@
+import time
+import asyncio
+
+import pytest
+
+from database_services.AsyncDataResource import AsyncDataResource
+from database_services.MemoryDataResource import MemoryDataResource
+
+
+def _collect(db, func, *args):
+    async def collect():
+        return [item async for item in db.stream(func, *args)]
+    return asyncio.run(asyncio.wait_for(collect(), timeout=5))
+
+
+@pytest.fixture
+def db():
+    db = AsyncDataResource(MemoryDataResource(), max_workers=2)
+    yield db
+    db.close()
+
+
+def test_stream_yields_every_item(db):
+    assert _collect(db, range, 1234) == list(range(1234))
+
+
+def test_stream_raises_when_func_fails(db):
+    def fail():
+        raise ValueError("bad arguments")
+
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        _collect(db, fail)
+    # Reaches the consumer at once instead of when the wait times out
+    assert time.perf_counter() - start < 1
+
+
+def test_stream_raises_when_the_generator_fails(db):
+    def items():
+        yield 1
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        _collect(db, items)
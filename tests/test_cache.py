@@ -0,0 +1,96 @@
+import time
+
+from utils.cache import LRUCache, create_cache
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_drops_every_entry_with_the_tag():
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("ab", 1, tags=("a", "b"))
+    cache.set("a", 2, tags=("a",))
+    cache.set("b", 3, tags=("b",))
+
+    assert cache.invalidate("a") == 2
+    assert cache.get("ab") is None
+    assert cache.get("a") is None
+    assert cache.get("b") == 3
+    # The dropped entries no longer count under their other tags
+    assert cache.invalidate("b") == 1
+    assert cache.invalidate("a") == 0
+    assert len(cache) == 0
+
+
+def test_evicted_entry_leaves_its_tags():
+    cache = LRUCache(max_size=1, ttl=60)
+    cache.set("a", 1, tags=("t",))
+    cache.set("b", 2)
+    assert cache.invalidate("t") == 0
+    assert cache.get("b") == 2
+
+
+def test_entries_expire():
+    cache = LRUCache(max_size=10, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_size_zero_disables_the_cache():
+    cache = LRUCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_stats():
+    cache = create_cache("test", max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"], stats["hit_ratio"]) == (1, 1, 1, 0.5)
+
+
+def _ids(rsp):
+    assert rsp.status_code == 200
+    return [m["user_id"] for m in rsp.get_json()["friend_list"]]
+
+
+def test_list_pages_are_served_from_the_cache(client, memory_db):
+    memory_db.merge_nodes(label="user", key="user_id", values=["a", "b"])
+    assert _ids(client.get("/friends/a")) == []
+
+    calls = []
+    find = memory_db.find_by_node_relationship_outward
+    memory_db.find_by_node_relationship_outward = lambda *args, **kwargs: calls.append(args) or find(*args, **kwargs)
+    assert _ids(client.get("/friends/a")) == []
+    assert calls == []
+
+
+def test_writes_invalidate_the_lists_they_change(client, memory_db):
+    memory_db.merge_nodes(label="user", key="user_id", values=["a", "b"])
+    for path in ("/friends/a", "/friends/b", "/friends/a/pending", "/friends/b/pending_request"):
+        client.get(path)
+
+    assert client.post("/friends/b/add", json={"friend_id": "a"}).status_code == 201
+    assert _ids(client.get("/friends/a/pending")) == ["b"]
+    assert _ids(client.get("/friends/b/pending_request")) == ["a"]
+
+    assert client.post("/friends/a/accept", json={"friend_id": "b"}).status_code == 201
+    assert _ids(client.get("/friends/a")) == ["b"]
+    assert _ids(client.get("/friends/b")) == ["a"]
+    assert _ids(client.get("/friends/a/pending")) == []
+
+    assert client.delete("/friends/a/delete", json={"friend_id": "b"}).status_code == 204
+    assert _ids(client.get("/friends/b")) == []
@@ -0,0 +1,74 @@
+import pytest
+
+from utils import rest_utils
+
+
+def test_make_etag():
+    assert rest_utils.make_etag(12) == 'W/"12"'
+    assert rest_utils.make_etag(3, 0) == 'W/"3.0"'
+    assert rest_utils.make_etag(3, None) is None
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('W/"12"', True),
+    ('"12"', True),
+    ('"11", W/"12"', True),
+    ("*", True),
+    ('W/"1"', False),
+    ('W/"120"', False),
+    ("", False),
+])
+def test_etag_matches(header, expected):
+    assert rest_utils.etag_matches({"If-None-Match": header}, 'W/"12"') is expected
+
+
+def test_etag_matches_any_header_case():
+    assert rest_utils.etag_matches({"if-none-match": 'W/"12"'}, 'W/"12"')
+
+
+def test_etag_matches_without_header_or_etag():
+    assert not rest_utils.etag_matches({}, 'W/"12"')
+    assert not rest_utils.etag_matches({"If-None-Match": "*"}, None)
+
+
+def _counting(db, name, calls):
+    method = getattr(db, name)
+
+    def counted(*args, **kwargs):
+        calls.append(name)
+        return method(*args, **kwargs)
+    setattr(db, name, counted)
+
+
+def test_matching_etag_is_answered_304_without_a_query(client, memory_db):
+    memory_db.merge_nodes(label="user", key="user_id", values=["a", "b"])
+    rsp = client.get("/friends/a/pending")
+    etag = rsp.headers["ETag"]
+    assert rsp.status_code == 200
+
+    calls = []
+    for name in ("get_version", "find_by_node_relationship_inward"):
+        _counting(memory_db, name, calls)
+    rsp = client.get("/friends/a/pending", headers={"If-None-Match": etag})
+    assert rsp.status_code == 304
+    assert rsp.headers["ETag"] == etag
+    assert calls == []
+
+
+def test_write_changes_the_etag(client, memory_db):
+    memory_db.merge_nodes(label="user", key="user_id", values=["a", "b"])
+    etags = {path: client.get(path).headers["ETag"]
+             for path in ("/friends/a/pending", "/friends/b/pending_request", "/friends/a/count")}
+
+    assert client.post("/friends/b/add", json={"friend_id": "a"}).status_code == 201
+    for path, etag in etags.items():
+        rsp = client.get(path, headers={"If-None-Match": etag})
+        assert rsp.status_code == 200, path
+        assert rsp.headers["ETag"] != etag
+    assert [m["user_id"] for m in client.get("/friends/a/pending").get_json()["friend_list"]] == ["b"]
+
+
+def test_unknown_user_has_no_etag(client, memory_db):
+    rsp = client.get("/friends/nobody", headers={"If-None-Match": "*"})
+    assert rsp.status_code == 200
+    assert "ETag" not in rsp.headers
@@ -0,0 +1,24 @@
+"""
+Runs the backend conformance checks of tools.conformance against the backends that need no server.
+"""
+import pytest
+
+import middleware.context as context
+from tools import conformance
+
+
+@pytest.fixture(scope="module", params=["memory", "sqlite"])
+def db(request, tmp_path_factory):
+    if request.param == "sqlite":
+        db_info = {"type": "sqlite", "database": str(tmp_path_factory.mktemp("sqlite") / "friends.db")}
+    else:
+        db_info = {"type": request.param}
+    db_resource = context.create_db_resource(db_info, context.get_pool_info())
+    yield db_resource
+    db_resource.close()
+
+
+@pytest.mark.parametrize("check", conformance.checks, ids=lambda check: check.__name__)
+def test_conformance(db, check):
+    with conformance.check_users(db) as users:
+        check(db, users)
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from database_services.ConnectionPool import ConnectionPool, ConnectionPoolTimeout, pooled, READ
+
+
+class Resource:
+
+    def __init__(self, max_size=1):
+        self._pool = ConnectionPool(max_size=max_size, timeout=0.2)
+
+    @pooled(READ)
+    def call(self):
+        return self._pool.stats()["in_use"]
+
+    @pooled(READ)
+    def nested(self):
+        return self.call()
+
+    @pooled(READ)
+    def items(self, n):
+        for i in range(n):
+            yield i, self.call()
+
+    @pooled(READ)
+    def listed(self, n, barrier=None):
+        if barrier is not None:
+            # Every thread holds its slot before any generator starts
+            barrier.wait(timeout=5)
+        return list(self.items(n))
+
+
+def _depth(resource):
+    return getattr(resource._pool._local, "depth", 0)
+
+
+def test_nested_calls_share_the_slot():
+    resource = Resource(max_size=1)
+    assert resource.nested() == 1
+    assert _depth(resource) == 0
+    assert resource.call() == 1
+
+
+def test_interleaved_generators_release_their_slots():
+    resource = Resource(max_size=2)
+    a, b = resource.items(3), resource.items(3)
+    pairs = list(zip(a, b))
+    assert [(x[0], y[0]) for x, y in pairs] == [(i, i) for i in range(3)]
+    # Each open generator holds a slot of its own
+    assert pairs[-1] == ((2, 2), (2, 2))
+    list(a)
+    list(b)
+
+    assert _depth(resource) == 0
+    assert resource._pool.stats()["in_use"] == 0
+    assert resource.call() == 1
+
+
+def test_closed_generator_releases_its_slot():
+    resource = Resource(max_size=1)
+    items = resource.items(5)
+    next(items)
+    items.close()
+    assert resource._pool.stats()["in_use"] == 0
+    assert resource.call() == 1
+
+
+def test_open_generator_is_not_reentrant():
+    resource = Resource(max_size=1)
+    items = resource.items(5)
+    next(items)
+    with pytest.raises(ConnectionPoolTimeout):
+        resource.call()
+    items.close()
+
+
+def test_exhausted_pool_times_out():
+    resource = Resource(max_size=1)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold():
+        with resource._pool.acquire():
+            holding.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    with pytest.raises(ConnectionPoolTimeout):
+        resource.call()
+    release.set()
+    thread.join()
+    assert resource._pool.stats()["timeouts"] == 1
+
+
+def test_close_waits_for_holders():
+    resource = Resource(max_size=2)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold():
+        with resource._pool.acquire():
+            holding.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    assert resource._pool.close(timeout=0.05) is False
+    with pytest.raises(ConnectionPoolTimeout):
+        resource.call()
+
+    release.set()
+    thread.join()
+    assert resource._pool.close(timeout=1) is True
+
+
+def test_pooled_call_consuming_a_pooled_generator_shares_its_slot():
+    resource = Resource(max_size=1)
+    assert resource.listed(3) == [(0, 1), (1, 1), (2, 1)]
+    assert resource._pool.stats()["in_use"] == 0
+    assert resource._pool.stats()["timeouts"] == 0
+
+
+def test_threads_consuming_pooled_generators_fit_the_pool():
+    size = 4
+    resource = Resource(max_size=size)
+    barrier = threading.Barrier(size)
+    results, errors = [], []
+
+    def consume():
+        try:
+            results.append(resource.listed(50, barrier))
+        except ConnectionPoolTimeout as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=consume) for _ in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(results) == size
+    assert resource._pool.stats()["peak_in_use"] <= size
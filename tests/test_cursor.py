@@ -0,0 +1,60 @@
+import pytest
+
+from database_services.MemoryDataResource import MemoryDataResource
+from utils import rest_utils
+
+
+def test_cursor_round_trip():
+    token = rest_utils.encode_cursor({"after": "user-7"})
+    assert rest_utils.decode_cursor(token) == {"after": "user-7"}
+
+
+def test_empty_cursor_is_first_page():
+    assert rest_utils.decode_cursor("") == {}
+    assert rest_utils.decode_cursor(None) == {}
+
+
+def test_tampered_cursor_is_rejected():
+    token = rest_utils.encode_cursor({"after": "user-7"})
+    payload, _, signature = token.rpartition(".")
+    forged = rest_utils.encode_cursor({"after": "user-8"}).rpartition(".")[0] + "." + signature
+    with pytest.raises(ValueError):
+        rest_utils.decode_cursor(forged)
+    with pytest.raises(ValueError):
+        rest_utils.decode_cursor(payload + ".x")
+
+
+def test_cursor_signed_with_another_secret_is_rejected(monkeypatch):
+    monkeypatch.setenv("CURSOR_SECRET", "one")
+    token = rest_utils.encode_cursor({"after": "user-7"})
+    monkeypatch.setenv("CURSOR_SECRET", "two")
+    with pytest.raises(ValueError):
+        rest_utils.decode_cursor(token)
+
+
+def test_unset_cursor_secret_is_reported(monkeypatch, caplog):
+    monkeypatch.delenv("CURSOR_SECRET", raising=False)
+    assert rest_utils.check_cursor_secret() is False
+    assert "CURSOR_SECRET" in caplog.text
+    monkeypatch.setenv("CURSOR_SECRET", "secret")
+    assert rest_utils.check_cursor_secret() is True
+
+
+def test_cursor_pages_walk_the_list():
+    db = MemoryDataResource()
+    friends = ["f{}".format(i) for i in range(7)]
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": "a", "b": f, "timestamp": "2021-01-01 00:00:00"} for f in friends])
+    template = {"label": "user", "template": {"user_id": "a"}}
+
+    pages, cursor = [], {}
+    while True:
+        page = [m["user_id"] for m in db.find_by_node_relationship_outward(template, "FRIEND", limit=3, cursor=cursor)]
+        if not page:
+            break
+        pages.append(page)
+        cursor = rest_utils.decode_cursor(rest_utils.encode_cursor({"after": page[-1]}))
+    assert pages == [friends[0:3], friends[3:6], friends[6:]]
+
+    before = db.find_by_node_relationship_outward(template, "FRIEND", limit=3, cursor={"before": "f5"})
+    assert [m["user_id"] for m in before] == friends[2:5]
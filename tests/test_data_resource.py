@@ -0,0 +1,24 @@
+import pytest
+
+from database_services.ConnectionPool import ConnectionPool
+from database_services.MemoryDataResource import MemoryDataResource
+
+
+@pytest.fixture
+def db():
+    return MemoryDataResource()
+
+
+def test_pool_stats_has_the_pool_shape(db):
+    assert db.pool_stats().keys() == ConnectionPool(max_size=1).stats().keys()
+    db.close()
+    assert db.pool_stats()["closed"] is True
+
+
+def test_graph_stats(db):
+    db.merge_nodes(label="user", key="user_id", values=["a", "b"])
+    db.create_relationship({"label": "user", "template": {"user_id": "a"}},
+                           {"label": "user", "template": {"user_id": "b"}}, relationship="FRIEND")
+    stats = db.graph_stats()
+    assert stats["nodes"] == 2
+    assert stats["relationships"]["FRIEND"] == 1
@@ -0,0 +1,33 @@
+import pytest
+
+import middleware.context as context
+from application_services.FriendsResource.friends_service import FriendsResource
+from database_services.MemoryDataResource import MemoryDataResource
+from utils import rest_utils
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db_resource = MemoryDataResource()
+    monkeypatch.setattr(context, "_db_resource", db_resource)
+    return db_resource
+
+
+def test_insert_users_in_batches(db):
+    res = FriendsResource.insert_users(["a", "b", "c"], batch_size=2)
+    assert (res["received"], res["created"], res["existing"]) == (3, 3, 0)
+    assert len(res["batches"]) == 2
+    assert "error" not in res
+
+
+def test_insert_users_reports_the_bad_record(db):
+    lines = ['{"user_id": "a"}', '{"user_id": "b"}', "", '{"user_id": "c"}', "{bad", '{"user_id": "d"}']
+    users = rest_utils.iter_ids(rest_utils.iter_ndjson(lines), "user_id")
+    res = FriendsResource.insert_users(users, batch_size=2)
+
+    # a and b are committed, c is in the batch with the bad record and is not
+    assert (res["received"], res["created"]) == (2, 2)
+    assert res["error"]["record"] == 4
+    assert res["error"]["message"].startswith("Line 5:")
+    assert FriendsResource.insert_users(["c"])["created"] == 1
+    assert FriendsResource.insert_users(["a", "b"])["existing"] == 2
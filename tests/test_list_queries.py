@@ -0,0 +1,57 @@
+import pytest
+
+from database_services.MemoryDataResource import MemoryDataResource
+
+
+@pytest.fixture
+def db():
+    return MemoryDataResource()
+
+
+@pytest.mark.parametrize("order_by, terms", [
+    (None, [("user_id", False)]),
+    ([], [("user_id", False)]),
+    (["-timestamp"], [("timestamp", True), ("user_id", False)]),
+    (["timestamp", "-timestamp"], [("timestamp", False), ("user_id", False)]),
+    (["-user_id", "timestamp"], [("user_id", True)]),
+])
+def test_order_terms(db, order_by, terms):
+    assert db._order_terms(order_by) == terms
+
+
+@pytest.mark.parametrize("order_by", [["nickname"], ["--timestamp"], ["user_id) DESC"]])
+def test_order_terms_rejects_unsupported_keys(db, order_by):
+    with pytest.raises(ValueError):
+        db._order_terms(order_by)
+
+
+def test_order_terms_with_cursor(db):
+    assert db._order_terms(["user_id"], cursor={}) == [("user_id", False)]
+    for order_by in (["-timestamp"], ["-user_id"]):
+        with pytest.raises(ValueError):
+            db._order_terms(order_by, cursor={"after": "a"})
+
+
+def test_projection(db):
+    assert db._projection(None) is None
+    assert db._projection(["name", "city", "name"]) == ["city", "name", "user_id"]
+    with pytest.raises(ValueError):
+        db._projection(["a b"])
+    with pytest.raises(ValueError):
+        db._projection(["f{}".format(i) for i in range(MemoryDataResource._max_fields)])
+
+
+def test_fields_and_order_by_through_the_route(client, memory_db):
+    memory_db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                                  rows=[{"a": "a", "b": b, "timestamp": t}
+                                        for b, t in (("b", "2021-01-02 00:00:00"), ("c", "2021-01-03 00:00:00"),
+                                                     ("d", "2021-01-01 00:00:00"))])
+    memory_db.update_node("user", {"user_id": "c"}, {"name": "Cy", "city": "Paris"})
+
+    rsp = client.get("/friends/a?order_by=-timestamp&fields=name")
+    assert rsp.status_code == 200
+    friends = rsp.get_json()["friend_list"]
+    assert [m["user_id"] for m in friends] == ["c", "b", "d"]
+    assert friends[0] == {"user_id": "c", "name": "Cy"}
+
+    assert client.get("/friends/a?order_by=name").status_code == 400
@@ -0,0 +1,32 @@
+from database_services import schema
+
+
+class Resource:
+    """
+    Records the statements of a migration run, like a Neo4JDataResource on a server with nothing to migrate.
+    """
+
+    def __init__(self):
+        self.migrations = set()
+        self.writes = []
+
+    def run_q(self, qs, args):
+        return [{"name": name} for name in self.migrations]
+
+    def run_write(self, qs, args):
+        self.writes.append(qs)
+        if qs.startswith("MERGE (m:SchemaMigration"):
+            self.migrations.add(args["name"])
+        return []
+
+
+def test_data_migrations_run_once():
+    db = Resource()
+    assert all(schema.migrate(db).values())
+    assert db.migrations == schema.run_once
+    first = len(db.writes)
+
+    assert all(schema.migrate(db).values())
+    rerun = db.writes[first:]
+    assert len(rerun) == len(schema.migrations) - len(schema.run_once)
+    assert not any("degree" in qs or "_count" in qs for qs in rerun)
@@ -0,0 +1,461 @@
+"""
+Conformance checks for storage backends. Every backend registered in middleware.context.backends must pass them.
+
+    DBTYPE=memory python -m tools.conformance
+    python -m tools.conformance --backend neo4j     # connection settings from env.sh
+
+Each check works on users with a random prefix and deletes them afterwards, but the node and relationship
+iteration checks scan the whole graph, so point it at a development database.
+"""
+import sys
+import uuid
+import logging
+import argparse
+import traceback
+from contextlib import contextmanager
+
+import middleware.context as context
+
+logger = logging.getLogger()
+
+
+class ConformanceError(Exception):
+    pass
+
+
+def expect(condition, message, *args):
+    if not condition:
+        raise ConformanceError(message.format(*args))
+
+
+def _template(user):
+    return {"label": "user", "template": {"user_id": user}}
+
+
+def _ids(nodes):
+    return [n["user_id"] for n in nodes]
+
+
+def check_create_node(db, users):
+    a = users("a")
+    res = db.create_node(label="user", user_id=a)
+    expect(res.get("user_id") == a, "create_node returned {}", res)
+    expect(_ids(db.find_nodes_by_template(_template(a))) == [a], "created node not found")
+    try:
+        db.create_node(label="user", user_id=a)
+    except Exception:
+        pass
+    else:
+        raise ConformanceError("create_node accepted a duplicate user_id")
+
+
+def check_merge_nodes(db, users):
+    a, b = users("a"), users("b")
+    db.create_node(label="user", user_id=a)
+    created = db.merge_nodes(label="user", key="user_id", values=[a, b, b])
+    expect(created == 1, "merge_nodes created {} nodes, expected 1", created)
+    created = db.merge_nodes(label="user", key="user_id", values=[a, b])
+    expect(created == 0, "merge_nodes created {} existing nodes", created)
+
+
+def check_create_relationship(db, users):
+    a, b = users("a"), users("b")
+    db.merge_nodes(label="user", key="user_id", values=[a, b])
+    res = db.create_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+    expect(res["relationship"] == "PENDING_FRIEND" and res["created"] is True, "create_relationship returned {}", res)
+    expect("timestamp" in res, "relationship has no timestamp: {}", res)
+    res = db.create_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+    expect(res["created"] is False, "repeated create_relationship created a second relationship")
+
+    expect(_ids(db.find_by_node_relationship_outward(_template(a), "PENDING_FRIEND")) == [b], "outward lookup")
+    expect(_ids(db.find_by_node_relationship_inward(_template(b), "PENDING_FRIEND")) == [a], "inward lookup")
+    expect(db.find_by_node_relationship_outward(_template(b), "PENDING_FRIEND") == [], "relationship is directed")
+
+    try:
+        db.create_relationship(_template(a), _template(users("missing")), relationship="PENDING_FRIEND")
+    except Exception:
+        pass
+    else:
+        raise ConformanceError("create_relationship to a missing node did not raise")
+
+
+def check_delete_relationship(db, users):
+    a, b = users("a"), users("b")
+    db.merge_nodes(label="user", key="user_id", values=[a, b])
+    db.create_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+    deleted = db.delete_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+    expect(deleted == 1, "delete_relationship deleted {}", deleted)
+    deleted = db.delete_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+    expect(deleted == 0, "second delete_relationship deleted {}", deleted)
+    expect(db.find_by_node_relationship_outward(_template(a), "PENDING_FRIEND") == [], "relationship still found")
+
+
+def check_accept_relationship(db, users):
+    a, b = users("a"), users("b")
+    db.merge_nodes(label="user", key="user_id", values=[a, b])
+    db.create_relationship(_template(b), _template(a), relationship="PENDING_FRIEND")
+    removed = db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    expect(removed == 1, "accept_relationship removed {} pending relationships", removed)
+    expect(_ids(db.find_by_node_relationship_outward(_template(a), "FRIEND")) == [b], "FRIEND a->b missing")
+    expect(_ids(db.find_by_node_relationship_outward(_template(b), "FRIEND")) == [a], "FRIEND b->a missing")
+    expect(db.find_by_node_relationship_inward(_template(a), "PENDING_FRIEND") == [], "pending request left")
+
+    removed = db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    expect(removed == 0, "repeated accept_relationship removed {}", removed)
+    expect(len(db.find_by_node_relationship_outward(_template(a), "FRIEND")) == 1, "accept duplicated FRIEND")
+
+
+def check_delete_bidirectional_relationship(db, users):
+    a, b = users("a"), users("b")
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}])
+    deleted = db.delete_bidirectional_relationship(_template(a), _template(b), relationship="FRIEND")
+    expect(deleted == 2, "delete_bidirectional_relationship deleted {}", deleted)
+    deleted = db.delete_bidirectional_relationship(_template(b), _template(a), relationship="FRIEND")
+    expect(deleted == 0, "second delete_bidirectional_relationship deleted {}", deleted)
+
+
+def check_merge_relationships(db, users):
+    a, b, c = users("a"), users("b"), users("c")
+    db.create_node(label="user", user_id=a)
+    rows = [{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}, {"a": a, "b": c, "timestamp": "2021-01-01 00:00:00"}]
+    created = db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    expect(created == 4, "merge_relationships created {}, expected 4", created)
+    created = db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    expect(created == 0, "repeated merge_relationships created {}", created)
+    expect(sorted(_ids(db.find_by_node_relationship_outward(_template(a), "FRIEND"))) == [b, c], "merged friends")
+    expect(_ids(db.find_by_node_relationship_inward(_template(a), "FRIEND")) != [], "reverse direction missing")
+
+
+def check_pagination(db, users):
+    a = users("a")
+    friends = sorted(users("f{:02d}".format(i)) for i in range(7))
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": f, "timestamp": "2021-01-01 00:00:00"} for f in friends])
+
+    # Offset pages are ordered by user_id too, so together they hold every friend once
+    pages = [_ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=3, offset=o)) for o in (0, 3, 6)]
+    expect([len(p) for p in pages] == [3, 3, 1], "offset page sizes {}", [len(p) for p in pages])
+    expect(sum(pages, []) == friends, "offset pages {}", pages)
+
+    # Cursor pages are ordered by user_id
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=3, cursor={}))
+    expect(page == friends[:3], "first cursor page {}", page)
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=3, cursor={"after": friends[2]}))
+    expect(page == friends[3:6], "page after {}", page)
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=3, cursor={"before": friends[3]}))
+    expect(page == friends[:3], "page before {}", page)
+    page = _ids(db.find_by_node_relationship_inward(_template(a), "FRIEND", limit=3, cursor={"after": friends[5]}))
+    expect(page == friends[6:], "inward page after {}", page)
+
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", whereclause={"user_id": friends[4]}))
+    expect(page == [friends[4]], "where clause {}", page)
+
+
+def check_projection_and_order(db, users):
+    a = users("a")
+    friends = sorted(users("f{}".format(i)) for i in range(4))
+    # Two friends share a timestamp, so user_id has to break the tie
+    stamps = ["2021-01-03 00:00:00", "2021-01-01 00:00:00", "2021-01-03 00:00:00", "2021-01-02 00:00:00"]
+    for f, stamp in zip(friends, stamps):
+        db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                               rows=[{"a": a, "b": f, "timestamp": stamp}])
+        db.update_node("user", {"user_id": f}, {"nickname": f[-2:], "city": "NYC"})
+
+    page = db.find_by_node_relationship_outward(_template(a), "FRIEND", fields=["nickname", "missing"])
+    expect(page and all(sorted(m) == ["missing", "nickname", "user_id"] for m in page), "projected {}", page)
+    expect(page[0]["missing"] is None and page[0]["nickname"] == friends[0][-2:], "projected values {}", page[0])
+
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", order_by=["-timestamp"]))
+    expect(page == [friends[0], friends[2], friends[3], friends[1]], "newest first {}", page)
+    page = _ids(db.find_by_node_relationship_inward(_template(a), "FRIEND", limit=2, offset=1, order_by=["timestamp"]))
+    expect(page == [friends[3], friends[0]], "oldest first, second page {}", page)
+    page = _ids(db.find_by_node_relationship_outward(_template(a), "FRIEND", order_by=["-user_id"]))
+    expect(page == friends[::-1], "user_id descending {}", page)
+
+    page = db.find_by_node_relationship_outward(_template(a), "FRIEND", limit=2, cursor={"after": friends[0]},
+                                                fields=["city"], order_by=["user_id"])
+    expect(page == [{"user_id": f, "city": "NYC"} for f in friends[1:3]], "projected cursor page {}", page)
+
+    for kwargs in ({"order_by": ["nickname"]}, {"order_by": ["-timestamp"], "cursor": {}}, {"fields": ["a b"]}):
+        try:
+            db.find_by_node_relationship_outward(_template(a), "FRIEND", **kwargs)
+        except ValueError:
+            continue
+        raise ConformanceError("{} was not rejected with ValueError".format(kwargs))
+
+
+def check_update_node(db, users):
+    a, b = users("a"), users("b")
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}])
+    res = db.update_node("user", {"user_id": b}, {"nickname": "bee"})
+    expect(len(res) == 1, "update_node matched {} nodes", len(res))
+    friends = db.find_by_node_relationship_outward(_template(a), "FRIEND", whereclause={"nickname": "bee"})
+    expect(_ids(friends) == [b] and friends[0].get("nickname") == "bee", "updated property not returned")
+
+
+def check_iteration(db, users):
+    a, b = users("a"), users("b")
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}])
+    db.create_relationship(_template(a), _template(b), relationship="PENDING_FRIEND")
+
+    nodes = {n["user_id"] for n in db.iter_nodes(label="user") if n["user_id"] in (a, b)}
+    expect(nodes == {a, b}, "iter_nodes returned {}", nodes)
+
+    found = sorted((r["relationship"], r["from"], r["to"])
+                   for r in db.iter_relationships(label="user", key="user_id", relationships=["FRIEND", "PENDING_FRIEND"])
+                   if r["from"] in (a, b))
+    expect(found == [("FRIEND", a, b), ("FRIEND", b, a), ("PENDING_FRIEND", a, b)], "iter_relationships returned {}", found)
+
+
+def check_delete_node(db, users):
+    a, b = users("a"), users("b")
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}])
+    deleted = db.delete_node(_template(a))
+    expect(deleted == {"nodes": 1, "relationships": 2}, "delete_node deleted {}", deleted)
+    expect(db.find_nodes_by_template(_template(a)) == [], "deleted node still found")
+    expect(db.find_by_node_relationship_outward(_template(b), "FRIEND") == [], "relationships of deleted node left")
+    expect(db.delete_node(_template(a)) is None, "deleting a missing node should return None")
+
+
+def check_first_by_nodes(db, users):
+    a, b, lonely = users("a"), users("b"), users("lonely")
+    friends = sorted(users("f{}".format(i)) for i in range(4))
+    rows = [{"a": a, "b": f, "timestamp": "2021-01-01 00:00:00"} for f in friends]
+    rows.append({"a": b, "b": friends[0], "timestamp": "2021-01-01 00:00:00"})
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    db.merge_nodes(label="user", key="user_id", values=[lonely])
+
+    found = db.find_first_by_nodes_relationship("user", "user_id", [a, b, lonely, users("missing")], "FRIEND", limit=3)
+    found = {k: (_ids(v["nodes"]), v["count"]) for k, v in found.items()}
+    expected = {a: (friends[:3], 4), b: ([friends[0]], 1), lonely: ([], 0)}
+    expect(found == expected, "first pages {}", found)
+    found = db.find_first_by_nodes_relationship("user", "user_id", [friends[0]], "FRIEND", direction="inward", limit=5)
+    expect(sorted(_ids(found[friends[0]]["nodes"])) == sorted([a, b]), "inward first page {}", found)
+
+
+def check_mutual(db, users):
+    a, b = users("a"), users("b")
+    common = sorted(users("m{}".format(i)) for i in range(3))
+    rows = [{"a": x, "b": m, "timestamp": "2021-01-01 00:00:00"} for x in (a, b) for m in common]
+    rows.append({"a": a, "b": users("only_a"), "timestamp": "2021-01-01 00:00:00"})
+    rows.append({"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"})
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+
+    mutual = _ids(db.find_by_node_relationship_mutual(_template(a), _template(b), "FRIEND"))
+    expect(mutual == common, "mutual friends {}", mutual)
+    mutual = _ids(db.find_by_node_relationship_mutual(_template(b), _template(a), "FRIEND"))
+    expect(mutual == common, "mutual friends in reverse order {}", mutual)
+    mutual = db.find_by_node_relationship_mutual(_template(a), _template(users("missing")), "FRIEND")
+    expect(mutual == [], "mutual friends with a missing node {}", mutual)
+
+
+def check_two_hop(db, users):
+    a, f1, f2, f3 = users("a"), users("f1"), users("f2"), users("f3")
+    x, y, z, pending = users("x"), users("y"), users("z"), users("pending")
+    rows = [(a, f1), (a, f2), (a, f3), (f1, x), (f2, x), (f3, x), (f1, y), (f2, y), (f3, z), (f1, f2), (f1, pending)]
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": p, "b": q, "timestamp": "2021-01-01 00:00:00"} for p, q in rows])
+    db.create_relationship(_template(pending), _template(a), relationship="PENDING_FRIEND")
+
+    found = [(n["user_id"], score) for n, score in db.find_two_hop_by_node_relationship(
+        _template(a), "FRIEND", exclude=["PENDING_FRIEND"], limit=2)]
+    expect(found == [(x, 3), (y, 2)], "two hop top 2 {}", found)
+    found = {n["user_id"] for n, _ in db.find_two_hop_by_node_relationship(
+        _template(a), "FRIEND", exclude=["PENDING_FRIEND"], limit=10)}
+    expect(found == {x, y, z}, "two hop candidates {}, friends, self and pending must be excluded", found)
+
+    # With a fan-out of one every intermediate contributes at most one candidate
+    found = db.find_two_hop_by_node_relationship(_template(a), "FRIEND", exclude=["PENDING_FRIEND"], fanout=1)
+    expect(sum(score for _, score in found) <= 3, "fan-out cap ignored: {}", found)
+    expect(db.find_two_hop_by_node_relationship(_template(users("missing")), "FRIEND") == [], "missing node")
+
+
+def check_relationships_between(db, users):
+    a, f, p_in, p_out, stranger = users("a"), users("f"), users("in"), users("out"), users("stranger")
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": f, "timestamp": "2021-01-01 00:00:00"}])
+    db.merge_nodes(label="user", key="user_id", values=[p_in, p_out, stranger])
+    db.create_relationship(_template(p_in), _template(a), relationship="PENDING_FRIEND")
+    db.create_relationship(_template(a), _template(p_out), relationship="PENDING_FRIEND")
+
+    found = db.find_relationships_between(_template(a), "user_id", [f, p_in, p_out, stranger, users("missing")],
+                                          ["FRIEND", "PENDING_FRIEND"])
+    found = {k: sorted(v) for k, v in found.items()}
+    expected = {f: [("FRIEND", "inward"), ("FRIEND", "outward")], p_in: [("PENDING_FRIEND", "inward")],
+                p_out: [("PENDING_FRIEND", "outward")]}
+    expect(found == expected, "relationships between {}", found)
+    found = db.find_relationships_between(_template(a), "user_id", [f, p_in], ["PENDING_FRIEND"])
+    expect(found == {p_in: [("PENDING_FRIEND", "inward")]}, "relationship filter {}", found)
+
+
+def _counts(db, user):
+    degrees = db.get_degrees(_template(user))
+    return (degrees["FRIEND"]["outward"], degrees["FRIEND"]["inward"],
+            degrees["PENDING_FRIEND"]["outward"], degrees["PENDING_FRIEND"]["inward"])
+
+
+def check_degrees(db, users):
+    a, b, c = users("a"), users("b"), users("c")
+    expect(db.get_degrees(_template(a)) is None, "get_degrees of a missing node should return None")
+    db.merge_nodes(label="user", key="user_id", values=[a, b, c])
+    expect(_counts(db, a) == (0, 0, 0, 0), "new node has degrees {}", _counts(db, a))
+
+    db.create_relationship(_template(b), _template(a), relationship="PENDING_FRIEND")
+    db.create_relationship(_template(b), _template(a), relationship="PENDING_FRIEND")
+    db.create_relationship(_template(c), _template(a), relationship="PENDING_FRIEND")
+    expect(_counts(db, a) == (0, 0, 0, 2), "after two requests a has {}", _counts(db, a))
+    expect(_counts(db, b) == (0, 0, 1, 0), "after a request b has {}", _counts(db, b))
+
+    db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    db.delete_relationship(_template(c), _template(a), relationship="PENDING_FRIEND")
+    expect(_counts(db, a) == (1, 1, 0, 0), "after accept and decline a has {}", _counts(db, a))
+    expect(_counts(db, b) == (1, 1, 0, 0), "after accept b has {}", _counts(db, b))
+    expect(_counts(db, c) == (0, 0, 0, 0), "after decline c has {}", _counts(db, c))
+
+    db.delete_bidirectional_relationship(_template(b), _template(a), relationship="FRIEND")
+    expect(_counts(db, a) == (0, 0, 0, 0), "after delete friend a has {}", _counts(db, a))
+
+    rows = [{"a": a, "b": b, "timestamp": "2021-01-01 00:00:00"}, {"a": a, "b": c, "timestamp": "2021-01-01 00:00:00"}]
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND", rows=rows)
+    expect(_counts(db, a) == (2, 2, 0, 0), "after merge a has {}", _counts(db, a))
+    expect(_counts(db, c) == (1, 1, 0, 0), "after merge c has {}", _counts(db, c))
+
+    db.create_relationship(_template(a), _template(c), relationship="PENDING_FRIEND")
+    db.delete_node(_template(c))
+    expect(_counts(db, a) == (1, 1, 0, 0), "after deleting a friend a has {}", _counts(db, a))
+
+
+def check_versions(db, users):
+    a, b, c = users("a"), users("b"), users("c")
+    version = lambda user: db.get_version(_template(user))
+    expect(version(a) is None, "get_version of a missing node should return None")
+    db.merge_nodes(label="user", key="user_id", values=[a, b, c])
+    expect(version(a) == 0, "new node has version {}", version(a))
+
+    db.create_relationship(_template(b), _template(a), relationship="PENDING_FRIEND")
+    va, vb = version(a), version(b)
+    expect(va > 0 and vb > 0, "a request left versions {} and {}", va, vb)
+    db.create_relationship(_template(b), _template(a), relationship="PENDING_FRIEND")
+    db.delete_relationship(_template(c), _template(a), relationship="PENDING_FRIEND")
+    expect((version(a), version(b)) == (va, vb), "writes that changed nothing moved versions to {} and {}",
+           version(a), version(b))
+    expect(version(c) == 0, "an uninvolved node has version {}", version(c))
+
+    db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    expect(version(a) > va and version(b) > vb, "accept left versions {} and {}", version(a), version(b))
+    va, vb = version(a), version(b)
+    db.accept_relationship(_template(a), _template(b), pending="PENDING_FRIEND", relationship="FRIEND")
+    expect((version(a), version(b)) == (va, vb), "repeated accept moved versions to {} and {}",
+           version(a), version(b))
+
+    va = version(a)
+    db.merge_relationships(label="user", key="user_id", relationship="FRIEND",
+                           rows=[{"a": a, "b": c, "timestamp": "2021-01-01 00:00:00"}])
+    expect(version(a) > va and version(c) > 0, "merge left versions {} and {}", version(a), version(c))
+
+    va = version(a)
+    db.delete_node(_template(c))
+    expect(version(a) > va, "deleting a friend left version {}", version(a))
+
+
+def check_invalid_identifiers(db, users):
+    a = users("a")
+    for call in (lambda: db.find_by_node_relationship_outward(_template(a), "FRIEND) DETACH DELETE (n"),
+                 lambda: db.create_node(label="admin", user_id=a)):
+        try:
+            call()
+        except ValueError:
+            continue
+        raise ConformanceError("unsupported identifier was not rejected with ValueError")
+
+
+checks = [
+    check_create_node,
+    check_merge_nodes,
+    check_create_relationship,
+    check_delete_relationship,
+    check_accept_relationship,
+    check_delete_bidirectional_relationship,
+    check_merge_relationships,
+    check_pagination,
+    check_projection_and_order,
+    check_update_node,
+    check_iteration,
+    check_delete_node,
+    check_first_by_nodes,
+    check_mutual,
+    check_two_hop,
+    check_relationships_between,
+    check_degrees,
+    check_versions,
+    check_invalid_identifiers,
+]
+
+
+@contextmanager
+def check_users(db_resource):
+    """
+    Yields the users(name) function a check takes, which returns user ids with a random prefix, and deletes
+    those users afterwards.
+    """
+    prefix = "conformance-{}-".format(uuid.uuid4().hex[:8])
+    created = []
+
+    def users(name):
+        created.append(prefix + name)
+        return prefix + name
+
+    try:
+        yield users
+    finally:
+        for user in set(created):
+            try:
+                db_resource.delete_node(_template(user))
+            except Exception as e:
+                logger.warning("Cleanup of {} failed, e = {}".format(user, e))
+
+
+def run(db_resource):
+    """
+    Runs every check against db_resource.
+
+    :return: List of (check name, error message) for the checks that failed.
+    """
+    failures = []
+    for check in checks:
+        try:
+            with check_users(db_resource) as users:
+                check(db_resource, users)
+            logger.info("PASS {}".format(check.__name__))
+        except Exception as e:
+            logger.error("FAIL {}, e = {}".format(check.__name__, e))
+            logger.debug(traceback.format_exc())
+            failures.append((check.__name__, str(e)))
+
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a storage backend against the data resource contract.")
+    parser.add_argument("--backend", choices=sorted(context.backends), default=None,
+                        help="backend to check, DBTYPE by default")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db_info = context.get_db_info(args.backend)
+    db_resource = context.create_db_resource(db_info, context.get_pool_info())
+
+    failures = run(db_resource)
+    db_resource.close()
+    logger.info("{} of {} checks passed on {}".format(len(checks) - len(failures), len(checks), db_info["type"]))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Streaming NDJSON export of the whole friends graph, for analytics and backups.
+
+    python -m tools.export_graph [-o friends.ndjson.gz] [--gzip]
+
+Writes every user as {"type": "user", "user_id": ...} and then every FRIEND and PENDING_FRIEND relationship as
+{"type": "relationship", "relationship": ..., "from": ..., "to": ..., "timestamp": ...}, one per line.
+Output goes to stdout unless -o is given, and is gzipped with --gzip or when the file name ends in .gz.
+Records are read from the database a chunk of users at a time (one query per chunk), so memory use is bounded by
+the chunk size and the degree of the users in it, not by the size of the graph.
+"""
+import sys
+import time
+import logging
+import argparse
+
+from utils import rest_utils
+from application_services.FriendsResource.friends_service import FriendsResource
+
+logger = logging.getLogger()
+
+
+def export_graph(out, gzip=False):
+    """
+
+    :param out: Binary file object to write to.
+    :return: Number of records written.
+    """
+    count = [0]
+
+    def counted(records):
+        for record in records:
+            count[0] += 1
+            yield record
+
+    chunks = rest_utils.to_ndjson(counted(FriendsResource.export_graph()))
+    if gzip:
+        chunks = rest_utils.to_gzip(chunks)
+
+    for chunk in chunks:
+        out.write(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+
+    return count[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the friends graph as NDJSON.")
+    parser.add_argument("-o", "--output", default=None, help="output file, stdout by default")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    gzip = args.gzip or (args.output is not None and args.output.endswith(".gz"))
+
+    start = time.perf_counter()
+    if args.output is None:
+        count = export_graph(sys.stdout.buffer, gzip=gzip)
+    else:
+        with open(args.output, "wb") as out:
+            count = export_graph(out, gzip=gzip)
+    logger.info("Exported {} records in {:.1f}s".format(count, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Offline import of an existing friendship graph from an edge list.
+
+    python -m tools.import_graph edges.csv [--batch-size 5000] [--checkpoint edges.csv.checkpoint]
+
+The input is CSV (user_id,friend_id[,timestamp], optional header) or NDJSON with one
+{"user_id": ..., "friend_id": ..., "timestamp": ...} object or [user_id, friend_id, timestamp] list per line.
+Files ending in .gz are decompressed on the fly. Every edge becomes a FRIEND relationship in both directions;
+missing users are created. The file is streamed, so memory does not grow with its size.
+
+After each committed batch the number of input records consumed is written to the checkpoint file. Re-running
+the same command after a failure skips those records and carries on. The checkpoint is removed on success.
+"""
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import datetime as dt
+from itertools import islice
+
+import middleware.context as context
+
+logger = logging.getLogger()
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="")
+    return open(path, "r", newline="")
+
+
+def _detect_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+
+def read_edges(f, fmt):
+    """
+
+    :param f: Open text file.
+    :param fmt: "csv" or "ndjson".
+    :return: Generator of (user_id, friend_id, timestamp or None) tuples, one per input record.
+        Records that cannot be used yield None so that record counts stay aligned with the checkpoint.
+    """
+    if fmt == "csv":
+        for i, row in enumerate(csv.reader(f)):
+            if i == 0 and row and row[0].strip() == "user_id":
+                continue
+            if len(row) < 2:
+                yield None
+                continue
+            yield row[0].strip(), row[1].strip(), row[2].strip() if len(row) > 2 and row[2].strip() else None
+    else:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                value = json.loads(line)
+                if isinstance(value, dict):
+                    yield str(value["user_id"]), str(value["friend_id"]), value.get("timestamp", None)
+                else:
+                    yield str(value[0]), str(value[1]), value[2] if len(value) > 2 else None
+            except (ValueError, KeyError, IndexError, TypeError):
+                yield None
+
+
+def _dedupe(records, default_ts):
+    """
+    Drops unusable records and self loops, and collapses duplicate and reversed pairs within a batch.
+    """
+    rows = {}
+    for record in records:
+        if record is None:
+            continue
+        a, b, ts = record
+        if not a or not b or a == b:
+            continue
+        pair = (a, b) if a < b else (b, a)
+        if pair not in rows:
+            rows[pair] = {"a": pair[0], "b": pair[1], "timestamp": ts or default_ts}
+    return list(rows.values())
+
+
+def _read_checkpoint(path):
+    if not os.path.exists(path):
+        return {"records": 0, "created": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def import_graph(db_resource, path, fmt=None, batch_size=5000, checkpoint_path=None):
+    """
+
+    :return: Dictionary with the number of records read and relationships created.
+    """
+    fmt = fmt or _detect_format(path)
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    checkpoint = _read_checkpoint(checkpoint_path)
+    default_ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    if checkpoint["records"]:
+        logger.info("Resuming {} after {} records".format(path, checkpoint["records"]))
+
+    start = time.perf_counter()
+    with _open(path) as f:
+        records = read_edges(f, fmt)
+        # Skip what earlier runs already committed
+        for _ in islice(records, checkpoint["records"]):
+            pass
+
+        read = 0
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            rows = _dedupe(batch, default_ts)
+            if rows:
+                checkpoint["created"] += db_resource.merge_relationships(
+                    label="user", key="user_id", relationship="FRIEND", rows=rows)
+            read += len(batch)
+            checkpoint["records"] += len(batch)
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.perf_counter() - start
+            logger.info("{} records imported, {} relationships created, {:.0f} records/s".format(
+                checkpoint["records"], checkpoint["created"], read / elapsed if elapsed else 0))
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a friendship edge list into the friends graph.")
+    parser.add_argument("path", help="CSV or NDJSON edge list, optionally gzipped")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default=None,
+                        help="input format, detected from the file name by default")
+    parser.add_argument("--batch-size", type=int, default=5000, help="input records per transaction")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file, defaults to <path>.checkpoint")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    result = import_graph(context.get_db_resource(), args.path, fmt=args.format,
+                          batch_size=args.batch_size, checkpoint_path=args.checkpoint)
+    logger.info("Import finished, {} records, {} relationships created".format(result["records"], result["created"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import time
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache bounded by entry count, with a time to live per entry.
+
+    Entries can carry tags, e.g. the user ids a result depends on, and invalidate(tag) drops every entry with
+    that tag. Changes made by other processes are only picked up when entries expire, so keep ttl short or use
+    RedisCache.
+    """
+
+    def __init__(self, max_size=10000, ttl=60.0):
+        """
+
+        :param max_size: Entries kept; the least recently used is evicted first. 0 disables the cache.
+        :param ttl: Seconds an entry is served for.
+        """
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        # key -> (expires at, value, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return default
+            self._counters["hits"] += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def invalidate(self, tag):
+        """
+        Drops every entry set with tag.
+
+        :return: Number of entries dropped.
+        """
+        with self._lock:
+            keys = self._tags.pop(tag, ())
+            for key in list(keys):
+                self._remove(key)
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """
+
+        :return: Dictionary of hits, misses, evictions, invalidations, hit_ratio and size.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """
+        Removes key and its tag references. Caller holds the lock.
+        """
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """
+    Cache shared by every instance of the service, with the same methods as LRUCache. Values are stored as JSON.
+
+    Each tag is a Redis set of the keys stored with it, so invalidate(tag) reaches entries written by any
+    instance. clear() moves to a new generation of keys and lets the old one expire. Size is bounded by the
+    server's maxmemory policy rather than max_size. Redis errors are logged and treated as misses, so an
+    unavailable cache never fails a request.
+    """
+
+    def __init__(self, url, name, ttl=60.0):
+        """
+
+        :param url: Redis URL, e.g. redis://host:6379/0.
+        :param name: Prefix separating this cache's keys from other caches on the same server.
+        """
+        # Only needed when a shared cache is configured
+        import redis
+
+        self.ttl = float(ttl)
+        self._prefix = "friends:{}:".format(name)
+        self._redis = redis.Redis.from_url(url, socket_timeout=1.0)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] += n
+
+    def _namespace(self):
+        generation = self._redis.get(self._prefix + "generation")
+        return "{}{}:".format(self._prefix, int(generation or 0))
+
+    def get(self, key, default=None):
+        try:
+            value = self._redis.get(self._namespace() + "key:" + key)
+        except Exception as e:
+            logger.warning("Cache get {}, e = {}".format(key, e))
+            self._count("errors")
+            value = None
+        if value is None:
+            self._count("misses")
+            return default
+        self._count("hits")
+        return json.loads(value)
+
+    def set(self, key, value, tags=()):
+        try:
+            namespace = self._namespace()
+            pipe = self._redis.pipeline()
+            pipe.set(namespace + "key:" + key, json.dumps(value, default=str), px=int(self.ttl * 1000))
+            for tag in tags:
+                pipe.sadd(namespace + "tag:" + tag, key)
+                pipe.pexpire(namespace + "tag:" + tag, int(self.ttl * 1000))
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Cache set {}, e = {}".format(key, e))
+            self._count("errors")
+
+    def invalidate(self, tag):
+        try:
+            namespace = self._namespace()
+            keys = self._redis.smembers(namespace + "tag:" + tag)
+            pipe = self._redis.pipeline()
+            for key in keys:
+                pipe.delete(namespace + "key:" + key.decode("utf-8"))
+            pipe.delete(namespace + "tag:" + tag)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Cache invalidate {}, e = {}".format(tag, e))
+            self._count("errors")
+            return 0
+        self._count("invalidations", len(keys))
+        return len(keys)
+
+    def clear(self):
+        try:
+            self._redis.incr(self._prefix + "generation")
+        except Exception as e:
+            logger.warning("Cache clear, e = {}".format(e))
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def create_cache(name, max_size=10000, ttl=60.0, url=None):
+    """
+
+    :param url: Redis URL of a cache shared between instances. None for an in-process LRUCache.
+    :return: A cache with get, set, invalidate, clear and stats.
+    """
+    if url:
+        return RedisCache(url, name, ttl=ttl)
+    return LRUCache(max_size=max_size, ttl=ttl)
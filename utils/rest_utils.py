@@ -1,15 +1,30 @@
+import os
 import copy
-from flask import request
+import zlib
+from flask import g
 import json
 import logging
 from datetime import datetime
+from itsdangerous import URLSafeSerializer, BadSignature
 
 logger = logging.getLogger()
 
+# Marks a lazily read attribute that has not been read yet, as None is a valid value
+_unset = object()
+
+
 class RESTContext:
+    """
+    Inputs of one request. Use get_context(request), which builds it once per request and caches it on flask.g.
+    Headers and the JSON body are only read from the request the first time they are used.
+    """
 
     _default_limit = 10
 
+    # Filled in on first access
+    _headers = None
+    _data = _unset
+
     @classmethod
     def _de_array_args(cls, args):
         result = {}
@@ -25,29 +40,19 @@ class RESTContext:
 
     def __init__(self, request_context, path_parameters=None):
 
-        log_message = ""
+        self._request = request_context
 
         self.limit = RESTContext._default_limit
 
         self.path = request_context.path
         self.endpoint = request_context.endpoint
-
-        args = dict(request_context.args)
-
-        args = self._de_array_args(args)
-        self.path = request.path
-
-        self.data = None
-        self.headers = dict(request.headers)
-        self.method = request.method
-        self.host_url = request.host_url
+        self.method = request_context.method
+        self.host_url = request_context.host_url
 
         self.path_parameters = path_parameters
 
-        try:
-            self.data = request_context.get_json()
-        except Exception as e:
-            pass
+        args = dict(request_context.args)
+        args = self._de_array_args(args)
 
         args, limit = self._get_and_remove_arg(args, "limit")
         self.limit = limit
@@ -61,21 +66,30 @@ class RESTContext:
         args, fields = self._get_and_remove_arg(args, "fields")
         self.fields = fields
 
+        # Present (possibly empty) when the client asked for cursor pagination instead of offsets.
+        args, cursor = self._get_and_remove_arg(args, "cursor")
+        self.cursor = cursor
+
         self.args = args
 
-        try:
-            if request.data is not None:
-                data = request.json
-            else:
-                data = None
-        except Exception as e:
-            # This would fail the request in a more real solution.
-            data = "You sent something but I could not get JSON out of it."
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = self._load_headers()
+        return self._headers
 
-            log_message = str(datetime.now()) + ": Method " + self.method
+    @property
+    def data(self):
+        # None when there is no JSON body, or it could not be parsed
+        if self._data is _unset:
+            self._data = self._load_data()
+        return self._data
 
-        log_message += " received: \n" + json.dumps(str(self), indent=2)
-        logger.debug(log_message)
+    def _load_headers(self):
+        return dict(self._request.headers)
+
+    def _load_data(self):
+        return self._request.get_json(silent=True)
 
     def to_json(self):
 
@@ -91,6 +105,7 @@ class RESTContext:
             'host_url': self.host_url,
             'order_by': self.order_by,
             'fields': self.fields,
+            'cursor': self.cursor,
             'data': self.data}
 
         return result
@@ -110,6 +125,18 @@ class RESTContext:
         return args, val
 
 
+def get_context(request_context):
+    """
+
+    :param request_context: The Flask request.
+    :return: The RESTContext of the current request, built on first use. Routes and the after_request hook share it.
+    """
+    inputs = g.get("rest_context")
+    if inputs is None:
+        inputs = g.rest_context = RESTContext(request_context)
+    return inputs
+
+
 
 
 
@@ -121,6 +148,10 @@ class RESTContext:
 
 
 def log_response(method, status, data, txt):
+    # Building the message costs more than the rest of a cached request, skip it unless it is logged
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+
     msg = {
         "method": method,
         "status": status,
@@ -132,6 +163,8 @@ def log_response(method, status, data, txt):
 
 
 def log_request(method_name, request_context):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
 
     info = {
         "method_name": method_name,
@@ -142,6 +175,145 @@ def log_request(method_name, request_context):
     logger.debug(str(datetime.now()) + ": \n" + msg)
 
 
+_default_cursor_secret = "friends-service-cursor"
+
+
+def check_cursor_secret():
+    """
+    Logs a warning when CURSOR_SECRET is unset. Cursors are then signed with a secret anyone can read in the
+    source, so they can be forged. Called once at startup.
+
+    :return: True if CURSOR_SECRET is set.
+    """
+    if os.environ.get("CURSOR_SECRET"):
+        return True
+    logger.warning("CURSOR_SECRET is not set, pagination cursors are signed with the public default secret")
+    return False
+
+
+def _cursor_serializer():
+    secret = os.environ.get("CURSOR_SECRET") or _default_cursor_secret
+    return URLSafeSerializer(secret, salt="pagination-cursor")
+
+
+def encode_cursor(data):
+    """
+
+    :param data: Dictionary describing a position in a list, e.g. {"after": "user_id"}.
+    :return: Opaque, signed token safe to put in a URL.
+    """
+    return _cursor_serializer().dumps(data)
+
+
+def decode_cursor(token):
+    """
+
+    :param token: Token created by encode_cursor. An empty token means the first page.
+    :return: The dictionary passed to encode_cursor.
+    :raises ValueError: if the token was not created by this service.
+    """
+    if not token:
+        return {}
+    try:
+        return _cursor_serializer().loads(token)
+    except BadSignature:
+        raise ValueError("Invalid cursor")
+
+
+def make_etag(*versions):
+    """
+
+    :param versions: Relationship versions the response depends on.
+    :return: Weak ETag header value, e.g. W/"12", or None if any version is None.
+    """
+    if any(v is None for v in versions):
+        return None
+    return 'W/"{}"'.format(".".join(str(v) for v in versions))
+
+
+def etag_matches(headers, etag):
+    """
+
+    :param headers: Request headers, in any case.
+    :return: True if If-None-Match lists etag, compared weakly as RFC 7232 requires, or is *.
+    """
+    if etag is None:
+        return False
+    header = next((v for k, v in headers.items() if k.lower() == "if-none-match"), None)
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == opaque:
+            return True
+    return False
+
+
+def iter_ndjson(lines):
+    """
+
+    :param lines: Iterable of NDJSON lines (bytes or str), e.g. a file or request stream.
+    :return: Generator of the decoded values, skipping blank lines. Raises ValueError, naming the line, on a
+        malformed line.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError("Line {}: {}".format(number, e))
+
+
+def to_ndjson(records):
+    """
+
+    :param records: Iterable of JSON serializable values.
+    :return: Generator of NDJSON lines.
+    """
+    for record in records:
+        yield json.dumps(record, default=str) + "\n"
+
+
+def to_gzip(chunks):
+    """
+
+    :param chunks: Iterable of str or bytes.
+    :return: Generator of gzip compressed bytes, produced incrementally.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_ids(values, key):
+    """
+
+    :param values: Iterable of ids, or of dictionaries holding the id under key.
+    :return: Generator of ids.
+    """
+    if not isinstance(values, list) and not hasattr(values, "__next__"):
+        raise ValueError("Expected a list of ids")
+    for v in values:
+        if isinstance(v, dict):
+            if key not in v:
+                raise ValueError("Missing {}".format(key))
+            v = v[key]
+        if v is None or isinstance(v, (dict, list)):
+            raise ValueError("Invalid id: {}".format(v))
+        yield v
+
+
 def split_key_string(s):
 
     result = s.split("_")